@@ -1,3 +1,7 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import AliExpressToken, CatalogProduct, FeedCrawl
+
+admin.site.register(AliExpressToken)
+admin.site.register(CatalogProduct)
+admin.site.register(FeedCrawl)
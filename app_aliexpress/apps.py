@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class AppAliexpressConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'app_aliexpress'
+
+    def ready(self):
+        from . import metrics  # pylint: disable=C0415,W0611
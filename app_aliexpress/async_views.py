@@ -0,0 +1,406 @@
+"""Async AliExpress views, served on the event loop when running under core/asgi.py."""
+import asyncio
+from functools import wraps
+import logging
+
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+from django.shortcuts import redirect, render
+
+from core.profiling import phase
+
+from .cache import (
+    ALIEXPRESS_FEED_PAGE_TTL,
+    ALIEXPRESS_TEXT_SEARCH_TTL,
+    AsyncSingleFlight,
+    feed_page_cache,
+    image_search_cache,
+    product_cache_key,
+    product_detail_cache,
+    request_cache_key,
+    text_search_cache,
+)
+from .catalog import (
+    record_image_search,
+    record_product_detail,
+    record_recommend_feed,
+    record_text_search,
+)
+from .client import AliExpressAPIError, get_async_client
+from .conditional import (
+    alast_changed,
+    content_hash,
+    fragment_context,
+    not_modified,
+    page_etag,
+    set_validators,
+)
+from .imagehash import image_fingerprint
+from .tokens import get_access_token
+from .views import (
+    ALIEXPRESS_FREIGHT_COUNTRIES,
+    ALIEXPRESS_SHIP_COUNTRY,
+    ALIEXPRESS_TARGET_CURRENCY,
+    apply_freight_matrix,
+    check_aliexpress_token,
+    freight_matrix_complete,
+    freight_query_params,
+    freights_from_response,
+    image_search_context,
+    image_search_params,
+    image_search_scope,
+    prepare_static_fields,
+    product_detail_params,
+    product_from_response,
+    prefetch_recommend_feed_page,
+    product_skus,
+    recommend_feed_context,
+    recommend_feed_params,
+    reduce_image_size,
+    text_search_context,
+    text_search_params,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def _in_pool(func):
+    """``func`` as a coroutine run on any executor thread, not the one thread-sensitive thread.
+
+    The connections it opens are closed afterwards, as ``request_finished``
+    does for the request's own thread.
+    """
+    def call(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+
+    return sync_to_async(call, thread_sensitive=False)
+
+
+# Templates touch request.user, which hits the database, so rendering runs off the loop
+_render_in_thread = _in_pool(render)
+
+
+async def _render(request, template_name, context=None):
+    with phase("template render"):
+        return await _render_in_thread(request, template_name, context)
+
+
+async def _conditional_render(request, template_name, context):
+    """Async counterpart of ``conditional_render``."""
+    fragment_key = content_hash(context)
+    etag = page_etag(request, fragment_key)
+    last_modified = await alast_changed(request, fragment_key)
+    response = not_modified(request, etag, last_modified)
+    if response is None:
+        response = await _render(request, template_name, fragment_context(context, fragment_key))
+    return set_validators(response, etag, last_modified)
+
+
+_cache_get = sync_to_async(product_detail_cache.get, thread_sensitive=False)
+_cache_get_static = sync_to_async(product_detail_cache.get_static, thread_sensitive=False)
+_cache_set = sync_to_async(product_detail_cache.set, thread_sensitive=False)
+
+_product_detail_flight = AsyncSingleFlight()
+_feed_page_flight = AsyncSingleFlight()
+_text_search_flight = AsyncSingleFlight()
+
+
+def async_token_required(view_func):
+    """Async counterpart of ``token_required``."""
+    @wraps(view_func)
+    async def _wrapped_view(request, *args, **kwargs):
+        token_response = await _check_aliexpress_token(request)
+        if token_response is not None:
+            return token_response
+        return await view_func(request, *args, **kwargs)
+
+    return _wrapped_view
+
+
+# Both may read the session or the token row from the database
+_check_aliexpress_token = _in_pool(check_aliexpress_token)
+_get_access_token = _in_pool(get_access_token)
+
+# Catalog writes stay on the single thread-sensitive thread on purpose: SQLite
+# takes one writer at a time and the FTS triggers run inside each write, so
+# spreading them over pool threads only turns queueing into "database is
+# locked" errors.
+_record_product_detail = sync_to_async(record_product_detail)
+_record_recommend_feed = sync_to_async(record_recommend_feed)
+_record_text_search = sync_to_async(record_text_search)
+_record_image_search = sync_to_async(record_image_search)
+
+
+async def shipping_aliexpress_async(access_token, product_id, sku_id,
+                                    ship_to_country=ALIEXPRESS_SHIP_COUNTRY):
+    """Async counterpart of ``shipping_aliexpress``."""
+    try:
+        response = await get_async_client().execute(
+            'aliexpress.ds.freight.query',
+            freight_query_params(product_id, sku_id, ship_to_country),
+            access_token,
+        )
+        return freights_from_response(response)
+    except ValueError as ve:  # More specific exception
+        logger.exception("ValueError during freight query: %s", ve)
+        return {"error": "Internal error processing request."}
+
+
+async def freight_matrix_aliexpress_async(access_token, product_id, sku_ids, countries=None):
+    """Quote freight for every SKU and country concurrently on the event loop."""
+    if countries is None:
+        countries = [ALIEXPRESS_SHIP_COUNTRY, *ALIEXPRESS_FREIGHT_COUNTRIES]
+    pairs = [(country, sku_id) for country in dict.fromkeys(countries) for sku_id in sku_ids]
+    results = await asyncio.gather(*(
+        shipping_aliexpress_async(access_token, product_id, sku_id, country)
+        for country, sku_id in pairs
+    ))
+    matrix = {}
+    for (country, sku_id), options in zip(pairs, results):
+        matrix.setdefault(country, {})[sku_id] = options
+    return matrix
+
+
+async def fetch_aliexpress_product_detail_async(access_token, product_id):
+    """Async counterpart of ``fetch_aliexpress_product_detail``."""
+    key = product_cache_key(product_id, ALIEXPRESS_TARGET_CURRENCY, ALIEXPRESS_SHIP_COUNTRY)
+    cached = await _cache_get(key)
+    if cached is not None:
+        return cached
+
+    return await _product_detail_flight.do(
+        key, lambda: _load_aliexpress_product_detail_async(access_token, product_id, key)
+    )
+
+
+async def _load_aliexpress_product_detail_async(access_token, product_id, key):
+    """Fetches product details from AliExpress API and caches the result."""
+    try:
+        response_data = await get_async_client().execute(
+            "aliexpress.ds.product.get", product_detail_params(product_id), access_token
+        )
+    except ValueError as ve:  # More specific exception
+        stale = await sync_to_async(product_detail_cache.get_stale, thread_sensitive=False)(key)
+        if stale is not None:
+            logger.warning("Serving stale product %s: %s", product_id, ve)
+            return stale
+        logger.exception("ValueError during product fetch: %s", ve)
+        return None, "Internal error processing the request."
+
+    product, error = product_from_response(response_data)
+    if error:
+        return None, error
+
+    # Quote freight on the loop while the description is processed in a thread
+    skus = product_skus(product)
+    freight_task = asyncio.ensure_future(
+        freight_matrix_aliexpress_async(access_token, product_id, [sku["sku_id"] for sku in skus])
+    )
+    static = await _cache_get_static(key)
+    error = await sync_to_async(prepare_static_fields, thread_sensitive=False)(product, static)
+    if error:
+        freight_task.cancel()
+        return None, error
+
+    await _record_product_detail(product_id, product)
+    freights = apply_freight_matrix(product, skus, await freight_task)
+
+    # Only cache complete answers; a failed quote is an error dict
+    if freight_matrix_complete(product["freight_matrix"]):
+        await _cache_set(key, product, freights, static_fresh=static is None)
+
+    return product, freights
+
+
+@async_token_required
+async def product_detail_aliexpress_async(request, product_id):
+    """Async counterpart of ``product_detail_aliexpress``."""
+    access_token = await _get_access_token()
+    if not access_token:
+        return await _render(request, "app_aliexpress/aliexpress_product_detail.html", \
+            {"error": "Access token missing."})
+
+    product, freights_or_error = await fetch_aliexpress_product_detail_async(
+        access_token, product_id
+    )
+
+    if isinstance(freights_or_error, str):
+        return await _render(request, "app_aliexpress/aliexpress_product_detail.html", \
+            {"error": freights_or_error})
+
+    if product is None:
+        return await _render(request, "app_aliexpress/aliexpress_product_detail.html", \
+                             {"error": "Failed to retrieve product details."})
+
+    return await _conditional_render(
+        request,
+        "app_aliexpress/aliexpress_product_detail.html",
+        {"product": product, "freights": freights_or_error, "product_id": product_id},
+    )
+
+
+async def fetch_recommend_feed_page_async(feed_name, page_no, page_size=50):
+    """Async counterpart of ``fetch_recommend_feed_page``."""
+    params = recommend_feed_params(feed_name, page_no, page_size)
+    key = request_cache_key(params)
+    response = await sync_to_async(feed_page_cache.get, thread_sensitive=False)(key)
+    if response is None:
+        response = await _feed_page_flight.do(
+            key, lambda: _load_recommend_feed_page_async(key, params)
+        )
+    return response
+
+
+async def _load_recommend_feed_page_async(key, params):
+    """Fetches a recommend feed page and caches it when it has results."""
+    try:
+        response = await get_async_client().execute('aliexpress.ds.recommend.feed.get', params)
+    except AliExpressAPIError:
+        stale = await sync_to_async(feed_page_cache.get_stale, thread_sensitive=False)(key)
+        if stale is None:
+            raise
+        logger.warning("Serving stale feed page %s of %s", params['page_no'], params['feed_name'])
+        return stale
+    if response.get('aliexpress_ds_recommend_feed_get_response', {}).get('result'):
+        await sync_to_async(feed_page_cache.set, thread_sensitive=False)(
+            key, response, ALIEXPRESS_FEED_PAGE_TTL
+        )
+        await _record_recommend_feed(response)
+    return response
+
+
+async def recommend_feed_aliexpress_async(request, feed_name):
+    """Async counterpart of ``recommend_feed_aliexpress``."""
+    page_no = int(request.GET.get("page", 1))
+    page_size = 50
+
+    try:
+        response = await fetch_recommend_feed_page_async(feed_name, page_no, page_size)
+        template, context = recommend_feed_context(response, feed_name, page_no, page_size)
+        # Users page linearly: fetch the next page while this one renders
+        if "products" in context and page_no < context["total_pages"]:
+            await sync_to_async(prefetch_recommend_feed_page, thread_sensitive=False)(
+                feed_name, page_no + 1, page_size
+            )
+        if "products" in context:
+            return await _conditional_render(request, template, context)
+        return await _render(request, template, context)
+
+    except ValueError as ve:  # More specific exception
+        logger.exception("ValueError during recommend feed: %s", ve)
+        return redirect(
+                "/aliexpress/dashboard/",
+                {"error": "Internal error processing request."}
+        )
+
+
+async def fetch_text_search_page_async(keyword, page_index, page_size, access_token):
+    """Async counterpart of ``fetch_text_search_page``."""
+    params = text_search_params(keyword, page_index, page_size)
+    key = request_cache_key(params)
+    response = await sync_to_async(text_search_cache.get, thread_sensitive=False)(key)
+    if response is None:
+        response = await _text_search_flight.do(
+            key, lambda: _load_text_search_page_async(key, params, access_token)
+        )
+    return response
+
+
+async def _load_text_search_page_async(key, params, access_token):
+    """Runs a text search and caches the response when it has products."""
+    try:
+        response = await get_async_client().execute(
+            'aliexpress.ds.text.search', params, access_token
+        )
+    except AliExpressAPIError:
+        stale = await sync_to_async(text_search_cache.get_stale, thread_sensitive=False)(key)
+        if stale is None:
+            raise
+        logger.warning("Serving stale text search for %r", params['keyWord'])
+        return stale
+    if response.get('aliexpress_ds_text_search_response', {}).get('data', {}) \
+            .get('products') is not None:
+        await sync_to_async(text_search_cache.set, thread_sensitive=False)(
+            key, response, ALIEXPRESS_TEXT_SEARCH_TTL
+        )
+        await _record_text_search(response)
+    return response
+
+
+@async_token_required
+async def text_search_aliexpress_async(request):
+    """Async counterpart of ``text_search_aliexpress``."""
+    keyword = request.GET.get('keyword', '')
+    page_index = request.GET.get('page', '1')
+    page_size = '20'  # Default page size
+    current_page = int(request.GET.get('page', 1))
+
+    try:
+        response = await fetch_text_search_page_async(
+            keyword, page_index, page_size, await _get_access_token()
+        )
+        context = text_search_context(response, keyword, current_page, page_size)
+        if "error" in context:
+            return await _render(request, "app_aliexpress/aliexpress_text_search.html", context)
+        return await _conditional_render(
+            request, "app_aliexpress/aliexpress_text_search.html", context
+        )
+    except ValueError as ve:  # More specific exception
+        logger.exception("ValueError during text search: %s", ve)
+        return redirect(
+                "/aliexpress/dashboard/",
+                {"error": "Internal error processing request."}
+        )
+
+
+@async_token_required
+async def aliexpress_image_search_async(request):
+    """Async counterpart of ``aliexpress_image_search``."""
+    if request.method == "POST" and 'image_file' in request.FILES:
+        image_file = request.FILES['image_file']
+        if not image_file:
+            return await _render(request, "app_aliexpress/aliexpress_image_search.html", \
+                {"error": "Please provide an image."})
+
+        try:
+            # Image decoding and encoding are CPU-bound; keep them off the event loop
+            fingerprint = await sync_to_async(image_fingerprint, thread_sensitive=False)(
+                image_file
+            )
+            scope = image_search_scope()
+            products = await sync_to_async(image_search_cache.get, thread_sensitive=False)(
+                scope, fingerprint
+            )
+            if products is not None:
+                return await _render(request, "app_aliexpress/aliexpress_image_search.html", \
+                    {"products": products})
+
+            reduced_image = await sync_to_async(reduce_image_size, thread_sensitive=False)(
+                image_file
+            )
+            response = await get_async_client().execute(
+                'aliexpress.ds.image.searchV2',
+                image_search_params(reduced_image),
+                await _get_access_token(),
+            )
+            context = image_search_context(response)
+            if "products" in context:
+                await sync_to_async(image_search_cache.set, thread_sensitive=False)(
+                    scope, fingerprint, context["products"]
+                )
+                await _record_image_search(context["products"])
+            return await _render(request, "app_aliexpress/aliexpress_image_search.html", \
+                context)
+
+        except ValueError as ve:  # More specific exception
+            logger.exception("ValueError during image search: %s", ve)
+            return redirect(
+                    "/aliexpress/dashboard/",
+                    {"error": "Internal error processing request."}
+            )
+    else:
+        return await _render(request, "app_aliexpress/aliexpress_image_search.html", \
+            {"results": ""})
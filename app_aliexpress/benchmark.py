@@ -0,0 +1,449 @@
+"""Stand-in AliExpress and Shopify servers for the offline benchmarks.
+
+Free of Django imports on purpose: ``start_server`` runs each stand-in in a
+child process, so generating and sending payloads does not compete with the
+views under test for the GIL.
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import math
+import multiprocessing
+import random
+import re
+import threading
+import time
+from urllib.parse import parse_qs
+from urllib.request import urlopen
+
+IMAGE_URL = "https://ae01.alicdn.com/kf/S{:032x}.jpg"
+
+STATS_PATH = "/__stats"
+
+
+def sample_description(target_kb, seed=0):
+    """Build an AliExpress-like description of about ``target_kb`` kilobytes.
+
+    Mirrors what ``ae_item_base_info_dto.detail`` usually holds: nested
+    layout tables with inline styles, spec rows and sized <img> tags.
+    """
+    rng = random.Random(seed)
+    parts = ['<div class="detailmodule_html"><div class="detail-desc-decorate-richtext">']
+    size = 0
+    while size < target_kb * 1024:
+        block = (
+            '<table style="width:750px;border-collapse:collapse" cellpadding="0">'
+            '<tbody><tr><td style="padding:4px;font-family:Arial">'
+            f'<p><span style="font-size:14px"><strong>Spec {rng.randint(1, 999)}:</strong> '
+            f'{"Material: aluminium alloy &amp; ABS. " * rng.randint(1, 4)}</span></p>'
+            '<table><tr>'
+            + "".join(
+                f'<td><img src="{IMAGE_URL.format(rng.getrandbits(128))}" '
+                f'width="{rng.choice((750, 790, 800))}" height="{rng.randint(300, 1200)}" '
+                'class="detail-desc-decorate-image" slate-data-type="image"></td>'
+                for _ in range(rng.randint(1, 3))
+            )
+            + "</tr></table></td></tr></tbody></table>"
+        )
+        parts.append(block)
+        size += len(block)
+    parts.append("</div></div>")
+    return "".join(parts)
+
+
+def _price(rng):
+    return f"{rng.uniform(1, 200):.2f}"
+
+
+def product_get_payload(product_id, skus=6, images=8, description_kb=100):
+    """aliexpress.ds.product.get response for ``product_id``."""
+    rng = random.Random(product_id)
+    # A handful of descriptions keeps generation cheap without every product sharing one
+    detail = sample_description(description_kb, seed=product_id % 16)
+    return {"aliexpress_ds_product_get_response": {"rsp_code": 200, "result": {
+        "ae_item_base_info_dto": {
+            "product_id": product_id,
+            "subject": f"Bench product {product_id} aluminium phone stand",
+            "detail": detail,
+            "category_id": rng.randint(100, 999),
+            "currency_code": "USD",
+            "product_status_type": "onSelling",
+            "avg_evaluation_rating": f"{rng.uniform(3, 5):.1f}",
+            "evaluation_count": rng.randint(0, 5000),
+            "sales_count": rng.randint(0, 20000),
+        },
+        "ae_multimedia_info_dto": {
+            "image_urls": ";".join(IMAGE_URL.format(rng.getrandbits(128)) for _ in range(images)),
+        },
+        "ae_item_sku_info_dtos": {"ae_item_sku_info_d_t_o": [
+            {
+                "sku_id": f"{product_id}{index:02d}",
+                "sku_code": f"BENCH-{product_id}-{index}",
+                "offer_sale_price": _price(rng),
+                "sku_price": _price(rng),
+                "sku_available_stock": rng.randint(0, 999),
+                "currency_code": "USD",
+                "ae_sku_property_dtos": {"ae_sku_property_d_t_o": [{
+                    "sku_property_value": f"Color {index}",
+                    "property_value_definition_name": f"Variant {index}",
+                    "sku_image": IMAGE_URL.format(rng.getrandbits(128)),
+                }]},
+            }
+            for index in range(skus)
+        ]},
+        "ae_store_info": {
+            "store_name": "Bench Store",
+            "item_as_described_rating": "4.8",
+            "communication_rating": "4.9",
+            "shipping_speed_rating": "4.7",
+        },
+        "package_info_dto": {
+            "gross_weight": "0.250", "package_height": 5, "package_length": 20,
+            "package_width": 10,
+        },
+        "logistics_info_dto": {"delivery_time": 7, "ship_to_country": "BR"},
+    }}}
+
+
+def freight_query_payload(options=3):
+    """aliexpress.ds.freight.query response with ``options`` delivery options."""
+    return {"aliexpress_ds_freight_query_response": {"result": {
+        "code": 200,
+        "delivery_options": {"delivery_option_d_t_o": [
+            {
+                "code": f"CAINIAO_{index}",
+                "company": f"Cainiao {index}",
+                "shipping_fee_format": f"US ${index * 1.5:.2f}",
+                "free_shipping": index == 0,
+                "free_shipping_threshold": "10.00",
+                "min_delivery_days": 7 + index * 3,
+                "max_delivery_days": 15 + index * 5,
+                "guaranteed_delivery_days": 30,
+                "delivery_date_desc": "Estimated delivery in 2 weeks",
+                "tracking": True,
+            }
+            for index in range(options)
+        ]},
+    }}}
+
+
+def _listing(rng, product_id):
+    return {
+        "product_id": product_id,
+        "product_title": f"Bench listing {product_id} wireless earbuds",
+        "product_main_image_url": IMAGE_URL.format(rng.getrandbits(128)),
+        "product_detail_url": f"https://www.aliexpress.com/item/{product_id}.html",
+        "target_sale_price": _price(rng),
+        "target_sale_price_currency": "USD",
+        "target_original_price_currency": "USD",
+        "sale_price": _price(rng),
+        "discount": f"{rng.randint(0, 70)}%",
+        "evaluate_rate": f"{rng.uniform(80, 100):.1f}%",
+        "lastest_volume": rng.randint(0, 10000),
+        "first_level_category_id": rng.randint(100, 999),
+        "first_level_category_name": "Consumer Electronics",
+        "first_level_category_title": "Consumer Electronics",
+        "second_level_category_id": rng.randint(1000, 9999),
+        "second_level_category_name": "Earphones",
+    }
+
+
+def recommend_feed_payload(feed_name, page_no, page_size, total=5000):
+    """aliexpress.ds.recommend.feed.get response for one page."""
+    rng = random.Random(f"{feed_name}:{page_no}")
+    first = 1005000000000000 + page_no * page_size
+    return {"aliexpress_ds_recommend_feed_get_response": {"result": {
+        "total_record_count": total,
+        "is_finished": page_no * page_size >= total,
+        "products": {"traffic_product_d_t_o": [
+            _listing(rng, first + index) for index in range(page_size)
+        ]},
+    }}}
+
+
+def image_search_payload(seed, results=20):
+    """aliexpress.ds.image.searchV2 response with ``results`` products."""
+    rng = random.Random(seed)
+    first = 1006000000000000 + rng.randrange(10 ** 6) * results
+    return {"aliexpress_ds_image_searchV2_response": {"result": {"data": {"data": [
+        _listing(rng, first + index) for index in range(results)
+    ]}}}}
+
+
+def text_search_payload(keyword, page_index, page_size, total=1000):
+    """aliexpress.ds.text.search response for one page."""
+    rng = random.Random(f"{keyword}:{page_index}")
+    first = 1007000000000000 + rng.randrange(10 ** 6) * page_size
+    return {"aliexpress_ds_text_search_response": {"data": {
+        "totalCount": total,
+        "products": {"selection_search_product": [
+            {
+                "itemId": first + index,
+                "title": f"{keyword} bench result {index}",
+                "itemMainPic": IMAGE_URL.format(rng.getrandbits(128)),
+                "itemUrl": f"https://www.aliexpress.com/item/{first + index}.html",
+                "salePrice": _price(rng),
+                "salePriceFormat": f"US ${_price(rng)}",
+                "salePriceCurrency": "USD",
+                "originalPrice": _price(rng),
+                "originalPriceCurrency": "USD",
+                "discount": f"{rng.randint(0, 70)}%",
+                "score": f"{rng.uniform(3, 5):.1f}",
+                "evaluateRate": f"{rng.uniform(80, 100):.1f}",
+                "orders": rng.randint(0, 10000),
+                "cateId": f"{rng.randint(100, 999)},{rng.randint(1000, 9999)}",
+            }
+            for index in range(page_size)
+        ]},
+    }}}
+
+
+def shopify_products_payload(count, description_kb=2, page=1, pages=1):
+    """Shopify GraphQL ``products`` connection: page ``page`` of ``pages``, ``count`` nodes each."""
+    # ``description`` is plain text, cut by Shopify to the requested length
+    description = " ".join(re.sub(r"<[^>]+>", " ", sample_description(description_kb, seed=count))
+                           .split())[:160]
+    first = (page - 1) * count
+    return {"data": {"products": {
+        "pageInfo": {
+            "hasNextPage": page < pages,
+            "hasPreviousPage": page > 1,
+            "startCursor": f"cursor-{page}-start",
+            "endCursor": f"cursor-{page}-end",
+        },
+        "nodes": [
+            {
+                "id": f"gid://shopify/Product/{first + index + 1}",
+                "title": f"Bench Shopify product {first + index + 1}",
+                "description": description,
+                "status": "ACTIVE",
+                "priceRangeV2": {"minVariantPrice": {"amount": "19.9"}},
+            }
+            for index in range(count)
+        ],
+    }}}
+
+
+class StandInServer(ThreadingHTTPServer):
+    """Threaded HTTP server answering with canned payloads after a simulated delay.
+
+    Args:
+        address: ``(host, port)`` to bind
+        options: Latency, error rate and payload size settings; see ``respond``
+            of the subclasses for the payload keys they read
+    """
+
+    daemon_threads = True
+    request_queue_size = 512
+    # Generated payloads are kept per request key; the cap bounds the memory of long runs
+    max_cached_payloads = 4096
+
+    def __init__(self, address, options):
+        super().__init__(address, _Handler)
+        self.options = options
+        self.counts = {}
+        self._payloads = {}
+        self._lock = threading.Lock()
+        self._rng = random.Random(options.get("seed", 0))
+
+    def delay(self):
+        """Seconds to wait before answering: log-normal around the median latency."""
+        median = self.options.get("latency_ms", 0) / 1000
+        if median <= 0:
+            return 0.0
+        with self._lock:
+            return median * math.exp(self._rng.gauss(0, self.options.get("jitter", 0.5)))
+
+    def fails(self):
+        """Whether this answer is an injected 503."""
+        with self._lock:
+            return self._rng.random() < self.options.get("error_rate", 0)
+
+    def count(self, name):
+        """Count one request to the stand-in method ``name``."""
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+    def cached(self, key, build):
+        """Encoded JSON payload of ``key``, built on first use."""
+        body = self._payloads.get(key)
+        if body is None:
+            body = json.dumps(build()).encode()
+            with self._lock:
+                if len(self._payloads) >= self.max_cached_payloads:
+                    self._payloads.clear()
+                self._payloads[key] = body
+        return body
+
+    def respond(self, method, path, body):
+        """Return ``(counted name, JSON bytes)`` for a request."""
+        raise NotImplementedError
+
+
+class AliExpressStandIn(StandInServer):
+    """Answers /sync calls of the AliExpress methods the views use.
+
+    Payload options: ``skus``, ``images``, ``description_kb``, ``freight_options``
+    and ``image_results``; search and feed pages follow the requested page size.
+    """
+
+    def respond(self, method, path, body):
+        params = {key: values[0] for key, values in parse_qs(body.decode()).items()}
+        name = params.get("method", path)
+        options = self.options
+        if name == "aliexpress.ds.product.get":
+            product_id = int(params.get("product_id", 0))
+            return name, self.cached((name, product_id), lambda: product_get_payload(
+                product_id, options.get("skus", 6), options.get("images", 8),
+                options.get("description_kb", 100),
+            ))
+        if name == "aliexpress.ds.freight.query":
+            return name, self.cached(name, lambda: freight_query_payload(
+                options.get("freight_options", 3)
+            ))
+        if name == "aliexpress.ds.text.search":
+            keyword, page = params.get("keyWord", ""), int(params.get("pageIndex", 1))
+            page_size = int(params.get("pageSize", 20))
+            return name, self.cached((name, keyword, page, page_size),
+                                     lambda: text_search_payload(keyword, page, page_size))
+        if name == "aliexpress.ds.recommend.feed.get":
+            feed, page = params.get("feed_name", ""), int(params.get("page_no", 1))
+            page_size = int(params.get("page_size", 50))
+            return name, self.cached((name, feed, page, page_size),
+                                     lambda: recommend_feed_payload(feed, page, page_size))
+        if name == "aliexpress.ds.image.searchV2":
+            # Only the size of the upload varies between calls worth caching
+            seed = len(params.get("param0", ""))
+            return name, self.cached((name, seed), lambda: image_search_payload(
+                seed, options.get("image_results", 20)
+            ))
+        return name, json.dumps({"error_response": {
+            "code": "InvalidApiName", "msg": f"{name} is not simulated",
+        }}).encode()
+
+
+class ShopifyStandIn(StandInServer):
+    """Answers the Admin API GraphQL endpoint.
+
+    The products query, the product and variant create mutations and the
+    location lookup are told apart by the operation in the document.
+    Payload options: ``products`` nodes per products page, their
+    ``description_kb`` and the number of ``pages``.
+    """
+
+    _mutation = re.compile(r"\b(productCreate|productVariantsBulkCreate)\(")
+
+    def __init__(self, address, options):
+        super().__init__(address, options)
+        self._next_id = 1
+
+    def new_id(self):
+        """Next id given to a created resource."""
+        with self._lock:
+            self._next_id += 1
+            return self._next_id
+
+    def respond(self, method, path, body):
+        if not path.endswith("/graphql.json"):
+            return f"{method} {path}", json.dumps({"errors": "Not Found"}).encode()
+        request = json.loads(body or b"{}")
+        query, variables = request.get("query", ""), request.get("variables") or {}
+        match = self._mutation.search(query)
+        if match and match.group(1) == "productCreate":
+            return "graphql.productCreate", json.dumps({"data": {"productCreate": {
+                "product": {"id": f"gid://shopify/Product/{self.new_id()}"},
+                "userErrors": [],
+            }}}).encode()
+        if match:
+            return "graphql.productVariantsBulkCreate", json.dumps({"data": {
+                "productVariantsBulkCreate": {
+                    "productVariants": [
+                        {"id": f"gid://shopify/ProductVariant/{self.new_id()}",
+                         "sku": variant.get("inventoryItem", {}).get("sku", "")}
+                        for variant in variables.get("variants", [])
+                    ],
+                    "userErrors": [],
+                }
+            }}).encode()
+        if "locations(" in query:
+            return "graphql.locations", json.dumps({"data": {"locations": {"edges": [
+                {"node": {"id": "gid://shopify/Location/1"}}
+            ]}}}).encode()
+        # Cursors look like "cursor-<page>-end"; paging back is not simulated
+        after = variables.get("after") or ""
+        page = int(after.split("-")[1]) + 1 if after.startswith("cursor-") else 1
+        return "graphql.products", self.cached(f"graphql.products.{page}", lambda: (
+            shopify_products_payload(
+                self.options.get("products", 10), self.options.get("description_kb", 2),
+                page, self.options.get("pages", 1),
+            )
+        ))
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # Keep-alive, so the clients' connection pools behave as they do in production
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):  # pylint: disable=W0622
+        pass
+
+    def _send(self, status, body):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):  # pylint: disable=C0103
+        """Serve the request counters, or a request like any other."""
+        if self.path == STATS_PATH:
+            with self.server._lock:  # pylint: disable=W0212
+                counts = dict(self.server.counts)
+            self._send(200, json.dumps(counts).encode())
+            return
+        self._answer("GET")
+
+    def do_POST(self):  # pylint: disable=C0103
+        """Answer a simulated API call."""
+        self._answer("POST")
+
+    def do_PUT(self):  # pylint: disable=C0103
+        """Answer a simulated API call."""
+        self._answer("PUT")
+
+    def _answer(self, method):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        name, payload = self.server.respond(method, self.path, body)
+        self.server.count(name)
+        time.sleep(self.server.delay())
+        if self.server.fails():
+            self._send(503, b'{"error": "injected failure"}')
+        else:
+            self._send(200, payload)
+
+
+def _serve(server_class, options, conn):
+    server = server_class(("127.0.0.1", 0), options)
+    conn.send(server.server_address[1])
+    conn.close()
+    server.serve_forever()
+
+
+def start_server(server_class, options):
+    """Run a stand-in server in a child process.
+
+    Returns:
+        tuple: ``(process, base URL)``; terminate the process to stop it
+    """
+    context = multiprocessing.get_context("spawn")
+    parent, child = context.Pipe()
+    process = context.Process(target=_serve, args=(server_class, options, child), daemon=True)
+    process.start()
+    port = parent.recv()
+    return process, f"http://127.0.0.1:{port}"
+
+
+def server_counts(base_url):
+    """Requests served so far by the stand-in at ``base_url``, per method."""
+    with urlopen(base_url + STATS_PATH, timeout=5) as response:
+        return json.loads(response.read())
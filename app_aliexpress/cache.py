@@ -0,0 +1,432 @@
+"""In-process and shared caches for AliExpress API results."""
+import asyncio
+from collections import OrderedDict
+import hashlib
+import json
+import logging
+import threading
+import time
+import weakref
+
+from django.core.cache import cache as shared_cache
+from decouple import config
+
+from .imagehash import hamming_distance
+
+logger = logging.getLogger(__name__)
+
+ALIEXPRESS_PRODUCT_LRU_SIZE = config("ALIEXPRESS_PRODUCT_LRU_SIZE", default=512, cast=int)
+ALIEXPRESS_PRODUCT_VOLATILE_TTL = config("ALIEXPRESS_PRODUCT_VOLATILE_TTL", default=300, cast=int)
+ALIEXPRESS_PRODUCT_STATIC_TTL = config("ALIEXPRESS_PRODUCT_STATIC_TTL", default=86400, cast=int)
+ALIEXPRESS_IMAGE_SEARCH_CACHE_SIZE = config(
+    "ALIEXPRESS_IMAGE_SEARCH_CACHE_SIZE", default=512, cast=int
+)
+ALIEXPRESS_IMAGE_SEARCH_TTL = config("ALIEXPRESS_IMAGE_SEARCH_TTL", default=3600, cast=int)
+ALIEXPRESS_IMAGE_HASH_DISTANCE = config("ALIEXPRESS_IMAGE_HASH_DISTANCE", default=4, cast=int)
+ALIEXPRESS_FEED_PAGE_CACHE_SIZE = config("ALIEXPRESS_FEED_PAGE_CACHE_SIZE", default=256, cast=int)
+ALIEXPRESS_FEED_PAGE_TTL = config("ALIEXPRESS_FEED_PAGE_TTL", default=600, cast=int)
+ALIEXPRESS_TEXT_SEARCH_CACHE_SIZE = config(
+    "ALIEXPRESS_TEXT_SEARCH_CACHE_SIZE", default=1024, cast=int
+)
+ALIEXPRESS_TEXT_SEARCH_TTL = config("ALIEXPRESS_TEXT_SEARCH_TTL", default=300, cast=int)
+# How long past their TTL shared entries stay available to serve while the API is down
+ALIEXPRESS_STALE_TTL = config("ALIEXPRESS_STALE_TTL", default=86400, cast=int)
+
+# Price, stock, logistics and freight change often; everything else on a product
+# (description, images, store and package info) is cached with the long TTL.
+PRODUCT_VOLATILE_FIELDS = ("ae_item_sku_info_dtos", "logistics_info_dto", "freight_matrix")
+
+
+_stats_registry = {}
+
+
+class CacheStats:
+    """Hit and miss counters of one named cache."""
+
+    def __init__(self, name):
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self._lock = threading.Lock()
+        _stats_registry[name] = self
+
+    def record(self, hit):
+        """Count one lookup."""
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def record_stale(self):
+        """Count one expired entry served in place of a failed upstream call."""
+        with self._lock:
+            self.stale += 1
+
+    def as_dict(self):
+        """Counters and hit ratio as a plain dict."""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale": self.stale,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+        }
+
+
+def cache_stats():
+    """Counters of every cache in the process, keyed on cache name."""
+    return {name: stats.as_dict() for name, stats in sorted(_stats_registry.items())}
+
+
+def request_cache_key(params):
+    """Cache key over every parameter of an upstream request."""
+    return hashlib.sha1(json.dumps(params, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class LRUCache:
+    """Thread-safe LRU mapping whose entries expire after a per-entry TTL."""
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Return the live value for ``key`` or ``default``."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            expires_at, value = entry
+            if expires_at <= time.time():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None, expires_at=None):
+        """Store ``value`` until ``expires_at`` or for ``ttl`` seconds."""
+        if expires_at is None:
+            expires_at = time.time() + ttl
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        """Drop ``key`` if present."""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """Drop every entry."""
+        with self._lock:
+            self._data.clear()
+
+
+_MISSING = object()
+
+
+class TieredCache:
+    """Two-tier cache: a per-process LRU in front of the Django cache.
+
+    Values are stored in the shared tier together with their absolute expiry
+    so a process filling its LRU from the shared tier keeps the original
+    deadline instead of restarting the TTL. The shared tier keeps entries for
+    ``stale_ttl`` more seconds, for :meth:`get_stale`.
+    """
+
+    def __init__(self, prefix, maxsize=128, stale_ttl=ALIEXPRESS_STALE_TTL):
+        self.prefix = prefix
+        self.local = LRUCache(maxsize)
+        self.stale_ttl = stale_ttl
+        self.stats = CacheStats(prefix)
+
+    def _shared_key(self, key):
+        return f"{self.prefix}:{key}"
+
+    def get(self, key, default=None):
+        """Return the cached value from the fastest tier holding it."""
+        value = self.local.get(key, _MISSING)
+        if value is not _MISSING:
+            self.stats.record(True)
+            return value
+        entry = shared_cache.get(self._shared_key(key))
+        if entry is None or entry[0] <= time.time():
+            self.stats.record(False)
+            return default
+        expires_at, value = entry
+        self.local.set(key, value, expires_at=expires_at)
+        self.stats.record(True)
+        return value
+
+    def get_stale(self, key, default=None):
+        """Return the last stored value even if expired, for when the API is failing."""
+        entry = shared_cache.get(self._shared_key(key))
+        if entry is None:
+            return default
+        self.stats.record_stale()
+        return entry[1]
+
+    def set(self, key, value, ttl):
+        """Store ``value`` in both tiers for ``ttl`` seconds."""
+        expires_at = time.time() + ttl
+        self.local.set(key, value, expires_at=expires_at)
+        shared_cache.set(
+            self._shared_key(key), (expires_at, value), timeout=ttl + self.stale_ttl
+        )
+
+    def delete(self, key):
+        """Drop ``key`` from both tiers."""
+        self.local.delete(key)
+        shared_cache.delete(self._shared_key(key))
+
+
+class _Call:
+    """An in-flight call other threads can wait on."""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalesce concurrent calls for the same key into one execution."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        """Run ``fn`` once per key at a time; concurrent callers share its result."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as exc:
+            call.error = exc
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+
+class AsyncSingleFlight:
+    """asyncio counterpart of SingleFlight; coalesces calls per event loop."""
+
+    def __init__(self):
+        self._tasks = weakref.WeakKeyDictionary()
+
+    async def do(self, key, coro_fn):
+        """Await ``coro_fn()`` once per key at a time; concurrent callers share it."""
+        loop = asyncio.get_running_loop()
+        tasks = self._tasks.setdefault(loop, {})
+        task = tasks.get(key)
+        if task is None:
+            task = tasks[key] = loop.create_task(coro_fn())
+            task.add_done_callback(lambda _task: tasks.pop(key, None))
+        # A cancelled waiter must not cancel the call the others are sharing
+        return await asyncio.shield(task)
+
+
+class RefreshingValue:
+    """One shared value, reloaded in the background once it gets old.
+
+    Readers get the cached value immediately; when it is older than
+    ``refresh_after`` a single background reload is started, so the value
+    only has to be loaded inline on a cold cache or an explicit ``force``.
+
+    Args:
+        prefix: Shared cache key
+        loader: Callable returning the fresh value; may raise
+        ttl: Seconds the value stays in the cache at all
+        refresh_after: Age in seconds after which a background reload starts
+    """
+
+    def __init__(self, prefix, loader, ttl, refresh_after):
+        self.cache = TieredCache(prefix, maxsize=1)
+        self.loader = loader
+        self.ttl = ttl
+        self.refresh_after = refresh_after
+        self._flight = SingleFlight()
+        # Held while a background reload runs; taken without blocking, so
+        # checking and claiming it is one step
+        self._refreshing = threading.Lock()
+
+    def get(self, force=False):
+        """Return the cached value, loading it inline when missing or forced."""
+        entry = None if force else self.cache.get("value")
+        if entry is None:
+            return self._flight.do("load", self._load)[1]
+        loaded_at, value = entry
+        if time.time() - loaded_at > self.refresh_after:
+            self._refresh_in_background()
+        return value
+
+    def _load(self):
+        entry = (time.time(), self.loader())
+        self.cache.set("value", entry, self.ttl)
+        return entry
+
+    def _refresh_in_background(self):
+        if not self._refreshing.acquire(blocking=False):
+            return
+
+        def run():
+            try:
+                self._flight.do("load", self._load)
+            except Exception as exc: # pylint: disable=W0718
+                logger.exception("Background refresh of %s failed: %s", self.cache.prefix, exc)
+            finally:
+                self._refreshing.release()
+
+        threading.Thread(target=run, name=f"refresh-{self.cache.prefix}", daemon=True).start()
+
+
+def product_cache_key(product_id, target_currency, ship_to_country):
+    """Cache key for a product detail payload."""
+    return f"{product_id}:{target_currency}:{ship_to_country}"
+
+
+class ProductDetailCache:
+    """Product detail cache with separate TTLs for volatile and static fields.
+
+    A product is split into its volatile part (SKU prices and stock, logistics
+    and the freight quotes) and its static part (everything else, including
+    the processed description and image list).
+    """
+
+    def __init__(self, maxsize=ALIEXPRESS_PRODUCT_LRU_SIZE,
+                 volatile_ttl=ALIEXPRESS_PRODUCT_VOLATILE_TTL,
+                 static_ttl=ALIEXPRESS_PRODUCT_STATIC_TTL):
+        self.volatile = TieredCache("aliexpress:product:volatile", maxsize)
+        self.static = TieredCache("aliexpress:product:static", maxsize)
+        self.volatile_ttl = volatile_ttl
+        self.static_ttl = static_ttl
+
+    def get(self, key):
+        """Return ``(product, freights)`` when both parts are fresh, else None."""
+        volatile = self.volatile.get(key)
+        if volatile is None:
+            return None
+        static = self.get_static(key)
+        if static is None:
+            return None
+        fields, freights = volatile
+        return {**static, **fields}, freights
+
+    def get_static(self, key):
+        """Return the cached static fields of a product, or None."""
+        return self.static.get(key)
+
+    def get_stale(self, key):
+        """Return ``(product, freights)`` from expired entries, or None."""
+        volatile = self.volatile.get_stale(key)
+        static = self.static.get_stale(key) if volatile is not None else None
+        if static is None:
+            return None
+        fields, freights = volatile
+        return {**static, **fields}, freights
+
+    def set(self, key, product, freights, static_fresh=True):
+        """Cache a product; ``static_fresh=False`` keeps the static part's TTL."""
+        fields = {k: product[k] for k in PRODUCT_VOLATILE_FIELDS if k in product}
+        self.volatile.set(key, (fields, freights), self.volatile_ttl)
+        if static_fresh:
+            static = {k: v for k, v in product.items() if k not in PRODUCT_VOLATILE_FIELDS}
+            self.static.set(key, static, self.static_ttl)
+
+    def delete(self, key):
+        """Invalidate both parts of a product."""
+        self.volatile.delete(key)
+        self.static.delete(key)
+
+
+product_detail_cache = ProductDetailCache()
+product_detail_flight = SingleFlight()
+
+feed_page_cache = TieredCache("aliexpress:feed_page", ALIEXPRESS_FEED_PAGE_CACHE_SIZE)
+feed_page_flight = SingleFlight()
+
+text_search_cache = TieredCache("aliexpress:text_search", ALIEXPRESS_TEXT_SEARCH_CACHE_SIZE)
+text_search_flight = SingleFlight()
+
+
+class PerceptualHashCache:
+    """TTL cache keyed on ``(scope, perceptual hash)`` that also matches near-duplicates.
+
+    Exact hashes are shared through the Django cache; the near-duplicate scan
+    runs over this process's most recent entries.
+    """
+
+    def __init__(self, prefix, maxsize=ALIEXPRESS_IMAGE_SEARCH_CACHE_SIZE,
+                 ttl=ALIEXPRESS_IMAGE_SEARCH_TTL, max_distance=ALIEXPRESS_IMAGE_HASH_DISTANCE):
+        self.prefix = prefix
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_distance = max_distance
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = CacheStats(prefix)
+
+    def _shared_key(self, scope, image_hash):
+        return f"{self.prefix}:{scope}:{image_hash:016x}"
+
+    def get(self, scope, image_hash):
+        """Return the value of the closest live entry within ``max_distance``."""
+        now = time.time()
+        with self._lock:
+            best_key, best_distance = None, self.max_distance + 1
+            for key, (expires_at, _value) in self._entries.items():
+                if key[0] != scope or expires_at <= now:
+                    continue
+                distance = hamming_distance(key[1], image_hash)
+                if distance < best_distance:
+                    best_key, best_distance = key, distance
+                    if distance == 0:
+                        break
+            if best_key is not None:
+                self._entries.move_to_end(best_key)
+                self.stats.record(True)
+                return self._entries[best_key][1]
+
+        entry = shared_cache.get(self._shared_key(scope, image_hash))
+        if entry is None or entry[0] <= now:
+            self.stats.record(False)
+            return None
+        self._store(scope, image_hash, *entry)
+        self.stats.record(True)
+        return entry[1]
+
+    def set(self, scope, image_hash, value):
+        """Cache ``value`` under the hash for ``ttl`` seconds."""
+        expires_at = time.time() + self.ttl
+        self._store(scope, image_hash, expires_at, value)
+        shared_cache.set(self._shared_key(scope, image_hash), (expires_at, value),
+                         timeout=self.ttl)
+
+    def _store(self, scope, image_hash, expires_at, value):
+        with self._lock:
+            self._entries[(scope, image_hash)] = (expires_at, value)
+            self._entries.move_to_end((scope, image_hash))
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+
+image_search_cache = PerceptualHashCache("aliexpress:image_search")
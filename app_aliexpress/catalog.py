@@ -0,0 +1,222 @@
+"""Local catalog of the AliExpress products seen in detail, search and feed responses."""
+from decimal import Decimal, InvalidOperation
+import html
+import logging
+import re
+
+from django.db import DatabaseError, connection
+from django.db.models import Q
+from decouple import config
+
+from .models import CatalogProduct
+
+logger = logging.getLogger(__name__)
+
+ALIEXPRESS_CATALOG_DESCRIPTION_CHARS = config(
+    "ALIEXPRESS_CATALOG_DESCRIPTION_CHARS", default=20000, cast=int
+)
+
+# Created by migration 0002 on SQLite only
+FTS_TABLE = "app_aliexpress_catalogproduct_fts"
+
+# Listings carry no description, so they must not overwrite one stored from a detail call
+LISTING_FIELDS = ["subject", "category", "price", "currency", "image_url", "source", "alter_at"]
+DETAIL_FIELDS = [*LISTING_FIELDS, "description"]
+
+_TAG = re.compile(r"<[^>]*>")
+_SPACE = re.compile(r"\s+")
+_NUMBER = re.compile(r"\d+(?:[.,]\d+)*")
+
+
+def description_text(html_content):
+    """Plain text of a description, for the full-text index."""
+    text = html.unescape(_TAG.sub(" ", html_content or ""))
+    return _SPACE.sub(" ", text).strip()[:ALIEXPRESS_CATALOG_DESCRIPTION_CHARS]
+
+
+def parse_price(value):
+    """Decimal price from "12.34", "1,234.56" or "R$ 12,34"; None when there is none."""
+    match = _NUMBER.search(str(value or ""))
+    if match is None:
+        return None
+    number = match.group(0)
+    if "," in number and "." in number:
+        if number.rfind(".") > number.rfind(","):
+            number = number.replace(",", "")
+        else:
+            number = number.replace(".", "").replace(",", ".")
+    elif "," in number:
+        # A single comma followed by two digits is a decimal comma
+        if number.count(",") == 1 and len(number) - number.rfind(",") == 3:
+            number = number.replace(",", ".")
+        else:
+            number = number.replace(",", "")
+    try:
+        return Decimal(number).quantize(Decimal("0.01"))
+    except InvalidOperation:
+        return None
+
+
+def _image_url(url):
+    url = url or ""
+    return f"https:{url}" if url.startswith("//") else url
+
+
+def entry_from_product_detail(product_id, product):
+    """Catalog fields of a product prepared by ``prepare_static_fields``."""
+    base = product.get("ae_item_base_info_dto", {})
+    skus = product.get("ae_item_sku_info_dtos", {}).get("ae_item_sku_info_d_t_o") or []
+    prices = [
+        price for price in (
+            parse_price(sku.get("offer_sale_price") or sku.get("sku_price")) for sku in skus
+        ) if price is not None
+    ]
+    image_urls = product.get("image_urls") or []
+    return {
+        "aliexpress_id": str(product_id),
+        "subject": base.get("subject", ""),
+        "description": description_text(base.get("detail")),
+        "category": str(base.get("category_id", "")),
+        "price": min(prices) if prices else None,
+        "currency": base.get("currency_code") or next(
+            (sku["currency_code"] for sku in skus if sku.get("currency_code")), ""
+        ),
+        "image_url": _image_url(image_urls[0] if image_urls else ""),
+    }
+
+
+def entry_from_text_search(item):
+    """Catalog fields of an aliexpress.ds.text.search product."""
+    return {
+        "aliexpress_id": str(item.get("itemId", "")),
+        "subject": item.get("title", ""),
+        "category": str(item.get("cateId", "")).split(",")[0],
+        "price": parse_price(item.get("salePrice")),
+        "currency": item.get("salePriceCurrency", ""),
+        "image_url": _image_url(item.get("itemMainPic")),
+    }
+
+
+def entry_from_listing(item):
+    """Catalog fields of a recommend feed or image search product."""
+    return {
+        "aliexpress_id": str(item.get("product_id", "")),
+        "subject": item.get("product_title", ""),
+        "category": str(item.get("second_level_category_id")
+                        or item.get("first_level_category_id") or ""),
+        "price": parse_price(item.get("target_sale_price") or item.get("sale_price")),
+        "currency": item.get("target_sale_price_currency", ""),
+        "image_url": _image_url(item.get("product_main_image_url")),
+    }
+
+
+def record_products(entries, source, update_fields=None, raise_errors=False):
+    """Upsert catalog entries in one statement.
+
+    Recording is best effort: unless ``raise_errors`` is set, a database
+    error is logged and never reaches the view that produced the entries.
+
+    Returns:
+        int: Number of entries written
+    """
+    by_id = {}
+    for entry in entries:
+        if entry.get("aliexpress_id") and entry.get("subject"):
+            by_id[entry["aliexpress_id"]] = CatalogProduct(source=source, **entry)
+    if not by_id:
+        return 0
+    try:
+        CatalogProduct.objects.bulk_create( # pylint: disable=E1101
+            by_id.values(),
+            update_conflicts=True,
+            unique_fields=["aliexpress_id"],
+            update_fields=update_fields or LISTING_FIELDS,
+        )
+    except DatabaseError as exc:
+        if raise_errors:
+            raise
+        logger.warning("Could not record %s catalog products: %s", source, exc)
+        return 0
+    return len(by_id)
+
+
+def record_product_detail(product_id, product):
+    """Record a product fetched through aliexpress.ds.product.get."""
+    return record_products(
+        [entry_from_product_detail(product_id, product)], "detail", DETAIL_FIELDS
+    )
+
+
+def record_text_search(response):
+    """Record the products of an aliexpress.ds.text.search response."""
+    products = response.get('aliexpress_ds_text_search_response', {}).get('data', {}) \
+        .get('products') or {}
+    return record_products(
+        [entry_from_text_search(item) for item in products.get('selection_search_product', [])],
+        "search",
+    )
+
+
+def feed_products(response):
+    """Product list of an aliexpress.ds.recommend.feed.get response."""
+    result = response.get('aliexpress_ds_recommend_feed_get_response', {}).get('result') or {}
+    return result.get('products', {}).get('traffic_product_d_t_o', [])
+
+
+def record_recommend_feed(response):
+    """Record the products of an aliexpress.ds.recommend.feed.get response."""
+    return record_products([entry_from_listing(item) for item in feed_products(response)], "feed")
+
+
+def record_image_search(products):
+    """Record the products of an image search, as listed in its template context."""
+    return record_products([entry_from_listing(item) for item in products], "image")
+
+
+def fts_query(query):
+    """FTS5 MATCH expression: every word must appear, as a prefix, in any order.
+
+    Words are quoted so user input can never be read as FTS5 syntax.
+    """
+    words = [word.replace('"', "") for word in query.split()]
+    return " ".join(f'"{word}"*' for word in words if word)
+
+
+def search_catalog(query="", category=None, min_price=None, max_price=None, limit=50):
+    """Search the local catalog, best full-text matches first.
+
+    Uses the FTS5 index on SQLite and falls back to LIKE filters elsewhere.
+
+    Returns:
+        list: Matching CatalogProduct rows
+    """
+    filters = Q()
+    if category:
+        filters &= Q(category=category)
+    if min_price is not None:
+        filters &= Q(price__gte=min_price)
+    if max_price is not None:
+        filters &= Q(price__lte=max_price)
+    queryset = CatalogProduct.objects.filter(filters) # pylint: disable=E1101
+
+    match = fts_query(query or "")
+    if not match:
+        return list(queryset.order_by("-alter_at")[:limit])
+
+    if connection.vendor != "sqlite":
+        for word in query.split():
+            queryset = queryset.filter(Q(subject__icontains=word) | Q(description__icontains=word))
+        return list(queryset.order_by("-alter_at")[:limit])
+
+    sql = f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s"
+    params = [match]
+    if filters:
+        # Column filters run on the category and price indexes
+        id_sql, id_params = queryset.values("id").query.sql_with_params()
+        sql += f" AND rowid IN ({id_sql})"
+        params.extend(id_params)
+    with connection.cursor() as cursor:
+        cursor.execute(f"{sql} ORDER BY rank LIMIT %s", [*params, limit])
+        ranked_ids = [row[0] for row in cursor.fetchall()]
+    rows = CatalogProduct.objects.in_bulk(ranked_ids) # pylint: disable=E1101
+    return [rows[pk] for pk in ranked_ids if pk in rows]
@@ -0,0 +1,356 @@
+"""Process-wide AliExpress API clients with keep-alive connection pooling."""
+import asyncio
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import logging
+import threading
+import time
+import weakref
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from decouple import config
+
+from core.metrics import observe_upstream
+
+from .ratelimit import current_priority, rate_limiter as default_rate_limiter
+from .resilience import (
+    ALIEXPRESS_RETRIES,
+    RETRIABLE_STATUS,
+    backoff_delay,
+    breakers,
+    hedge_delay,
+    is_idempotent,
+    latencies,
+)
+from .signing import signer as default_signer
+
+logger = logging.getLogger(__name__)
+
+# Overridable to point the clients at a stand-in server (see bench_views)
+ALIEXPRESS_API_URL = config("ALIEXPRESS_API_URL", default="https://api-sg.aliexpress.com")
+
+ALIEXPRESS_POOL_CONNECTIONS = config("ALIEXPRESS_POOL_CONNECTIONS", default=4, cast=int)
+ALIEXPRESS_POOL_MAXSIZE = config("ALIEXPRESS_POOL_MAXSIZE", default=32, cast=int)
+ALIEXPRESS_CONNECT_TIMEOUT = config("ALIEXPRESS_CONNECT_TIMEOUT", default=3.05, cast=float)
+ALIEXPRESS_READ_TIMEOUT = config("ALIEXPRESS_READ_TIMEOUT", default=10, cast=float)
+ALIEXPRESS_ASYNC_MAX_CONNECTIONS = config(
+    "ALIEXPRESS_ASYNC_MAX_CONNECTIONS", default=200, cast=int
+)
+ALIEXPRESS_HEDGE_WORKERS = config("ALIEXPRESS_HEDGE_WORKERS", default=32, cast=int)
+
+FORM_HEADERS = {"Content-Type": "application/x-www-form-urlencoded;charset=utf-8"}
+
+
+class AliExpressAPIError(ValueError):
+    """Raised when an AliExpress call fails at the transport or decoding level.
+
+    Subclasses ValueError so the views' existing ``except ValueError`` blocks
+    keep handling upstream failures. ``retriable`` is set for timeouts,
+    connection errors and 408/429/5xx answers.
+    """
+
+    def __init__(self, message="", retriable=False):
+        super().__init__(message)
+        self.retriable = retriable
+
+
+class CircuitOpenError(AliExpressAPIError):
+    """Raised without calling AliExpress while the method's circuit is open."""
+
+
+def api_url(method):
+    """Endpoint for ``method``: REST paths go to /rest, dotted methods to /sync."""
+    if "/" in method:
+        return f"{ALIEXPRESS_API_URL}/rest{method}"
+    return f"{ALIEXPRESS_API_URL}/sync"
+
+
+class _ResilientCall:
+    """Retry and circuit breaker bookkeeping shared by the sync and async clients."""
+
+    def __init__(self, method, retries):
+        self.method = method
+        self.breaker = breakers.get(method)
+        self.attempts = 1 + (retries if is_idempotent(method) else 0)
+
+    def check(self):
+        """Fail fast while the circuit is open."""
+        if not self.breaker.allow():
+            raise CircuitOpenError(f"AliExpress call {self.method} skipped: circuit open")
+
+    def failed(self, exc, attempt):
+        """Return the backoff before the next attempt, or re-raise ``exc``."""
+        if not exc.retriable:
+            raise exc
+        if attempt + 1 >= self.attempts:
+            self.breaker.record_failure()
+            raise exc
+        self.check()
+        logger.info("Retrying AliExpress call %s (attempt %s)", self.method, attempt + 2)
+        return backoff_delay(attempt)
+
+
+class AliExpressClient:
+    """Signed AliExpress API client sharing one pooled HTTP session.
+
+    Idempotent query methods are retried with jittered backoff and, when
+    ALIEXPRESS_HEDGE_REQUESTS is set, duplicated once they run past the
+    method's recent p95 latency. Every method has a circuit breaker.
+
+    Args:
+        signer: Request signer; defaults to the application's shared Signer
+        pool_connections: Number of host pools kept by the adapter
+        pool_maxsize: Maximum keep-alive connections per host
+        timeout: ``(connect, read)`` timeout tuple in seconds
+        rate_limiter: Per-method call limiter; defaults to the process-wide one
+        retries: Extra attempts for idempotent methods
+    """
+
+    def __init__(self, signer=None,
+                 pool_connections=ALIEXPRESS_POOL_CONNECTIONS,
+                 pool_maxsize=ALIEXPRESS_POOL_MAXSIZE,
+                 timeout=(ALIEXPRESS_CONNECT_TIMEOUT, ALIEXPRESS_READ_TIMEOUT),
+                 rate_limiter=None, retries=ALIEXPRESS_RETRIES):
+        self.signer = signer or default_signer
+        self.rate_limiter = rate_limiter or default_rate_limiter
+        self.timeout = timeout
+        self.retries = retries
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update(FORM_HEADERS)
+        self._hedge_executor = None
+        self._hedge_lock = threading.Lock()
+
+    def execute(self, method, params=None, access_token=None, timeout=None, priority=None):
+        """Call an AliExpress API method and return the decoded JSON body.
+
+        Args:
+            method: API method ("aliexpress.ds.product.get") or REST path
+                ("/auth/token/create")
+            params: Application parameters for the call
+            access_token: Seller access token, when the method requires one
+            timeout: Optional override of the client timeout
+            priority: Rate limiter lane; defaults to the lane of the caller's context
+
+        Returns:
+            dict: Decoded response body
+
+        Raises:
+            AliExpressAPIError: On transport, HTTP status or decoding errors once
+                retries are exhausted, or when a high-priority call waited too
+                long for the rate limiter
+            CircuitOpenError: While the method's circuit is open
+        """
+        lane = priority or current_priority()
+        call = _ResilientCall(method, self.retries)
+        call.check()
+        attempt = 0
+        while True:
+            if not self.rate_limiter.acquire(method, lane):
+                raise AliExpressAPIError(f"AliExpress call {method} rate limited")
+            try:
+                response = self._send_hedged(method, params or {}, access_token, timeout, lane)
+            except AliExpressAPIError as exc:
+                time.sleep(call.failed(exc, attempt))
+                attempt += 1
+            else:
+                call.breaker.record_success()
+                return response
+
+    def _send(self, method, params, access_token, timeout):
+        """Sign and send one request."""
+        data = self.signer.build_signed_params(method, params, access_token)
+        started = time.perf_counter()
+        try:
+            response = self.session.post(
+                api_url(method), data=data, timeout=timeout or self.timeout
+            )
+            response.raise_for_status()
+            body = response.json()
+        except requests.RequestException as exc:
+            logger.error("AliExpress call %s failed: %s", method, exc)
+            observe_upstream("aliexpress", method, 0, error=type(exc).__name__)
+            status = getattr(exc.response, "status_code", None)
+            raise AliExpressAPIError(
+                f"AliExpress call {method} failed: {exc}",
+                retriable=status is None or status in RETRIABLE_STATUS,
+            ) from exc
+        elapsed = time.perf_counter() - started
+        latencies.get(method).record(elapsed)
+        observe_upstream("aliexpress", method, elapsed, len(response.content))
+        return body
+
+    def _send_hedged(self, method, params, access_token, timeout, lane):
+        """Send a request, duplicating it if it outlives the method's p95 latency."""
+        delay = hedge_delay(method)
+        if delay is None:
+            return self._send(method, params, access_token, timeout)
+
+        executor = self._hedges()
+        futures = {executor.submit(self._send, method, params, access_token, timeout)}
+        done, _pending = wait(futures, timeout=delay)
+        # The duplicate only goes out if the rate limiter has a token to spare
+        if not done and self.rate_limiter.try_acquire(method, lane):
+            logger.info("Hedging AliExpress call %s after %.3fs", method, delay)
+            futures.add(executor.submit(self._send, method, params, access_token, timeout))
+
+        error = None
+        while futures:
+            done, futures = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    return future.result()
+                except AliExpressAPIError as exc:
+                    error = exc
+        raise error
+
+    def _hedges(self):
+        if self._hedge_executor is None:
+            with self._hedge_lock:
+                if self._hedge_executor is None:
+                    self._hedge_executor = ThreadPoolExecutor(
+                        max_workers=ALIEXPRESS_HEDGE_WORKERS, thread_name_prefix="aliexpress-hedge"
+                    )
+        return self._hedge_executor
+
+    def close(self):
+        """Release the pooled connections."""
+        if self._hedge_executor is not None:
+            self._hedge_executor.shutdown(wait=False)
+        self.session.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Return the process-wide AliExpress client, creating it on first use."""
+    global _client  # pylint: disable=W0603
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = AliExpressClient()
+    return _client
+
+
+class AsyncAliExpressClient:
+    """Signed AliExpress API client for async views, on a pooled httpx client.
+
+    Applies the same retry, hedging and circuit breaker policies as
+    :class:`AliExpressClient`; a losing hedged request is cancelled.
+
+    Args:
+        signer: Request signer; defaults to the application's shared Signer
+        max_connections: Maximum concurrent connections, keep-alive included
+        timeout: ``(connect, read)`` timeout tuple in seconds
+        rate_limiter: Per-method call limiter; defaults to the process-wide one
+        retries: Extra attempts for idempotent methods
+    """
+
+    def __init__(self, signer=None,
+                 max_connections=ALIEXPRESS_ASYNC_MAX_CONNECTIONS,
+                 timeout=(ALIEXPRESS_CONNECT_TIMEOUT, ALIEXPRESS_READ_TIMEOUT),
+                 rate_limiter=None, retries=ALIEXPRESS_RETRIES):
+        self.signer = signer or default_signer
+        self.rate_limiter = rate_limiter or default_rate_limiter
+        self.retries = retries
+        connect_timeout, read_timeout = timeout
+        self.http = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+            ),
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            headers=FORM_HEADERS,
+        )
+
+    async def execute(self, method, params=None, access_token=None, timeout=None,
+                      priority=None):
+        """Async counterpart of :meth:`AliExpressClient.execute`."""
+        lane = priority or current_priority()
+        call = _ResilientCall(method, self.retries)
+        call.check()
+        attempt = 0
+        while True:
+            if not await self.rate_limiter.acquire_async(method, lane):
+                raise AliExpressAPIError(f"AliExpress call {method} rate limited")
+            try:
+                response = await self._send_hedged(
+                    method, params or {}, access_token, timeout, lane
+                )
+            except AliExpressAPIError as exc:
+                await asyncio.sleep(call.failed(exc, attempt))
+                attempt += 1
+            else:
+                call.breaker.record_success()
+                return response
+
+    async def _send(self, method, params, access_token, timeout):
+        """Sign and send one request."""
+        data = self.signer.build_signed_params(method, params, access_token)
+        kwargs = {"timeout": timeout} if timeout is not None else {}
+        started = time.perf_counter()
+        try:
+            response = await self.http.post(api_url(method), data=data, **kwargs)
+            response.raise_for_status()
+            body = response.json()
+        except (httpx.HTTPError, ValueError) as exc:
+            logger.error("AliExpress call %s failed: %s", method, exc)
+            observe_upstream("aliexpress", method, 0, error=type(exc).__name__)
+            status = exc.response.status_code \
+                if isinstance(exc, httpx.HTTPStatusError) else None
+            raise AliExpressAPIError(
+                f"AliExpress call {method} failed: {exc}",
+                retriable=status is None or status in RETRIABLE_STATUS,
+            ) from exc
+        elapsed = time.perf_counter() - started
+        latencies.get(method).record(elapsed)
+        observe_upstream("aliexpress", method, elapsed, len(response.content))
+        return body
+
+    async def _send_hedged(self, method, params, access_token, timeout, lane):
+        """Async counterpart of :meth:`AliExpressClient._send_hedged`."""
+        delay = hedge_delay(method)
+        if delay is None:
+            return await self._send(method, params, access_token, timeout)
+
+        tasks = {asyncio.ensure_future(self._send(method, params, access_token, timeout))}
+        done, _pending = await asyncio.wait(tasks, timeout=delay)
+        if not done and self.rate_limiter.try_acquire(method, lane):
+            logger.info("Hedging AliExpress call %s after %.3fs", method, delay)
+            tasks.add(asyncio.ensure_future(self._send(method, params, access_token, timeout)))
+
+        error = None
+        try:
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    try:
+                        return task.result()
+                    except AliExpressAPIError as exc:
+                        error = exc
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def close(self):
+        """Release the pooled connections."""
+        await self.http.aclose()
+
+
+# httpx clients are bound to the event loop that created them
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_client():
+    """Return the AliExpress async client of the running event loop."""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = _async_clients[loop] = AsyncAliExpressClient()
+    return client
@@ -0,0 +1,103 @@
+"""Content-hash validators and fragment keys for the pages built from API payloads.
+
+A page's ETag combines the hash of the context it renders with the session
+and CSRF cookies, since the header and the forms around the cached
+fragments depend on them. Last-Modified is when the page's content hash
+last changed, so content that reverts to an earlier version still counts
+as modified.
+"""
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import cache as shared_cache
+from django.shortcuts import render
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+from decouple import config
+
+# How long rendered fragments stay in the template fragment cache
+ALIEXPRESS_FRAGMENT_TTL = config("ALIEXPRESS_FRAGMENT_TTL", default=3600, cast=int)
+# How long the last change of a page's content hash is remembered
+ALIEXPRESS_CONTENT_SEEN_TTL = config("ALIEXPRESS_CONTENT_SEEN_TTL", default=7 * 86400, cast=int)
+
+
+def content_hash(context):
+    """Stable hash of a template context built from API payloads."""
+    encoded = json.dumps(context, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha1(encoded.encode("utf-8")).hexdigest()
+
+
+def page_etag(request, fragment_key):
+    """Quoted ETag of a page rendering content ``fragment_key`` for this client."""
+    cookies = request.COOKIES
+    seed = "|".join((
+        fragment_key,
+        cookies.get(settings.SESSION_COOKIE_NAME, ""),
+        cookies.get(settings.CSRF_COOKIE_NAME, ""),
+    ))
+    return quote_etag(hashlib.sha1(seed.encode("utf-8")).hexdigest())
+
+
+def _seen_key(request):
+    page = hashlib.sha1(request.get_full_path().encode("utf-8")).hexdigest()
+    return f"aliexpress:content_seen:{page}"
+
+
+def _changed(seen, fragment_key):
+    """The ``(fragment_key, epoch seconds)`` entry to store, or None to keep ``seen``."""
+    if seen is not None and seen[0] == fragment_key:
+        return None
+    return fragment_key, int(time.time())
+
+
+def last_changed(request, fragment_key):
+    """Epoch seconds when the page of ``request`` last changed to content ``fragment_key``."""
+    key = _seen_key(request)
+    seen = shared_cache.get(key)
+    changed = _changed(seen, fragment_key)
+    if changed is None:
+        return seen[1]
+    shared_cache.set(key, changed, ALIEXPRESS_CONTENT_SEEN_TTL)
+    return changed[1]
+
+
+async def alast_changed(request, fragment_key):
+    """Async counterpart of :func:`last_changed`."""
+    key = _seen_key(request)
+    seen = await shared_cache.aget(key)
+    changed = _changed(seen, fragment_key)
+    if changed is None:
+        return seen[1]
+    await shared_cache.aset(key, changed, ALIEXPRESS_CONTENT_SEEN_TTL)
+    return changed[1]
+
+
+def fragment_context(context, fragment_key):
+    """``context`` plus what the templates' ``{% cache %}`` blocks are keyed on."""
+    return {**context, "fragment_key": fragment_key, "fragment_ttl": ALIEXPRESS_FRAGMENT_TTL}
+
+
+def not_modified(request, etag, last_modified):
+    """A 304 when the client's copy is current, else None."""
+    return get_conditional_response(request, etag=etag, last_modified=last_modified)
+
+
+def set_validators(response, etag, last_modified):
+    """Add the validators, and make browsers revalidate before reusing the page."""
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(last_modified)
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def conditional_render(request, template_name, context):
+    """Render ``context``, or answer 304 when the client already has this content."""
+    fragment_key = content_hash(context)
+    etag = page_etag(request, fragment_key)
+    last_modified = last_changed(request, fragment_key)
+    response = not_modified(request, etag, last_modified)
+    if response is None:
+        response = render(request, template_name, fragment_context(context, fragment_key))
+    return set_validators(response, etag, last_modified)
@@ -0,0 +1,72 @@
+"""Streaming crawl of a whole AliExpress recommend feed."""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import logging
+
+from .catalog import feed_products
+from .client import AliExpressAPIError, get_client
+from .ratelimit import LOW
+from .views import recommend_feed_params
+
+logger = logging.getLogger(__name__)
+
+
+def fetch_feed_page(feed_name, page_no, page_size):
+    """Fetch one feed page straight from the API, bypassing the page cache.
+
+    Returns:
+        tuple: ``(products, total_record_count)``
+
+    Raises:
+        AliExpressAPIError: When the API answers with an error body
+    """
+    response = get_client().execute(
+        'aliexpress.ds.recommend.feed.get',
+        recommend_feed_params(feed_name, page_no, page_size),
+        priority=LOW,
+    )
+    if 'aliexpress_ds_recommend_feed_get_response' not in response:
+        raise AliExpressAPIError(
+            f"Feed {feed_name} page {page_no} failed: {response.get('error_response', response)}"
+        )
+    result = response['aliexpress_ds_recommend_feed_get_response'].get('result') or {}
+    return feed_products(response), int(result.get('total_record_count', 0))
+
+
+def iter_feed_pages(feed_name, start_page=1, page_size=50, concurrency=4, max_pages=None):
+    """Yield ``(page_no, products, total_pages)`` for every page from ``start_page`` on.
+
+    Pages are yielded in order while up to ``concurrency`` of the following
+    pages are already being fetched, so at most that many pages are held in
+    memory. The generator stops at the first empty page or after the last
+    page reported by the API.
+    """
+    products, total_records = fetch_feed_page(feed_name, start_page, page_size)
+    total_pages = (total_records + page_size - 1) // page_size
+    last_page = total_pages
+    if max_pages is not None:
+        last_page = min(last_page, start_page + max_pages - 1)
+    if not products:
+        return
+    yield start_page, products, total_pages
+
+    next_page = start_page + 1
+    with ThreadPoolExecutor(max_workers=concurrency,
+                            thread_name_prefix="aliexpress-crawl") as executor:
+        pending = deque()
+        try:
+            while pending or next_page <= last_page:
+                while next_page <= last_page and len(pending) < concurrency:
+                    pending.append((next_page, executor.submit(
+                        fetch_feed_page, feed_name, next_page, page_size
+                    )))
+                    next_page += 1
+                page_no, future = pending.popleft()
+                products, _total_records = future.result()
+                if not products:
+                    logger.info("Feed %s ended early at page %s", feed_name, page_no)
+                    return
+                yield page_no, products, total_pages
+        finally:
+            for _page_no, future in pending:
+                future.cancel()
@@ -0,0 +1,53 @@
+"""Single-pass rewriting of AliExpress product description HTML."""
+import hashlib
+import re
+
+from decouple import config
+
+from .cache import ALIEXPRESS_PRODUCT_STATIC_TTL, LRUCache
+
+ALIEXPRESS_DESCRIPTION_CACHE_SIZE = config(
+    "ALIEXPRESS_DESCRIPTION_CACHE_SIZE", default=256, cast=int
+)
+
+IMG_STYLE = "max-width: 100%; height: auto; display: block; margin: 10px 0;"
+
+# An <img> tag, allowing ">" inside quoted attribute values
+_IMG_TAG = re.compile(r"""<img\b((?:[^>"']|"[^"]*"|'[^']*')*?)(/?)>""", re.IGNORECASE)
+# One attribute inside a tag: name, optionally followed by a quoted or bare value
+_ATTRIBUTE = re.compile(
+    r"""\s*([^\s=/>]+)(?:\s*=\s*("[^"]*"|'[^']*'|[^\s"'>]+))?""", re.DOTALL
+)
+_DROPPED_ATTRIBUTES = frozenset(("width", "height", "style"))
+
+_description_cache = LRUCache(ALIEXPRESS_DESCRIPTION_CACHE_SIZE)
+
+
+def _rewrite_img(match):
+    """Rebuild one <img> tag without width/height and with the responsive style."""
+    kept = [
+        attribute.group(0).strip()
+        for attribute in _ATTRIBUTE.finditer(match.group(1))
+        if attribute.group(1).lower() not in _DROPPED_ATTRIBUTES
+    ]
+    kept.append(f'style="{IMG_STYLE}"')
+    return f"<img {' '.join(kept)}{match.group(2)}>"
+
+
+def rewrite_description(html_content):
+    """Strip width/height from every <img> and inject the responsive style.
+
+    Only <img> tags are touched; the rest of the markup is copied through as
+    is, so no document tree is built.
+    """
+    return _IMG_TAG.sub(_rewrite_img, html_content)
+
+
+def process_description(html_content):
+    """Memoized :func:`rewrite_description`, keyed on a hash of the input HTML."""
+    digest = hashlib.blake2b(html_content.encode("utf-8"), digest_size=16).digest()
+    rewritten = _description_cache.get(digest)
+    if rewritten is None:
+        rewritten = rewrite_description(html_content)
+        _description_cache.set(digest, rewritten, ttl=ALIEXPRESS_PRODUCT_STATIC_TTL)
+    return rewritten
@@ -0,0 +1,38 @@
+"""Perceptual image fingerprints used to spot repeated image-search uploads."""
+from PIL import Image
+
+HASH_SIZE = 8
+
+
+def dhash(image, hash_size=HASH_SIZE):
+    """Difference hash: one bit per horizontally adjacent pixel pair.
+
+    Returns:
+        int: ``hash_size * hash_size`` bit fingerprint
+    """
+    small = image.convert("L").resize((hash_size + 1, hash_size), Image.Resampling.BILINEAR)
+    pixels = small.tobytes()
+    bits = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            bits = (bits << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return bits
+
+
+def hamming_distance(first, second):
+    """Number of differing bits between two fingerprints."""
+    return bin(first ^ second).count("1")
+
+
+def image_fingerprint(image_file):
+    """Fingerprint an uploaded image, leaving the file rewound for later reads.
+
+    Big JPEGs are decoded in draft mode at a fraction of their size, which is
+    all a 9x8 hash needs.
+    """
+    image = Image.open(image_file)
+    image.thumbnail((64, 64), Image.Resampling.BILINEAR, reducing_gap=2.0)
+    fingerprint = dhash(image)
+    image_file.seek(0)
+    return fingerprint
@@ -0,0 +1,271 @@
+"""Resizing proxy for AliExpress product images, backed by an on-disk LRU cache."""
+import hashlib
+from io import BytesIO
+import logging
+import os
+from pathlib import Path
+import threading
+from urllib.parse import urlsplit
+import uuid
+
+from pillow_avif import AvifImagePlugin # pylint: disable=W0611
+from PIL import Image, ImageOps
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+from django.utils.crypto import constant_time_compare, salted_hmac
+from decouple import Csv, config
+
+from core.metrics import track_upstream
+from core.profiling import phase
+
+from .cache import CacheStats, SingleFlight
+
+logger = logging.getLogger(__name__)
+
+ALIEXPRESS_IMAGE_CACHE_DIR = Path(config(
+    "ALIEXPRESS_IMAGE_CACHE_DIR", default=str(Path(settings.BASE_DIR) / "image_cache")
+))
+ALIEXPRESS_IMAGE_CACHE_MAX_MB = config("ALIEXPRESS_IMAGE_CACHE_MAX_MB", default=512, cast=int)
+# Requested widths snap up to one of these, so the cache holds few variants per image
+ALIEXPRESS_IMAGE_WIDTHS = sorted(config(
+    "ALIEXPRESS_IMAGE_WIDTHS", default="100,200,400,800,1200", cast=Csv(int)
+))
+ALIEXPRESS_IMAGE_DEFAULT_WIDTH = config("ALIEXPRESS_IMAGE_DEFAULT_WIDTH", default=800, cast=int)
+# Preferred output formats, used when the browser's Accept header lists them
+ALIEXPRESS_IMAGE_FORMATS = config("ALIEXPRESS_IMAGE_FORMATS", default="avif,webp", cast=Csv())
+ALIEXPRESS_IMAGE_QUALITY = config("ALIEXPRESS_IMAGE_QUALITY", default=75, cast=int)
+# 0 (slowest, smallest) to 10 (fastest); variants are encoded while the browser waits
+ALIEXPRESS_IMAGE_AVIF_SPEED = config("ALIEXPRESS_IMAGE_AVIF_SPEED", default=8, cast=int)
+ALIEXPRESS_IMAGE_MAX_AGE = config("ALIEXPRESS_IMAGE_MAX_AGE", default=365 * 86400, cast=int)
+ALIEXPRESS_IMAGE_MAX_SOURCE_MB = config("ALIEXPRESS_IMAGE_MAX_SOURCE_MB", default=15, cast=int)
+ALIEXPRESS_IMAGE_TIMEOUT = config("ALIEXPRESS_IMAGE_TIMEOUT", default=10, cast=float)
+# Only images on these domains (or their subdomains) are proxied
+ALIEXPRESS_IMAGE_HOSTS = config(
+    "ALIEXPRESS_IMAGE_HOSTS", default="alicdn.com,aliexpress-media.com", cast=Csv()
+)
+
+# format: (Pillow format, content type)
+FORMATS = {
+    "avif": ("AVIF", "image/avif"),
+    "webp": ("WEBP", "image/webp"),
+    "jpeg": ("JPEG", "image/jpeg"),
+}
+
+
+class ImageProxyError(ValueError):
+    """Raised when a source image cannot be fetched or decoded."""
+
+
+class DiskLRUCache:
+    """Directory of byte blobs bounded to ``max_bytes``, least recently used out first.
+
+    Reads touch the file's mtime, so mtime order is the LRU order and it
+    survives restarts. Eviction rescans the directory, which also picks up
+    files written by other processes sharing it, and trims down to
+    ``low_water`` of the budget so it does not run on every write.
+    """
+
+    def __init__(self, directory, max_bytes, low_water=0.9):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.low_water = low_water
+        self._size = None
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return self.directory / digest[:2] / digest
+
+    def get(self, key):
+        """Stored bytes of ``key``, or None."""
+        path = self._path(key)
+        try:
+            data = path.read_bytes()
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return data
+
+    def set(self, key, data):
+        """Store ``data`` under ``key``, evicting old entries when over budget."""
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+        temporary.write_bytes(data)
+        try:
+            replaced = path.stat().st_size
+        except FileNotFoundError:
+            replaced = 0
+        os.replace(temporary, path)
+        with self._lock:
+            if self._size is None:
+                self._size = self._scan_size()
+            else:
+                self._size += len(data) - replaced
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _entries(self):
+        for path in self.directory.glob("??/*"):
+            if path.suffix == ".tmp":
+                continue
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            yield stat.st_mtime, stat.st_size, path
+
+    def _scan_size(self):
+        return sum(size for _mtime, size, _path in self._entries())
+
+    def _evict(self):
+        entries = sorted(self._entries())
+        size = sum(entry_size for _mtime, entry_size, _path in entries)
+        target = self.max_bytes * self.low_water
+        for _mtime, entry_size, path in entries:
+            if size <= target:
+                break
+            path.unlink(missing_ok=True)
+            size -= entry_size
+        self._size = size
+
+
+image_cache = DiskLRUCache(ALIEXPRESS_IMAGE_CACHE_DIR, ALIEXPRESS_IMAGE_CACHE_MAX_MB * 2 ** 20)
+image_stats = CacheStats("aliexpress:image_variants")
+_source_flight = SingleFlight()
+_variant_flight = SingleFlight()
+
+_session = requests.Session()
+_session.mount("https://", HTTPAdapter(pool_maxsize=16))
+_session.mount("http://", HTTPAdapter(pool_maxsize=16))
+
+
+def normalize_image_url(url):
+    """AliExpress image URLs are often protocol relative; give them a scheme."""
+    url = (url or "").strip()
+    return f"https:{url}" if url.startswith("//") else url
+
+
+def allowed_image_url(url):
+    """Whether ``url`` is an http(s) image on one of ALIEXPRESS_IMAGE_HOSTS."""
+    try:
+        parts = urlsplit(url)
+    except ValueError:
+        return False
+    host = (parts.hostname or "").lower()
+    return parts.scheme in ("http", "https") and any(
+        host == allowed or host.endswith(f".{allowed}") for allowed in ALIEXPRESS_IMAGE_HOSTS
+    )
+
+
+def image_signature(url, width):
+    """Signature the proxy requires with ``url`` and ``width``.
+
+    Only URLs our own pages render are served, so nobody else can make the
+    server download and encode images.
+    """
+    return salted_hmac("app_aliexpress.images", f"{url}|{width}", algorithm="sha256").hexdigest()
+
+
+def valid_image_signature(url, width, signature):
+    """Whether ``signature`` was made by ``image_signature`` for ``url`` and ``width``."""
+    return constant_time_compare(image_signature(url, width), signature or "")
+
+
+def snap_width(width):
+    """Smallest configured width at least ``width``; the largest one when none is."""
+    try:
+        width = int(width)
+    except (TypeError, ValueError):
+        width = ALIEXPRESS_IMAGE_DEFAULT_WIDTH
+    return next((allowed for allowed in ALIEXPRESS_IMAGE_WIDTHS if allowed >= width),
+                ALIEXPRESS_IMAGE_WIDTHS[-1])
+
+
+def negotiate_format(accept):
+    """First of ALIEXPRESS_IMAGE_FORMATS the ``Accept`` header allows, else JPEG."""
+    for name in ALIEXPRESS_IMAGE_FORMATS:
+        if name in FORMATS and FORMATS[name][1] in accept:
+            return name
+    return "jpeg"
+
+
+def fetch_source(url):
+    """Original bytes of ``url``, downloaded once and then kept in the disk cache."""
+    key = f"source|{url}"
+    data = image_cache.get(key)
+    if data is None:
+        data = _source_flight.do(key, lambda: _download(url, key))
+    return data
+
+
+def _download(url, key):
+    limit = ALIEXPRESS_IMAGE_MAX_SOURCE_MB * 2 ** 20
+    try:
+        with track_upstream("alicdn", "image") as call:
+            # Not followed: the allowlist was only checked on ``url`` itself
+            with _session.get(url, timeout=ALIEXPRESS_IMAGE_TIMEOUT, stream=True,
+                              allow_redirects=False) as response:
+                response.raise_for_status()
+                if response.is_redirect:
+                    raise ImageProxyError(
+                        f"Image download redirected to {response.headers.get('Location')}"
+                    )
+                data = response.raw.read(limit + 1, decode_content=True)
+            call["size"] = len(data)
+    except requests.RequestException as exc:
+        raise ImageProxyError(f"Image download failed: {exc}") from exc
+    if len(data) > limit:
+        raise ImageProxyError(f"Image larger than {ALIEXPRESS_IMAGE_MAX_SOURCE_MB} MB")
+    image_cache.set(key, data)
+    return data
+
+
+def render_variant(source, width, image_format):
+    """Encode ``source`` at most ``width`` pixels wide in ``image_format``."""
+    pillow_format = FORMATS[image_format][0]
+    try:
+        with Image.open(BytesIO(source)) as image:
+            # JPEG sources decode straight at a fraction of their size
+            image.draft("RGB", (width, width))
+            image = ImageOps.exif_transpose(image)
+            if image.width > width:
+                image = image.resize(
+                    (width, max(1, round(image.height * width / image.width))),
+                    Image.Resampling.LANCZOS, reducing_gap=2.0,
+                )
+            has_alpha = image.mode in ("RGBA", "LA") or "transparency" in image.info
+            mode = "RGBA" if has_alpha and pillow_format != "JPEG" else "RGB"
+            if image.mode != mode:
+                image = image.convert(mode)
+            out = BytesIO()
+            options = {"quality": ALIEXPRESS_IMAGE_QUALITY}
+            if pillow_format == "AVIF":
+                options["speed"] = ALIEXPRESS_IMAGE_AVIF_SPEED
+            image.save(out, pillow_format, **options)
+    except (OSError, ValueError, Image.DecompressionBombError) as exc:
+        raise ImageProxyError(f"Image could not be converted: {exc}") from exc
+    return out.getvalue()
+
+
+def image_variant(url, width, image_format):
+    """Resized ``image_format`` bytes of ``url``, from the disk cache when present.
+
+    Raises:
+        ImageProxyError: When the source cannot be downloaded or decoded
+    """
+    key = f"variant|{url}|{width}|{image_format}"
+    data = image_cache.get(key)
+    image_stats.record(data is not None)
+    if data is None:
+        data = _variant_flight.do(key, lambda: _build_variant(url, width, image_format, key))
+    return data
+
+
+def _build_variant(url, width, image_format, key):
+    source = fetch_source(url)
+    with phase(f"image resize {image_format}"):
+        data = render_variant(source, width, image_format)
+    image_cache.set(key, data)
+    return data
@@ -0,0 +1,63 @@
+"""Micro-benchmark of product description rewriting."""
+from pathlib import Path
+import timeit
+
+from bs4 import BeautifulSoup
+from django.core.management.base import BaseCommand
+
+from app_aliexpress.benchmark import sample_description
+from app_aliexpress.description import IMG_STYLE, process_description, rewrite_description
+
+
+def rewrite_description_bs4(html_content):
+    """The former BeautifulSoup implementation, kept as the reference."""
+    soup = BeautifulSoup(html_content, "html.parser")
+    for img in soup.find_all("img"):
+        if "width" in img.attrs:
+            del img["width"]
+        if "height" in img.attrs:
+            del img["height"]
+        img["style"] = IMG_STYLE
+    return str(soup)
+
+
+class Command(BaseCommand):
+    """Compare the BeautifulSoup and streaming description rewriters."""
+
+    help = "Benchmark process_product_description against the former BeautifulSoup path."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", default="20,100,300,600",
+                            help="Comma separated synthetic description sizes in KB.")
+        parser.add_argument("--file", action="append", default=[],
+                            help="Real description HTML file to include; repeatable.")
+        parser.add_argument("--repeat", type=int, default=5,
+                            help="Timing repetitions; the best one is reported.")
+
+    def handle(self, *args, **options):
+        samples = [
+            (f"synthetic {kb}KB", sample_description(int(kb)))
+            for kb in options["sizes"].split(",") if kb.strip()
+        ]
+        samples += [(path, Path(path).read_text(encoding="utf-8")) for path in options["file"]]
+
+        self.stdout.write(f"{'sample':<28}{'imgs':>6}{'bs4 ms':>10}{'stream ms':>11}"
+                          f"{'memo ms':>10}{'speedup':>9}")
+        for name, html in samples:
+            expected = BeautifulSoup(rewrite_description_bs4(html), "html.parser")
+            actual = BeautifulSoup(rewrite_description(html), "html.parser")
+            images = expected.find_all("img")
+            if [img.attrs for img in images] != [img.attrs for img in actual.find_all("img")]:
+                self.stderr.write(self.style.ERROR(f"{name}: <img> attributes differ"))
+
+            bs4_s = min(timeit.repeat(lambda: rewrite_description_bs4(html),
+                                      number=1, repeat=options["repeat"]))
+            stream_s = min(timeit.repeat(lambda: rewrite_description(html),
+                                         number=1, repeat=options["repeat"]))
+            process_description(html)
+            memo_s = min(timeit.repeat(lambda: process_description(html),
+                                       number=1, repeat=options["repeat"]))
+            self.stdout.write(
+                f"{name[:27]:<28}{len(images):>6}{bs4_s * 1000:>10.2f}"
+                f"{stream_s * 1000:>11.2f}{memo_s * 1000:>10.3f}{bs4_s / stream_s:>8.1f}x"
+            )
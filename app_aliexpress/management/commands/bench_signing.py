@@ -0,0 +1,78 @@
+"""Micro-benchmark of AliExpress request signing."""
+import hashlib
+import hmac
+import json
+import timeit
+from urllib.parse import quote
+
+from django.core.management.base import BaseCommand
+
+from app_aliexpress.signing import Signer
+
+SAMPLE_CALLS = {
+    "product.get": ("aliexpress.ds.product.get", {
+        "product_id": 1005006123456789,
+        "target_currency": "BRL",
+        "ship_to_country": "BR",
+    }),
+    "freight.query": ("aliexpress.ds.freight.query", {
+        "queryDeliveryReq": json.dumps({
+            "productId": 1005006123456789, "selectedSkuId": "12000036123456789",
+            "currency": "BRL", "shipToCountry": "BR", "quantity": 1,
+            "language": "pt_BR", "locale": "zh_CN",
+        }),
+    }),
+    "token.refresh": ("/auth/token/refresh", {"refresh_token": "50001600c12" * 4}),
+}
+
+
+def generate_sign_legacy(secret, api_name, parameters):
+    """The former generate_sign, kept as the reference."""
+    encoded_parameters = {k: quote(str(v)) for k, v in parameters.items()}
+    sorted_params = sorted(encoded_parameters)
+    if "/" in api_name:
+        parts = [f"{k}{encoded_parameters[k]}" for k in sorted_params]
+        parameters_str = f"{api_name}{''.join(parts)}"
+    else:
+        parts = [f"{k}{encoded_parameters[k]}" for k in sorted_params]
+        parameters_str = ''.join(parts)
+    h = hmac.new(
+        secret.encode("utf-8"),
+        parameters_str.encode("utf-8"),
+        digestmod=hashlib.sha256,
+    )
+    return h.hexdigest().upper()
+
+
+class Command(BaseCommand):
+    """Compare the former generate_sign with the precomputed Signer."""
+
+    help = "Benchmark per-call cost of signing AliExpress requests."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--number", type=int, default=20000,
+                            help="Calls per timing run.")
+        parser.add_argument("--repeat", type=int, default=5,
+                            help="Timing repetitions; the best one is reported.")
+
+    def handle(self, *args, **options):
+        number, repeat = options["number"], options["repeat"]
+        signer = Signer("12345678", "0123456789abcdef0123456789abcdef")
+        secret = "0123456789abcdef0123456789abcdef"
+
+        self.stdout.write(f"{'call':<16}{'legacy us':>11}{'sign us':>10}"
+                          f"{'build us':>10}{'speedup':>9}")
+        for name, (method, params) in SAMPLE_CALLS.items():
+            signed = signer.build_signed_params(method, params, access_token="token")
+            unsigned = {k: v for k, v in signed.items() if k != "sign"}
+
+            def best(fn):
+                return min(timeit.repeat(fn, number=number, repeat=repeat)) / number * 1e6
+
+            legacy_us = best(lambda: generate_sign_legacy(secret, method, unsigned))
+            sign_us = best(lambda: signer.sign(method, unsigned))
+            build_us = best(
+                lambda: signer.build_signed_params(method, params, access_token="token")
+            )
+            self.stdout.write(f"{name:<16}{legacy_us:>11.2f}{sign_us:>10.2f}"
+                              f"{build_us:>10.2f}{legacy_us / sign_us:>8.1f}x")
@@ -0,0 +1,373 @@
+"""Offline load benchmark of the views against stand-in AliExpress and Shopify servers."""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+import io
+import json
+import logging
+import os
+from pathlib import Path
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from unittest import mock
+
+from PIL import Image, ImageDraw
+import shopify
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import AsyncClient, Client
+from django.test.utils import override_settings
+
+from app_aliexpress import client as aliexpress_client
+from app_aliexpress.benchmark import (
+    AliExpressStandIn,
+    ShopifyStandIn,
+    server_counts,
+    start_server,
+)
+from app_aliexpress.models import AliExpressToken
+from app_aliexpress.ratelimit import rate_limiter
+from app_shopify.models import Product, ShopStore
+
+# Synthetic ids, far from real ones, so a shared cache never mixes them up
+FIRST_PRODUCT_ID = 9000000000000000
+SCENARIO_ID_SPAN = 10 ** 6
+# Where the views redirect when they fail
+ERROR_REDIRECTS = ("/aliexpress/dashboard/", "/aliexpress/authorization/", "/admin/login/")
+
+# name: (async client, HTTP method, path); each scenario gets its own ids,
+# keywords and feed so it never starts on caches warmed by another one
+SCENARIOS = {
+    "detail": (False, "get", "/aliexpress/product/{product_id}/"),
+    "detail_async": (True, "get", "/aliexpress/async/product/{product_id}/"),
+    "text_search": (False, "get", "/aliexpress/text_search/?keyword=bench+{tag}+{key}"),
+    "text_search_async": (True, "get",
+                          "/aliexpress/async/text_search/?keyword=bench+{tag}+{key}"),
+    "feed": (False, "get", "/aliexpress/recommend_feed_aliexpress/bench-{tag}/?page={page}"),
+    "feed_async": (True, "get",
+                   "/aliexpress/async/recommend_feed_aliexpress/bench-{tag}/?page={page}"),
+    "image_search": (False, "post", "/aliexpress/image_search/"),
+    "image_search_async": (True, "post", "/aliexpress/async/image_search/"),
+    "shopify_list": (False, "get", "/shopify/products/{store_id}/"),
+    "shopify_push": (False, "post", "/shopify/push/{product_id}/"),
+}
+
+FEED_PAGES = 100
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an ascending list."""
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, round(fraction * len(sorted_values) + 0.5) - 1))
+    return sorted_values[index]
+
+
+def rss_mb():
+    """Current resident set size in MB, or the peak where /proc is unavailable."""
+    try:
+        pages = int(Path("/proc/self/statm").read_text(encoding="ascii").split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10
+
+
+def sample_image(seed, size):
+    """JPEG bytes of a distinct synthetic photo, so uploads do not share a fingerprint."""
+    rng = random.Random(seed)
+    image = Image.new("RGB", (size, size), tuple(rng.randrange(256) for _ in range(3)))
+    draw = ImageDraw.Draw(image)
+    for _ in range(40):
+        x, y = rng.randrange(size), rng.randrange(size)
+        draw.rectangle((x, y, x + rng.randrange(size // 2), y + rng.randrange(size // 2)),
+                       fill=tuple(rng.randrange(256) for _ in range(3)))
+    out = io.BytesIO()
+    image.save(out, "JPEG", quality=90)
+    return out.getvalue()
+
+
+def failed(response):
+    """Whether a response is an error status or one of the views' error redirects."""
+    if response.status_code >= 400:
+        return True
+    return response.status_code in (301, 302) \
+        and response["Location"].split("?", 1)[0] in ERROR_REDIRECTS
+
+
+class Command(BaseCommand):
+    """Drive the real views concurrently against local stand-in API servers.
+
+    Runs on a throwaway database, with the AliExpress client and the Shopify
+    session pointed at the stand-ins, which run in child processes.
+    """
+
+    help = "Load-test the AliExpress and Shopify views offline and report latency and memory."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                            help=f"Comma separated scenarios among: {', '.join(SCENARIOS)}.")
+        parser.add_argument("--requests", type=int, default=200,
+                            help="Measured requests per scenario.")
+        parser.add_argument("--concurrency", type=int, default=16,
+                            help="Requests in flight at the same time.")
+        parser.add_argument("--distinct", type=int, default=50,
+                            help="Distinct products, keywords, pages or images requested per "
+                                 "scenario; 0 makes every request distinct (all cache misses).")
+        parser.add_argument("--warmup", type=int, default=5,
+                            help="Unmeasured requests per scenario, on keys outside the pool.")
+        parser.add_argument("--latency", type=float, default=80,
+                            help="Median AliExpress stand-in latency in ms.")
+        parser.add_argument("--shopify-latency", type=float, default=120,
+                            help="Median Shopify stand-in latency in ms.")
+        parser.add_argument("--jitter", type=float, default=0.5,
+                            help="Sigma of the log-normal latency spread; 0 makes it constant.")
+        parser.add_argument("--error-rate", type=float, default=0.0,
+                            help="Share of stand-in answers that are 503 errors.")
+        parser.add_argument("--description-kb", type=int, default=100,
+                            help="Product description size in KB.")
+        parser.add_argument("--skus", type=int, default=6, help="SKUs per product.")
+        parser.add_argument("--images", type=int, default=8, help="Images per product.")
+        parser.add_argument("--image-results", type=int, default=20,
+                            help="Products per image search answer.")
+        parser.add_argument("--image-size", type=int, default=800,
+                            help="Side in pixels of the uploaded search images.")
+        parser.add_argument("--shopify-products", type=int, default=10,
+                            help="Products per Shopify GraphQL answer.")
+        parser.add_argument("--keep-rate-limits", action="store_true",
+                            help="Apply the configured AliExpress rate limits.")
+        parser.add_argument("--configured-cache", action="store_true",
+                            help="Use the configured Django cache instead of a private "
+                                 "local-memory one.")
+        parser.add_argument("--tracemalloc", action="store_true",
+                            help="Also report the peak Python allocations; slows every request.")
+        parser.add_argument("--logs", action="store_true",
+                            help="Keep the application logs; by default they are silenced so "
+                                 "injected errors do not bury the results.")
+        parser.add_argument("--json", help="Also write the results to this file.")
+
+    def handle(self, *args, **options):
+        names = [name.strip() for name in options["scenarios"].split(",") if name.strip()]
+        unknown = [name for name in names if name not in SCENARIOS]
+        if unknown:
+            raise CommandError(f"Unknown scenarios: {', '.join(unknown)}")
+
+        processes = []
+        with ExitStack() as stack:
+            stack.callback(lambda: [process.terminate() for process in processes])
+            if not options["logs"]:
+                logging.disable(logging.ERROR)
+                stack.callback(logging.disable, logging.NOTSET)
+            aliexpress_process, aliexpress_url = start_server(AliExpressStandIn, {
+                "latency_ms": options["latency"], "jitter": options["jitter"],
+                "error_rate": options["error_rate"], "skus": options["skus"],
+                "images": options["images"], "description_kb": options["description_kb"],
+                "image_results": options["image_results"],
+            })
+            processes.append(aliexpress_process)
+            shopify_process, shopify_url = start_server(ShopifyStandIn, {
+                "latency_ms": options["shopify_latency"], "jitter": options["jitter"],
+                "error_rate": options["error_rate"], "products": options["shopify_products"],
+            })
+            processes.append(shopify_process)
+            self._point_at(stack, aliexpress_url, shopify_url, options)
+            self._use_test_database(stack)
+            store, cookies = self._seed()
+
+            results = []
+            self.stdout.write(
+                f"{'scenario':<20}{'reqs':>6}{'errs':>6}{'req/s':>9}{'p50 ms':>9}"
+                f"{'p95 ms':>9}{'p99 ms':>9}{'upstream':>10}{'rss MB':>9}"
+                + (f"{'py peak MB':>12}" if options["tracemalloc"] else "")
+            )
+            if options["tracemalloc"]:
+                tracemalloc.start()
+                stack.callback(tracemalloc.stop)
+            for index, name in enumerate(names):
+                result = self._scenario(index, name, store, cookies, options,
+                                        (aliexpress_url, shopify_url))
+                results.append(result)
+                self.stdout.write(
+                    f"{name:<20}{result['requests']:>6}{result['errors']:>6}"
+                    f"{result['throughput']:>9.1f}{result['p50_ms']:>9.1f}"
+                    f"{result['p95_ms']:>9.1f}{result['p99_ms']:>9.1f}"
+                    f"{result['upstream_calls']:>10}{result['rss_mb']:>9.1f}"
+                    + (f"{result['py_peak_mb']:>12.1f}" if options["tracemalloc"] else "")
+                )
+
+        if options["json"]:
+            Path(options["json"]).write_text(
+                json.dumps({"options": options, "results": results}, indent=2, default=str),
+                encoding="utf-8",
+            )
+
+    @staticmethod
+    def _point_at(stack, aliexpress_url, shopify_url, options):
+        """Route the clients to the stand-ins for the rest of the run."""
+        stack.enter_context(mock.patch.object(aliexpress_client, "ALIEXPRESS_API_URL",
+                                              aliexpress_url))
+        if not options["keep_rate_limits"]:
+            # Buckets are created on first use, so no call has been limited yet
+            stack.enter_context(mock.patch.object(rate_limiter, "limits", {}))
+            stack.enter_context(mock.patch.object(rate_limiter, "default", (0, 0)))
+
+        # shopify.Session keeps the first label of the shop URL and appends its
+        # domain: shop "127" on domain "0.0.1" is the stand-in's 127.0.0.1
+        port = int(shopify_url.rsplit(":", 1)[1])
+        stack.enter_context(mock.patch.object(shopify.Session, "protocol", "http"))
+        stack.enter_context(mock.patch.object(shopify.Session, "myshopify_domain", "0.0.1"))
+        stack.enter_context(mock.patch.object(shopify.Session, "port", port))
+        stack.enter_context(mock.patch.dict(os.environ, {
+            "SHOPIFY_CLIENT_ID": "bench", "SHOPIFY_CLIENT_SECRET": "bench",
+            "SHOPIFY_API_VERSION": "2024-01",
+        }))
+
+        overrides = {"ALLOWED_HOSTS": [*settings.ALLOWED_HOSTS, "testserver"]}
+        if not options["configured_cache"]:
+            overrides["CACHES"] = {"default": {
+                "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+                "LOCATION": "bench_views",
+            }}
+        stack.enter_context(override_settings(**overrides))
+
+    @staticmethod
+    def _use_test_database(stack):
+        """Migrate a throwaway database, dropped when the run ends."""
+        if connection.vendor == "sqlite":
+            # A file rather than memory: the request threads each open their own connection
+            directory = tempfile.mkdtemp(prefix="bench_views")
+            stack.callback(shutil.rmtree, directory, ignore_errors=True)
+            connection.settings_dict["TEST"]["NAME"] = str(Path(directory) / "bench.sqlite3")
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False
+        )
+        stack.callback(connection.creation.destroy_test_db, old_name, verbosity=0)
+
+    @staticmethod
+    def _seed():
+        """Create the AliExpress token, the active Shopify store and a logged-in staff user.
+
+        Returns:
+            tuple: The store and the staff user's session cookies
+        """
+        AliExpressToken.objects.create( # pylint: disable=E1101
+            account="bench", access_token="bench", refresh_token="bench",
+            expires_at=int(time.time()) + 30 * 86400, is_active=True,
+        )
+        store = ShopStore.objects.create( # pylint: disable=E1101
+            shop_url="127", access_token="bench", is_active=True
+        )
+        # The views spending the shared AliExpress token are staff only
+        staff = get_user_model().objects.create_user("bench", is_staff=True)
+        login = Client()
+        login.force_login(staff)
+        return store, {key: morsel.value for key, morsel in login.cookies.items()}
+
+    def _scenario(self, index, name, store, cookies, options, servers):
+        """Run one scenario and return its measurements."""
+        use_async, method, path = SCENARIOS[name]
+        first_id = FIRST_PRODUCT_ID + index * SCENARIO_ID_SPAN
+        # Pool keys, then warm-up keys counted down from the end of the id span
+        rng = random.Random(index)
+        distinct = options["distinct"]
+        keys = [rng.randrange(distinct) if distinct else key
+                for key in range(options["requests"])]
+        warmup = [SCENARIO_ID_SPAN - 1 - key for key in range(options["warmup"])]
+
+        if name == "shopify_push":
+            Product.objects.bulk_create( # pylint: disable=E1101
+                Product(title=f"Bench product {key}", description="<p>Bench</p>",
+                        price="19.90", aliexpress_id=str(first_id + key), stock=10)
+                for key in set(keys + warmup)
+            )
+
+        images = {}
+        if name.startswith("image_search"):
+            for key in set(keys + warmup):
+                images[key] = sample_image(index * SCENARIO_ID_SPAN + key, options["image_size"])
+
+        def build(key):
+            target = path.format(
+                product_id=first_id + key,
+                tag=f"s{index}", key=key, page=key % FEED_PAGES + 1, store_id=store.id,
+            )
+            data = None
+            if name.startswith("image_search"):
+                data = {"image_file": SimpleUploadedFile(
+                    f"bench{key}.jpg", images[key], content_type="image/jpeg"
+                )}
+            return method, target, data
+
+        run = self._run_async if use_async else self._run_sync
+        run([build(key) for key in warmup], options["concurrency"], cookies)
+
+        before = [sum(server_counts(url).values()) for url in servers]
+        if options["tracemalloc"]:
+            tracemalloc.reset_peak()
+        started = time.perf_counter()
+        timings = run([build(key) for key in keys], options["concurrency"], cookies)
+        elapsed = time.perf_counter() - started
+        after = [sum(server_counts(url).values()) for url in servers]
+
+        latencies = sorted(seconds * 1000 for seconds, _error in timings)
+        result = {
+            "scenario": name,
+            "requests": len(timings),
+            "errors": sum(1 for _seconds, error in timings if error),
+            "throughput": len(timings) / elapsed if elapsed else 0.0,
+            "p50_ms": percentile(latencies, 0.50),
+            "p95_ms": percentile(latencies, 0.95),
+            "p99_ms": percentile(latencies, 0.99),
+            "upstream_calls": sum(after) - sum(before),
+            "rss_mb": rss_mb(),
+        }
+        if options["tracemalloc"]:
+            result["py_peak_mb"] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        return result
+
+    @staticmethod
+    def _run_sync(requests, concurrency, cookies):
+        """Send ``requests`` through the WSGI handler from a thread pool."""
+        local = threading.local()
+
+        def send(request):
+            method, path, data = request
+            client = getattr(local, "client", None)
+            if client is None:
+                client = local.client = Client(raise_request_exception=False)
+                client.cookies.load(cookies)
+            started = time.perf_counter()
+            response = getattr(client, method)(path, data)
+            return time.perf_counter() - started, failed(response)
+
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="bench") as pool:
+            return list(pool.map(send, requests))
+
+    @staticmethod
+    def _run_async(requests, concurrency, cookies):
+        """Send ``requests`` through the ASGI handler on one event loop."""
+
+        async def main():
+            client = AsyncClient(raise_request_exception=False)
+            client.cookies.load(cookies)
+            slots = asyncio.Semaphore(concurrency)
+
+            async def send(request):
+                method, path, data = request
+                async with slots:
+                    started = time.perf_counter()
+                    response = await getattr(client, method)(path, data)
+                    return time.perf_counter() - started, failed(response)
+
+            return await asyncio.gather(*(send(request) for request in requests))
+
+        return asyncio.run(main())
@@ -0,0 +1,90 @@
+"""Crawl a whole recommend feed into the local catalog."""
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from app_aliexpress.catalog import entry_from_listing, record_products
+from app_aliexpress.client import AliExpressAPIError
+from app_aliexpress.crawler import iter_feed_pages
+from app_aliexpress.models import FeedCrawl
+
+
+class Command(BaseCommand):
+    """Stream every page of a recommend feed into CatalogProduct, resumably."""
+
+    help = "Crawl every page of a recommend feed into the local catalog, resuming " \
+        "from the last stored page after a failure."
+
+    def add_arguments(self, parser):
+        parser.add_argument("feed_name", help="Recommend feed name, as listed by feedname/.")
+        parser.add_argument("--page-size", type=int, default=50,
+                            help="Products per API page.")
+        parser.add_argument("--concurrency", type=int, default=4,
+                            help="Pages fetched concurrently.")
+        parser.add_argument("--batch-size", type=int, default=500,
+                            help="Products per bulk upsert; the checkpoint moves after each.")
+        parser.add_argument("--max-pages", type=int, default=None,
+                            help="Stop after this many pages in this run.")
+        parser.add_argument("--restart", action="store_true",
+                            help="Ignore the checkpoint and crawl from page 1.")
+
+    def handle(self, *args, **options):
+        for option in ("page_size", "concurrency", "batch_size", "max_pages"):
+            if options[option] is not None and options[option] < 1:
+                raise CommandError(f"--{option.replace('_', '-')} must be at least 1.")
+
+        feed_name = options["feed_name"]
+        crawl, _created = FeedCrawl.objects.get_or_create(feed_name=feed_name) # pylint: disable=E1101
+        if options["restart"] or crawl.finished_at is not None:
+            # A finished crawl starts the next snapshot over
+            crawl.last_page = 0
+            crawl.products = 0
+            crawl.finished_at = None
+            crawl.save()
+        elif crawl.last_page:
+            self.stdout.write(f"Resuming {feed_name} after page {crawl.last_page}")
+
+        started = time.perf_counter()
+        batch = []
+        batch_last_page = crawl.last_page
+        pages = iter_feed_pages(
+            feed_name,
+            start_page=crawl.last_page + 1,
+            page_size=options["page_size"],
+            concurrency=options["concurrency"],
+            max_pages=options["max_pages"],
+        )
+        try:
+            for page_no, products, total_pages in pages:
+                batch.extend(entry_from_listing(item) for item in products)
+                batch_last_page = page_no
+                crawl.total_pages = total_pages
+                if len(batch) >= options["batch_size"]:
+                    self._flush(crawl, batch, batch_last_page)
+                    batch = []
+            self._flush(crawl, batch, batch_last_page)
+        except AliExpressAPIError as exc:
+            # Pages fetched before the failure are kept; the next run resumes after them
+            self._flush(crawl, batch, batch_last_page)
+            raise CommandError(
+                f"{exc} (stopped after page {crawl.last_page}; run again to resume)"
+            ) from exc
+
+        if crawl.total_pages and crawl.last_page >= crawl.total_pages:
+            crawl.finished_at = timezone.now()
+            crawl.save(update_fields=["finished_at", "alter_at"])
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{feed_name}: page {crawl.last_page} of {crawl.total_pages}, "
+            f"{crawl.products} products stored in {time.perf_counter() - started:.1f}s"
+        ))
+
+    def _flush(self, crawl, batch, last_page):
+        """Upsert a batch, then move the checkpoint past its pages."""
+        if batch:
+            crawl.products += record_products(batch, "feed", raise_errors=True)
+        if last_page != crawl.last_page:
+            crawl.last_page = last_page
+            crawl.save(update_fields=["last_page", "total_pages", "products", "alter_at"])
+            self.stdout.write(f"  stored through page {last_page} ({crawl.products} products)")
@@ -0,0 +1,37 @@
+"""Scrape-time metrics of the AliExpress caches and circuit breakers."""
+from core.metrics import register_collector
+
+from .cache import cache_stats
+from .resilience import CircuitBreaker, breakers
+
+_BREAKER_STATES = {CircuitBreaker.CLOSED: 0, CircuitBreaker.HALF_OPEN: 1, CircuitBreaker.OPEN: 2}
+
+
+@register_collector
+def collect_cache_metrics():
+    """Hit, miss and stale-serve counters and hit ratio of every cache."""
+    stats = cache_stats()
+    rows = [({"cache": name}, counters) for name, counters in stats.items()]
+    return [
+        ("aliexpress_cache_hits_total", "counter", "Cache lookups answered from the cache.",
+         [(labels, counters["hits"]) for labels, counters in rows]),
+        ("aliexpress_cache_misses_total", "counter", "Cache lookups that missed.",
+         [(labels, counters["misses"]) for labels, counters in rows]),
+        ("aliexpress_cache_stale_total", "counter",
+         "Expired entries served because the API call failed.",
+         [(labels, counters["stale"]) for labels, counters in rows]),
+        ("aliexpress_cache_hit_ratio", "gauge", "Hits over lookups since start.",
+         [(labels, counters["hit_ratio"]) for labels, counters in rows
+          if counters["hit_ratio"] is not None]),
+    ]
+
+
+@register_collector
+def collect_breaker_metrics():
+    """Circuit breaker state per API method: 0 closed, 1 half-open, 2 open."""
+    return [
+        ("aliexpress_circuit_state", "gauge",
+         "Circuit breaker state per API method: 0 closed, 1 half-open, 2 open.",
+         [({"method": method}, _BREAKER_STATES[breaker.state])
+          for method, breaker in breakers.items()]),
+    ]
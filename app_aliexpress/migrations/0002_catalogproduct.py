@@ -0,0 +1,73 @@
+# Generated by Django 4.2.19 on 2026-10-18 06:34
+
+from django.db import migrations, models
+
+FTS_TABLE = "app_aliexpress_catalogproduct_fts"
+CATALOG_TABLE = "app_aliexpress_catalogproduct"
+
+# External-content FTS5 index over subject and description, kept in step by triggers
+CREATE_FTS = [
+    f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5("
+    f"subject, description, content='{CATALOG_TABLE}', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2')",
+    f"CREATE TRIGGER {FTS_TABLE}_ai AFTER INSERT ON {CATALOG_TABLE} BEGIN "
+    f"INSERT INTO {FTS_TABLE}(rowid, subject, description) "
+    "VALUES (new.id, new.subject, new.description); END",
+    f"CREATE TRIGGER {FTS_TABLE}_ad AFTER DELETE ON {CATALOG_TABLE} BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, subject, description) "
+    "VALUES ('delete', old.id, old.subject, old.description); END",
+    f"CREATE TRIGGER {FTS_TABLE}_au AFTER UPDATE OF subject, description ON {CATALOG_TABLE} "
+    f"BEGIN INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, subject, description) "
+    "VALUES ('delete', old.id, old.subject, old.description); "
+    f"INSERT INTO {FTS_TABLE}(rowid, subject, description) "
+    "VALUES (new.id, new.subject, new.description); END",
+]
+DROP_FTS = [
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_au",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_ad",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_ai",
+    f"DROP TABLE IF EXISTS {FTS_TABLE}",
+]
+
+
+def create_fts_index(apps, schema_editor): # pylint: disable=W0613
+    """Create the FTS5 index on SQLite; other backends search with LIKE."""
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    for statement in CREATE_FTS:
+        schema_editor.execute(statement)
+
+
+def drop_fts_index(apps, schema_editor): # pylint: disable=W0613
+    """Drop the FTS5 index and its triggers."""
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    for statement in DROP_FTS:
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_aliexpress', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogProduct',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('aliexpress_id', models.CharField(max_length=100, unique=True)),
+                ('subject', models.CharField(max_length=512)),
+                ('description', models.TextField(blank=True, help_text='Plain text of the product description.')),
+                ('category', models.CharField(blank=True, db_index=True, max_length=100)),
+                ('price', models.DecimalField(blank=True, db_index=True, decimal_places=2, max_digits=12, null=True)),
+                ('currency', models.CharField(blank=True, max_length=10)),
+                ('image_url', models.URLField(blank=True, max_length=512)),
+                ('source', models.CharField(choices=[('detail', 'Product detail'), ('search', 'Text search'), ('image', 'Image search'), ('feed', 'Recommend feed')], max_length=10)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('alter_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(create_fts_index, drop_fts_index),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.19 on 2026-10-18 06:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_aliexpress', '0002_catalogproduct'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeedCrawl',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('feed_name', models.CharField(max_length=255, unique=True)),
+                ('last_page', models.IntegerField(default=0, help_text='Last page whose products are stored.')),
+                ('total_pages', models.IntegerField(default=0)),
+                ('products', models.IntegerField(default=0)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('alter_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
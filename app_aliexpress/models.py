@@ -1,3 +1,54 @@
+"""Module providing a function database."""
 from django.db import models
 
-# Create your models here.
+class AliExpressToken(models.Model):
+    """ Database AliExpress account token """
+    account = models.CharField(max_length=100, unique=True)
+    access_token = models.CharField(max_length=255)
+    refresh_token = models.CharField(max_length=255)
+    expires_at = models.BigIntegerField(help_text="Access token expiry, epoch seconds.")
+    is_active = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    alter_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"AliExpressToken {self.account}"
+
+
+class CatalogProduct(models.Model):
+    """ Database AliExpress product seen in a detail, search or feed response """
+    SOURCE_CHOICES = [
+        ("detail", "Product detail"),
+        ("search", "Text search"),
+        ("image", "Image search"),
+        ("feed", "Recommend feed"),
+    ]
+
+    aliexpress_id = models.CharField(max_length=100, unique=True)
+    subject = models.CharField(max_length=512)
+    description = models.TextField(blank=True, help_text="Plain text of the product description.")
+    category = models.CharField(max_length=100, blank=True, db_index=True)
+    price = models.DecimalField(max_digits=12, decimal_places=2, blank=True, null=True,
+                                db_index=True)
+    currency = models.CharField(max_length=10, blank=True)
+    image_url = models.URLField(max_length=512, blank=True)
+    source = models.CharField(max_length=10, choices=SOURCE_CHOICES)
+    created_at = models.DateTimeField(auto_now_add=True)
+    alter_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"CatalogProduct {self.aliexpress_id}"
+
+
+class FeedCrawl(models.Model):
+    """ Database recommend feed crawl checkpoint """
+    feed_name = models.CharField(max_length=255, unique=True)
+    last_page = models.IntegerField(default=0, help_text="Last page whose products are stored.")
+    total_pages = models.IntegerField(default=0)
+    products = models.IntegerField(default=0)
+    finished_at = models.DateTimeField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    alter_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"FeedCrawl {self.feed_name}"
@@ -0,0 +1,183 @@
+"""Token-bucket rate limiting of AliExpress API calls, with priority lanes."""
+import asyncio
+from contextlib import contextmanager
+import contextvars
+import threading
+import time
+
+from decouple import Csv, config
+
+# Interactive views run in the high lane; prefetches, batches and crawls in the low one
+HIGH = "high"
+LOW = "low"
+
+# Calls per second and burst of every method without its own entry; 0 disables limiting
+ALIEXPRESS_RATE_LIMIT_DEFAULT = config("ALIEXPRESS_RATE_LIMIT_DEFAULT", default=10, cast=float)
+ALIEXPRESS_RATE_LIMIT_BURST = config("ALIEXPRESS_RATE_LIMIT_BURST", default=10, cast=float)
+# Per-method overrides: "aliexpress.ds.freight.query=20/40,aliexpress.ds.text.search=5"
+ALIEXPRESS_RATE_LIMITS = config("ALIEXPRESS_RATE_LIMITS", default="", cast=Csv())
+# Share of each bucket the low lane may never take, kept for interactive calls
+ALIEXPRESS_RATE_LIMIT_RESERVE = config("ALIEXPRESS_RATE_LIMIT_RESERVE", default=0.25, cast=float)
+# Longest a high-priority call waits for a token before failing
+ALIEXPRESS_RATE_LIMIT_MAX_WAIT = config("ALIEXPRESS_RATE_LIMIT_MAX_WAIT", default=5, cast=float)
+
+_priority = contextvars.ContextVar("aliexpress_priority", default=HIGH)
+
+
+def current_priority():
+    """Lane of the calls made in the current context."""
+    return _priority.get()
+
+
+@contextmanager
+def priority(lane):
+    """Run the calls made inside the block in ``lane``."""
+    token = _priority.set(lane)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def call_with_priority(lane, fn, *args, **kwargs):
+    """Call ``fn`` in ``lane``; for work handed to executor threads."""
+    with priority(lane):
+        return fn(*args, **kwargs)
+
+
+def parse_rate_limits(entries):
+    """``{method: (rate, burst)}`` from "method=rate[/burst]" entries."""
+    limits = {}
+    for entry in entries:
+        method, _sep, spec = entry.partition("=")
+        rate, _sep, burst = spec.partition("/")
+        limits[method.strip()] = (float(rate), float(burst or rate))
+    return limits
+
+
+class TokenBucket:
+    """Token bucket refilled at ``rate`` tokens per second up to ``burst``.
+
+    The low lane only takes tokens above ``reserve`` and yields to waiting
+    high-priority callers, so it can use the whole steady-state rate while
+    interactive calls still find tokens for their bursts.
+    """
+
+    def __init__(self, rate, burst, reserve=ALIEXPRESS_RATE_LIMIT_RESERVE):
+        self.rate = rate
+        self.burst = max(burst, 1.0)
+        self.floor = min(reserve * self.burst, self.burst - 1.0)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._high_waiting = 0
+        self._lock = threading.Lock()
+
+    def try_acquire(self, lane=HIGH):
+        """Take a token if ``lane`` may have one.
+
+        Returns:
+            float: 0 when a token was taken, else seconds until one may be free
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            floor = 0.0 if lane == HIGH else self.floor
+            if lane != HIGH and self._high_waiting:
+                return 1.0 / self.rate
+            if self._tokens >= floor + 1.0:
+                self._tokens -= 1.0
+                return 0.0
+            return (floor + 1.0 - self._tokens) / self.rate
+
+    def _waiting(self, lane, delta):
+        if lane == HIGH:
+            with self._lock:
+                self._high_waiting += delta
+
+    def acquire(self, lane=HIGH, timeout=None):
+        """Block until a token is taken; False when ``timeout`` would be exceeded."""
+        wait = self.try_acquire(lane)
+        if not wait:
+            return True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        self._waiting(lane, 1)
+        try:
+            while wait:
+                if deadline is not None and time.monotonic() + wait > deadline:
+                    return False
+                time.sleep(wait)
+                wait = self.try_acquire(lane)
+            return True
+        finally:
+            self._waiting(lane, -1)
+
+    async def acquire_async(self, lane=HIGH, timeout=None):
+        """Async counterpart of :meth:`acquire`, sleeping on the event loop."""
+        wait = self.try_acquire(lane)
+        if not wait:
+            return True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        self._waiting(lane, 1)
+        try:
+            while wait:
+                if deadline is not None and time.monotonic() + wait > deadline:
+                    return False
+                await asyncio.sleep(wait)
+                wait = self.try_acquire(lane)
+            return True
+        finally:
+            self._waiting(lane, -1)
+
+
+class RateLimiter:
+    """One token bucket per API method, shared by every client in the process.
+
+    Args:
+        limits: ``{method: (rate, burst)}`` overrides
+        default: ``(rate, burst)`` of the other methods; a rate of 0 disables them
+        max_wait: Longest a high-priority call waits; low-priority calls wait as needed
+    """
+
+    def __init__(self, limits=None,
+                 default=(ALIEXPRESS_RATE_LIMIT_DEFAULT, ALIEXPRESS_RATE_LIMIT_BURST),
+                 max_wait=ALIEXPRESS_RATE_LIMIT_MAX_WAIT):
+        self.limits = parse_rate_limits(ALIEXPRESS_RATE_LIMITS) if limits is None else limits
+        self.default = default
+        self.max_wait = max_wait
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, method):
+        """Bucket of ``method``, or None when it is not limited."""
+        bucket = self._buckets.get(method)
+        if bucket is None and method not in self._buckets:
+            with self._lock:
+                if method not in self._buckets:
+                    rate, burst = self.limits.get(method, self.default)
+                    self._buckets[method] = TokenBucket(rate, burst) if rate > 0 else None
+                bucket = self._buckets[method]
+        return bucket
+
+    def _timeout(self, lane):
+        return self.max_wait if lane == HIGH else None
+
+    def acquire(self, method, lane=None):
+        """Wait for a call slot of ``method``; False when the wait limit was hit."""
+        bucket = self.bucket(method)
+        lane = lane or current_priority()
+        return bucket is None or bucket.acquire(lane, self._timeout(lane))
+
+    def try_acquire(self, method, lane=None):
+        """Take a call slot of ``method`` only if one is free right now."""
+        bucket = self.bucket(method)
+        return bucket is None or not bucket.try_acquire(lane or current_priority())
+
+    async def acquire_async(self, method, lane=None):
+        """Async counterpart of :meth:`acquire`."""
+        bucket = self.bucket(method)
+        lane = lane or current_priority()
+        return bucket is None or await bucket.acquire_async(lane, self._timeout(lane))
+
+
+rate_limiter = RateLimiter()
@@ -0,0 +1,175 @@
+"""Retry, hedging and circuit breaking policies for AliExpress API calls."""
+from collections import deque
+import logging
+import random
+import threading
+import time
+
+from decouple import Csv, config
+
+logger = logging.getLogger(__name__)
+
+# Read-only queries: safe to send more than once
+ALIEXPRESS_IDEMPOTENT_METHODS = frozenset(config(
+    "ALIEXPRESS_IDEMPOTENT_METHODS",
+    default="aliexpress.ds.product.get,aliexpress.ds.freight.query,aliexpress.ds.text.search,"
+            "aliexpress.ds.recommend.feed.get,aliexpress.ds.feedname.get,"
+            "aliexpress.ds.image.searchV2",
+    cast=Csv(),
+))
+ALIEXPRESS_RETRIES = config("ALIEXPRESS_RETRIES", default=2, cast=int)
+ALIEXPRESS_RETRY_BASE_DELAY = config("ALIEXPRESS_RETRY_BASE_DELAY", default=0.1, cast=float)
+ALIEXPRESS_RETRY_MAX_DELAY = config("ALIEXPRESS_RETRY_MAX_DELAY", default=1.0, cast=float)
+ALIEXPRESS_HEDGE_REQUESTS = config("ALIEXPRESS_HEDGE_REQUESTS", default=False, cast=bool)
+ALIEXPRESS_HEDGE_QUANTILE = config("ALIEXPRESS_HEDGE_QUANTILE", default=0.95, cast=float)
+ALIEXPRESS_HEDGE_MIN_SAMPLES = config("ALIEXPRESS_HEDGE_MIN_SAMPLES", default=20, cast=int)
+ALIEXPRESS_HEDGE_MIN_DELAY = config("ALIEXPRESS_HEDGE_MIN_DELAY", default=0.05, cast=float)
+ALIEXPRESS_BREAKER_FAILURES = config("ALIEXPRESS_BREAKER_FAILURES", default=5, cast=int)
+ALIEXPRESS_BREAKER_RESET = config("ALIEXPRESS_BREAKER_RESET", default=30, cast=float)
+
+# Upstream answers worth another attempt; other 4xx will fail the same way again
+RETRIABLE_STATUS = frozenset((408, 429, 500, 502, 503, 504))
+
+
+def is_idempotent(method):
+    """Whether ``method`` may be retried or hedged."""
+    return method in ALIEXPRESS_IDEMPOTENT_METHODS
+
+
+def backoff_delay(attempt, base=ALIEXPRESS_RETRY_BASE_DELAY, cap=ALIEXPRESS_RETRY_MAX_DELAY):
+    """Full-jitter exponential backoff before retry number ``attempt + 1``."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class LatencyTracker:
+    """Rolling latency samples of one method, for the hedging delay.
+
+    The quantile is recomputed every ``window // 10`` samples rather than on
+    every call.
+    """
+
+    def __init__(self, window=200, quantile=ALIEXPRESS_HEDGE_QUANTILE,
+                 min_samples=ALIEXPRESS_HEDGE_MIN_SAMPLES):
+        self.quantile = quantile
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=window)
+        self._recompute_every = max(1, window // 10)
+        self._since_recompute = 0
+        self._cached = None
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        """Add one successful call's latency."""
+        with self._lock:
+            self._samples.append(seconds)
+            self._since_recompute += 1
+            if self._since_recompute >= self._recompute_every:
+                self._cached = None
+
+    def value(self):
+        """Current latency quantile, or None until ``min_samples`` were seen."""
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return None
+            if self._cached is None:
+                ordered = sorted(self._samples)
+                self._cached = ordered[min(len(ordered) - 1, int(len(ordered) * self.quantile))]
+                self._since_recompute = 0
+            return self._cached
+
+
+class CircuitBreaker:
+    """Fail fast after ``failures`` consecutive failed calls, for ``reset`` seconds.
+
+    Once ``reset`` has passed a single trial call is let through: success
+    closes the circuit again, failure re-opens it. A trial that reports
+    neither outcome frees the slot after another ``reset`` seconds.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name, failures=ALIEXPRESS_BREAKER_FAILURES, reset=ALIEXPRESS_BREAKER_RESET):
+        self.name = name
+        self.failures = failures
+        self.reset = reset
+        self.state = self.CLOSED
+        self._consecutive = 0
+        self._opened_at = 0.0
+        self._trial_at = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Whether a call may be sent now."""
+        if self.failures <= 0 or self.state == self.CLOSED:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            if self.state == self.OPEN and now - self._opened_at >= self.reset:
+                self.state = self.HALF_OPEN
+                self._trial_at = None
+            if self.state != self.HALF_OPEN:
+                return False
+            if self._trial_at is not None and now - self._trial_at < self.reset:
+                return False
+            self._trial_at = now
+            return True
+
+    def record_success(self):
+        """Close the circuit after a successful call."""
+        if self.state == self.CLOSED and not self._consecutive:
+            return
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.info("AliExpress circuit %s closed", self.name)
+            self.state = self.CLOSED
+            self._consecutive = 0
+
+    def record_failure(self):
+        """Count a failed call, opening the circuit when the threshold is reached."""
+        with self._lock:
+            self._consecutive += 1
+            if self.state == self.HALF_OPEN or (
+                    self.state == self.CLOSED and 0 < self.failures <= self._consecutive):
+                logger.warning("AliExpress circuit %s opened after %s failures",
+                               self.name, self._consecutive)
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+
+
+class _PerMethod:
+    """Lazily created per-method policy objects."""
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._items = {}
+        self._lock = threading.Lock()
+
+    def get(self, method):
+        """Policy object of ``method``, created on first use."""
+        item = self._items.get(method)
+        if item is None:
+            with self._lock:
+                item = self._items.get(method)
+                if item is None:
+                    item = self._items[method] = self._factory(method)
+        return item
+
+    def items(self):
+        """``(method, policy object)`` pairs created so far."""
+        return list(self._items.items())
+
+
+breakers = _PerMethod(CircuitBreaker)
+latencies = _PerMethod(lambda method: LatencyTracker())
+
+
+def hedge_delay(method):
+    """Seconds to wait before hedging a call to ``method``, or None to not hedge."""
+    if not ALIEXPRESS_HEDGE_REQUESTS or not is_idempotent(method):
+        return None
+    quantile = latencies.get(method).value()
+    if quantile is None:
+        return None
+    return max(quantile, ALIEXPRESS_HEDGE_MIN_DELAY)
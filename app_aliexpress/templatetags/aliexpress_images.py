@@ -0,0 +1,29 @@
+"""Template filters for AliExpress product images."""
+from urllib.parse import urlencode
+
+from django import template
+from django.urls import reverse
+
+from app_aliexpress.images import (
+    allowed_image_url,
+    image_signature,
+    normalize_image_url,
+    snap_width,
+)
+
+register = template.Library()
+
+
+@register.filter
+def image_proxy(url, width=800):
+    """URL of ``url`` resized to ``width`` through the image proxy.
+
+    URLs outside the proxied hosts are returned unchanged; the others are
+    signed, as the proxy only serves URLs it handed out.
+    """
+    url = normalize_image_url(url)
+    if not allowed_image_url(url):
+        return url
+    width = snap_width(width)
+    query = urlencode({"url": url, "w": width, "s": image_signature(url, width)})
+    return f"{reverse('image_proxy_aliexpress')}?{query}"
@@ -1,3 +1,977 @@
-from django.test import TestCase
+import asyncio
+import base64
+from decimal import Decimal
+import json
+import os
+from io import BytesIO, StringIO
+from pathlib import Path
+import tempfile
+import threading
+import time
+from unittest import mock
+from urllib.parse import parse_qs, urlsplit
 
-# Create your tests here.
+from PIL import Image, ImageDraw, ImageOps
+from django.contrib.auth import get_user_model
+from django.core.cache import cache as shared_cache
+from django.core.management import CommandError, call_command
+from django.http import HttpResponse
+from django.test import Client, RequestFactory, SimpleTestCase, TestCase
+from django.urls import reverse
+
+from . import async_views, images, views
+from .benchmark import (
+    freight_query_payload,
+    product_get_payload,
+    recommend_feed_payload,
+    text_search_payload,
+)
+from .cache import (
+    AsyncSingleFlight,
+    LRUCache,
+    PerceptualHashCache,
+    ProductDetailCache,
+    RefreshingValue,
+    SingleFlight,
+    TieredCache,
+    feed_page_cache,
+    product_detail_cache,
+    text_search_cache,
+)
+from .catalog import DETAIL_FIELDS, parse_price, record_products, search_catalog
+from .client import AliExpressAPIError
+from .conditional import conditional_render
+from .description import IMG_STYLE, rewrite_description
+from .imagehash import hamming_distance, image_fingerprint
+from .images import DiskLRUCache, ImageProxyError, snap_width, valid_image_signature
+from .models import AliExpressToken, CatalogProduct, FeedCrawl
+from .ratelimit import HIGH, LOW, TokenBucket
+from .resilience import CircuitBreaker
+from .signing import Signer
+from .templatetags.aliexpress_images import image_proxy
+from .tokens import TokenStore
+
+
+class RewriteDescriptionTests(SimpleTestCase):
+    """ Responsive <img> rewriting of product descriptions """
+
+    def test_drops_size_attributes_and_adds_style(self):
+        self.assertEqual(
+            rewrite_description('<p>a</p><img src="x.jpg" width="750" height=300 style="float:left">'),
+            f'<p>a</p><img src="x.jpg" style="{IMG_STYLE}">',
+        )
+
+    def test_keeps_self_closing_tags_and_quoted_gt(self):
+        self.assertEqual(
+            rewrite_description("<IMG alt='a > b' src=\"y.png\" WIDTH=\"1\"/>"),
+            f"<img alt='a > b' src=\"y.png\" style=\"{IMG_STYLE}\"/>",
+        )
+
+    def test_leaves_other_markup_alone(self):
+        html = '<div width="10"><span style="color:red">text</span></div>'
+        self.assertEqual(rewrite_description(html), html)
+
+
+class SignerTests(SimpleTestCase):
+    """ Request signatures against fixed vectors """
+
+    def setUp(self):
+        self.signer = Signer(app_key="12345", app_secret="secret")
+
+    def test_rest_api_signs_the_api_name_first(self):
+        self.assertEqual(
+            self.signer.sign("/auth/token/create", {"code": "xyz", "app_key": "abc"}),
+            "52BE0DFDDBE16BAB71D4EFB26FAD54D741587F81941C4E9E8FBABD700577F66A",
+        )
+
+    def test_dotted_method_signs_sorted_parameters_only(self):
+        self.assertEqual(
+            self.signer.sign("aliexpress.ds.product.get", {
+                "product_id": "1005001", "method": "aliexpress.ds.product.get", "app_key": "12345",
+            }),
+            "F25D7221F406D0483282D5698D0F0427000ED071BBFFFB2AA066E9A453FCA9BB",
+        )
+
+    def test_build_signed_params(self):
+        with mock.patch("app_aliexpress.signing.time.time_ns", return_value=1_700_000_000_000_000_000):
+            signed = self.signer.build_signed_params(
+                "aliexpress.ds.product.get", {"product_id": 1005001}, access_token="tok"
+            )
+        self.assertEqual(signed, {
+            "app_key": "12345",
+            "timestamp": "1700000000000",
+            "sign_method": "sha256",
+            "method": "aliexpress.ds.product.get",
+            "access_token": "tok",
+            "product_id": "1005001",
+            "sign": "9DC4C7121871B5C840AF16353EE09D09BD560B32F60D194D2D5F912C62D2A2D5",
+        })
+
+
+class TokenBucketTests(SimpleTestCase):
+    """ Priority lanes of the rate limiter """
+
+    def test_low_lane_leaves_the_reserve_to_high(self):
+        # No meaningful refill during the test; floor = 2 of 4 tokens
+        bucket = TokenBucket(rate=0.001, burst=4, reserve=0.5)
+        self.assertEqual(bucket.try_acquire(LOW), 0.0)
+        self.assertEqual(bucket.try_acquire(LOW), 0.0)
+        self.assertGreater(bucket.try_acquire(LOW), 0.0)
+        self.assertEqual(bucket.try_acquire(HIGH), 0.0)
+        self.assertEqual(bucket.try_acquire(HIGH), 0.0)
+        self.assertGreater(bucket.try_acquire(HIGH), 0.0)
+
+    def test_low_lane_yields_to_waiting_high_callers(self):
+        bucket = TokenBucket(rate=0.001, burst=4, reserve=0.0)
+        bucket._waiting(HIGH, 1) # pylint: disable=W0212
+        self.assertGreater(bucket.try_acquire(LOW), 0.0)
+        bucket._waiting(HIGH, -1) # pylint: disable=W0212
+        self.assertEqual(bucket.try_acquire(LOW), 0.0)
+
+    def test_acquire_gives_up_after_timeout(self):
+        bucket = TokenBucket(rate=0.001, burst=1, reserve=0.0)
+        self.assertTrue(bucket.acquire(HIGH, timeout=0.01))
+        self.assertFalse(bucket.acquire(HIGH, timeout=0.01))
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    """ Open, half-open and closed transitions """
+
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch("app_aliexpress.resilience.time.monotonic", lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = CircuitBreaker("test", failures=2, reset=30)
+
+    def test_opens_after_consecutive_failures(self):
+        self.breaker.record_failure()
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(self.breaker.allow())
+
+    def test_success_resets_the_failure_count(self):
+        self.breaker.record_failure()
+        self.breaker.record_success()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_half_open_lets_one_trial_through(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.now += 30
+        self.assertTrue(self.breaker.allow())
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertFalse(self.breaker.allow())
+
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.assertTrue(self.breaker.allow())
+
+    def test_failed_trial_reopens(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.now += 30
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(self.breaker.allow())
+
+    def test_unreported_trial_frees_the_slot_after_reset(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.now += 30
+        self.assertTrue(self.breaker.allow())
+        self.now += 30
+        self.assertTrue(self.breaker.allow())
+
+
+class ImageProxyLimitTests(SimpleTestCase):
+    """ Width snapping, source size cap and cache budget of the image proxy """
+
+    def test_snap_width(self):
+        with mock.patch.object(images, "ALIEXPRESS_IMAGE_WIDTHS", [100, 200, 400]), \
+                mock.patch.object(images, "ALIEXPRESS_IMAGE_DEFAULT_WIDTH", 200):
+            self.assertEqual(snap_width(150), 200)
+            self.assertEqual(snap_width(100), 100)
+            self.assertEqual(snap_width(5000), 400)
+            self.assertEqual(snap_width("junk"), 200)
+
+    def test_download_rejects_sources_over_the_limit(self):
+        response = mock.MagicMock()
+        response.__enter__.return_value = response
+        response.is_redirect = False
+        response.raw.read.side_effect = lambda size, decode_content: b"x" * size
+        with mock.patch.object(images, "ALIEXPRESS_IMAGE_MAX_SOURCE_MB", 1), \
+                mock.patch.object(images._session, "get", return_value=response), \
+                mock.patch.object(images.image_cache, "set") as cache_set:
+            with self.assertRaises(ImageProxyError):
+                images._download("https://ae01.alicdn.com/big.jpg", "source|big") # pylint: disable=W0212
+        response.raw.read.assert_called_once_with(2 ** 20 + 1, decode_content=True)
+        cache_set.assert_not_called()
+
+    def test_download_does_not_follow_redirects(self):
+        response = mock.MagicMock()
+        response.__enter__.return_value = response
+        response.is_redirect = True
+        response.headers = {"Location": "http://169.254.169.254/"}
+        with mock.patch.object(images._session, "get", return_value=response) as get, \
+                mock.patch.object(images.image_cache, "set") as cache_set:
+            with self.assertRaises(ImageProxyError):
+                images._download("https://ae01.alicdn.com/a.jpg", "source|a") # pylint: disable=W0212
+        self.assertFalse(get.call_args.kwargs["allow_redirects"])
+        response.raw.read.assert_not_called()
+        cache_set.assert_not_called()
+
+    def test_disk_cache_evicts_least_recently_used_past_budget(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = DiskLRUCache(directory, max_bytes=300, low_water=0.7)
+            for age, key in enumerate(("c", "b", "a"), start=1):
+                cache.set(key, key.encode() * 100)
+                old = time.time() - 10 * age
+                os.utime(cache._path(key), (old, old)) # pylint: disable=W0212
+            # Reading "a" makes it the most recently used entry
+            self.assertEqual(cache.get("a"), b"a" * 100)
+
+            cache.set("d", b"d" * 100)
+
+            self.assertIsNone(cache.get("b"))
+            self.assertIsNone(cache.get("c"))
+            self.assertEqual(cache.get("a"), b"a" * 100)
+            self.assertEqual(cache.get("d"), b"d" * 100)
+            self.assertLessEqual(
+                sum(path.stat().st_size for path in Path(directory).glob("??/*")), 300
+            )
+
+
+class ImageProxyViewTests(TestCase):
+    """ Only URLs signed by the image_proxy filter are served """
+
+    url = "https://ae01.alicdn.com/kf/a.jpg"
+
+    def test_filter_signs_the_snapped_width(self):
+        query = parse_qs(urlsplit(image_proxy(self.url, 150)).query)
+        self.assertEqual(query["w"], ["200"])
+        self.assertTrue(valid_image_signature(self.url, 200, query["s"][0]))
+        self.assertFalse(valid_image_signature(self.url, 400, query["s"][0]))
+
+    def test_unsigned_requests_are_refused(self):
+        with mock.patch("app_aliexpress.views.image_variant") as image_variant:
+            response = self.client.get(reverse("image_proxy_aliexpress"),
+                                       {"url": self.url, "w": 200, "s": "forged"})
+        self.assertEqual(response.status_code, 403)
+        image_variant.assert_not_called()
+
+    def test_signed_requests_are_served(self):
+        with mock.patch("app_aliexpress.views.image_variant", return_value=b"webp") as variant:
+            response = self.client.get(image_proxy(self.url, 200), HTTP_ACCEPT="image/webp")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b"webp")
+        self.assertEqual(response["Content-Type"], "image/webp")
+        variant.assert_called_once_with(self.url, 200, "webp")
+
+
+class TokenStoreRefreshTests(TestCase):
+    """ Proactive refresh of expiring accounts """
+
+    def setUp(self):
+        soon = int(time.time()) + 60
+        for account, refresh_token, is_active in [
+                ("dead", "gone", False), ("revoked", "revoked", True), ("good", "good", True)]:
+            AliExpressToken.objects.create( # pylint: disable=E1101
+                account=account, access_token="old", refresh_token=refresh_token,
+                expires_at=soon, is_active=is_active,
+            )
+
+    def execute(self, _api_name, params, _access_token=None):
+        if params["refresh_token"] != "good":
+            raise AliExpressAPIError("IllegalRefreshToken")
+        return {"code": "0", "access_token": "new", "expires_in": 3600}
+
+    def test_skips_inactive_accounts_and_isolates_failures(self):
+        client = mock.Mock(execute=mock.Mock(side_effect=self.execute))
+        with mock.patch("app_aliexpress.tokens.get_client", return_value=client), \
+                self.assertLogs("app_aliexpress.tokens", "ERROR") as logs:
+            TokenStore().refresh_expiring()
+
+        self.assertEqual(
+            [call.args[1]["refresh_token"] for call in client.execute.call_args_list],
+            ["revoked", "good"],
+        )
+        self.assertEqual(len(logs.records), 1)
+        tokens = dict(AliExpressToken.objects.values_list("account", "access_token")) # pylint: disable=E1101
+        self.assertEqual(tokens, {"dead": "old", "revoked": "old", "good": "new"})
+
+
+class TokenGateTests(TestCase):
+    """ Which views need a staff user because they spend the shared token """
+
+    def test_recommend_feed_stays_public(self):
+        with mock.patch("app_aliexpress.views.fetch_recommend_feed_page", return_value={}), \
+                self.assertLogs("app_aliexpress.views", "ERROR"):
+            response = self.client.get(reverse("recommend_feed_aliexpress", args=["DS_Brazil"]))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "No results returned from API")
+
+    def test_text_search_needs_staff(self):
+        response = self.client.get(reverse("text_search_aliexpress"), {"keyword": "lamp"})
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response["Location"].startswith(reverse("admin:login")))
+
+
+def _run_in_threads(count, target):
+    threads = [threading.Thread(target=target) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads
+
+
+class TieredCacheTests(SimpleTestCase):
+    """ Per-process LRU in front of the Django cache """
+
+    def setUp(self):
+        shared_cache.clear()
+
+    def test_lru_evicts_the_least_recently_used(self):
+        lru = LRUCache(maxsize=2)
+        lru.set("a", 1, ttl=60)
+        lru.set("b", 2, ttl=60)
+        lru.get("a")
+        lru.set("c", 3, ttl=60)
+        self.assertEqual([lru.get(key) for key in "abc"], [1, None, 3])
+
+    def test_evicted_entries_fall_through_to_the_shared_tier(self):
+        cache = TieredCache("test:tiered", maxsize=1)
+        cache.set("a", "first", ttl=60)
+        cache.set("b", "second", ttl=60)
+        self.assertIsNone(cache.local.get("a"))
+
+        self.assertEqual(cache.get("a"), "first")
+        # Refilled locally with the deadline it was stored with
+        self.assertEqual(cache.local.get("a"), "first")
+        self.assertEqual(cache.stats.as_dict()["misses"], 0)
+
+    def test_expired_entries_are_only_served_stale(self):
+        cache = TieredCache("test:tiered", maxsize=1)
+        cache.set("a", "old", ttl=60)
+        with mock.patch("app_aliexpress.cache.time.time", return_value=time.time() + 61):
+            self.assertIsNone(cache.get("a"))
+            self.assertEqual(cache.get_stale("a"), "old")
+
+
+class SingleFlightTests(SimpleTestCase):
+    """ Concurrent callers of one key share one call """
+
+    def test_concurrent_callers_make_one_call(self):
+        flight, release, calls, results = SingleFlight(), threading.Event(), [], []
+
+        def load():
+            calls.append(1)
+            release.wait(5)
+            return "value"
+
+        threads = _run_in_threads(8, lambda: results.append(flight.do("key", load)))
+        # Let every caller reach the flight before the call returns
+        time.sleep(0.1)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ["value"] * 8)
+
+    def test_the_error_reaches_every_waiter(self):
+        flight, release, errors = SingleFlight(), threading.Event(), []
+
+        def load():
+            release.wait(5)
+            raise AliExpressAPIError("down")
+
+        def call():
+            try:
+                flight.do("key", load)
+            except AliExpressAPIError as exc:
+                errors.append(str(exc))
+
+        threads = _run_in_threads(5, call)
+        time.sleep(0.1)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(errors, ["down"] * 5)
+        # The failed call is not remembered
+        self.assertEqual(flight.do("key", lambda: "ok"), "ok")
+
+
+class ProductDetailCacheTests(SimpleTestCase):
+    """ Volatile and static product fields cached apart """
+
+    product = {
+        "ae_item_base_info_dto": {"subject": "Lamp"},
+        "ae_item_sku_info_dtos": {"price": "10"},
+        "freight_matrix": {"1": {"BR": []}},
+    }
+
+    def setUp(self):
+        shared_cache.clear()
+        self.cache = ProductDetailCache(maxsize=8, volatile_ttl=60, static_ttl=3600)
+
+    def test_merges_both_parts(self):
+        self.cache.set("p", self.product, ["freight"])
+        self.assertEqual(self.cache.get("p"), (self.product, ["freight"]))
+        self.assertEqual(self.cache.get_static("p"),
+                         {"ae_item_base_info_dto": {"subject": "Lamp"}})
+
+    def test_volatile_part_expires_first(self):
+        self.cache.set("p", self.product, [])
+        with mock.patch("app_aliexpress.cache.time.time", return_value=time.time() + 61):
+            self.assertIsNone(self.cache.get("p"))
+            self.assertIsNotNone(self.cache.get_static("p"))
+
+    def test_refresh_without_static_keeps_the_static_part(self):
+        self.cache.set("p", self.product, [])
+        changed = {**self.product, "ae_item_base_info_dto": {"subject": "New"},
+                   "ae_item_sku_info_dtos": {"price": "12"}}
+        self.cache.set("p", changed, [], static_fresh=False)
+
+        product, _freights = self.cache.get("p")
+        self.assertEqual(product["ae_item_base_info_dto"], {"subject": "Lamp"})
+        self.assertEqual(product["ae_item_sku_info_dtos"], {"price": "12"})
+
+
+class RefreshingValueTests(SimpleTestCase):
+    """ Stale-while-refresh of a shared value """
+
+    def setUp(self):
+        shared_cache.clear()
+        self.release = threading.Event()
+        self.loads = []
+
+    def loader(self):
+        self.loads.append(1)
+        if len(self.loads) > 1:
+            self.release.wait(5)
+        return f"v{len(self.loads)}"
+
+    def reloaded(self, value):
+        self.release.set()
+        for thread in threading.enumerate():
+            if thread.name == "refresh-test:refreshing":
+                thread.join(5)
+        return value.cache.get("value")[1]
+
+    def test_serves_the_old_value_while_reloading(self):
+        value = RefreshingValue("test:refreshing", self.loader, ttl=60, refresh_after=-1)
+        self.assertEqual(value.get(), "v1")
+
+        # Old enough to reload: still answered at once with the cached value
+        self.assertEqual(value.get(), "v1")
+        self.assertEqual(self.reloaded(value), "v2")
+
+    def test_concurrent_readers_start_one_reload(self):
+        value = RefreshingValue("test:refreshing", self.loader, ttl=60, refresh_after=-1)
+        value.get()
+        results = []
+        for thread in _run_in_threads(10, lambda: results.append(value.get())):
+            thread.join(5)
+
+        self.assertEqual(results, ["v1"] * 10)
+        self.assertEqual(len(self.loads), 2)
+        self.assertEqual(self.reloaded(value), "v2")
+
+
+@mock.patch("app_aliexpress.views.record_recommend_feed")
+class RecommendFeedCacheTests(SimpleTestCase):
+    """ Feed page cache and next-page prefetch """
+
+    def setUp(self):
+        shared_cache.clear()
+        feed_page_cache.local.clear()
+        self.client_patcher = mock.patch("app_aliexpress.views.get_client")
+        self.api = self.client_patcher.start().return_value
+        self.addCleanup(self.client_patcher.stop)
+        self.api.execute.side_effect = lambda _method, params: recommend_feed_payload(
+            params["feed_name"], params["page_no"], params["page_size"]
+        )
+
+    def test_pages_are_fetched_once(self, _record):
+        first = views.fetch_recommend_feed_page("DS_Brazil", 1, 10)
+        self.assertEqual(views.fetch_recommend_feed_page("DS_Brazil", 1, 10), first)
+        self.assertEqual(self.api.execute.call_count, 1)
+
+    def test_empty_pages_are_not_cached(self, _record):
+        self.api.execute.side_effect = None
+        self.api.execute.return_value = {"aliexpress_ds_recommend_feed_get_response": {}}
+        views.fetch_recommend_feed_page("DS_Brazil", 1, 10)
+        views.fetch_recommend_feed_page("DS_Brazil", 1, 10)
+        self.assertEqual(self.api.execute.call_count, 2)
+
+    def test_prefetch_warms_the_next_page(self, _record):
+        views.prefetch_recommend_feed_page("DS_Brazil", 2, 10).result(5)
+        self.assertEqual(self.api.execute.call_count, 1)
+
+        self.assertIsNone(views.prefetch_recommend_feed_page("DS_Brazil", 2, 10))
+        views.fetch_recommend_feed_page("DS_Brazil", 2, 10)
+        self.assertEqual(self.api.execute.call_count, 1)
+
+
+@mock.patch("app_aliexpress.views.record_text_search")
+class TextSearchCacheTests(SimpleTestCase):
+    """ Text search result cache and coalescing of duplicate searches """
+
+    def setUp(self):
+        shared_cache.clear()
+        text_search_cache.local.clear()
+        self.release = threading.Event()
+        patcher = mock.patch("app_aliexpress.views.get_client")
+        self.api = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+        self.api.execute.side_effect = self.execute
+
+    def execute(self, _method, params, _access_token):
+        self.release.wait(5)
+        return text_search_payload(
+            params["keyWord"], int(params["pageIndex"]), int(params["pageSize"])
+        )
+
+    def test_keyword_case_and_spacing_share_one_entry(self, _record):
+        self.release.set()
+        first = views.fetch_text_search_page("LED  Lamp", 1, 20, "tok")
+        self.assertEqual(views.fetch_text_search_page(" led lamp", 1, 20, "tok"), first)
+        self.assertEqual(self.api.execute.call_count, 1)
+
+    def test_concurrent_duplicate_searches_make_one_call(self, _record):
+        results = []
+        threads = _run_in_threads(
+            6, lambda: results.append(views.fetch_text_search_page("lamp", 1, 20, "tok"))
+        )
+        time.sleep(0.1)
+        self.release.set()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(self.api.execute.call_count, 1)
+        self.assertEqual(len(results), 6)
+        self.assertTrue(all(result is results[0] for result in results))
+
+
+class AsyncViewHelperTests(SimpleTestCase):
+    """ Coalescing and thread use of the async views """
+
+    async def test_async_single_flight_shares_one_call(self):
+        flight, calls = AsyncSingleFlight(), []
+
+        async def load():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return "value"
+
+        results = await asyncio.gather(*(flight.do("key", load) for _ in range(5)))
+        self.assertEqual(results, ["value"] * 5)
+        self.assertEqual(len(calls), 1)
+
+    async def test_async_single_flight_error_reaches_every_waiter(self):
+        flight = AsyncSingleFlight()
+
+        async def load():
+            await asyncio.sleep(0.05)
+            raise AliExpressAPIError("down")
+
+        results = await asyncio.gather(
+            *(flight.do("key", load) for _ in range(3)), return_exceptions=True
+        )
+        self.assertEqual([str(result) for result in results], ["down"] * 3)
+
+    async def test_pool_calls_run_concurrently(self):
+        # On the single thread-sensitive thread the second call would never start
+        barrier = threading.Barrier(2, timeout=5)
+        both = async_views._in_pool(barrier.wait) # pylint: disable=W0212
+        await asyncio.gather(both(), both())
+
+
+@mock.patch("app_aliexpress.views.record_product_detail")
+class FreightMatrixTests(SimpleTestCase):
+    """ Freight quotes for every SKU and country """
+
+    def setUp(self):
+        shared_cache.clear()
+        product_detail_cache.volatile.local.clear()
+        product_detail_cache.static.local.clear()
+        self.failing = set()
+        patcher = mock.patch("app_aliexpress.views.get_client")
+        self.api = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+        self.api.execute.side_effect = self.execute
+
+    def execute(self, method, params, _access_token=None):
+        if method == "aliexpress.ds.product.get":
+            return product_get_payload(int(params["product_id"]), skus=2, description_kb=1)
+        query = json.loads(params["queryDeliveryReq"])
+        if (query["shipToCountry"], query["selectedSkuId"]) in self.failing:
+            return {"error_message": "Freight unavailable"}
+        return freight_query_payload(options=1)
+
+    def product_calls(self):
+        return [call for call in self.api.execute.call_args_list
+                if call.args[0] == "aliexpress.ds.product.get"]
+
+    def test_matrix_holds_every_country_and_sku(self, _record):
+        self.failing = {("US", "b")}
+        with self.assertLogs("app_aliexpress.views", "ERROR"):
+            matrix = views.freight_matrix_aliexpress("tok", 1, ["a", "b"], ["BR", "US"])
+
+        self.assertEqual(set(matrix), {"BR", "US"})
+        self.assertEqual(len(matrix["BR"]["a"]), 1)
+        self.assertEqual(matrix["US"]["b"], {"error": "Freight unavailable"})
+        self.assertFalse(views.freight_matrix_complete(matrix))
+        self.assertTrue(views.freight_matrix_complete({"BR": matrix["BR"]}))
+
+    def test_complete_products_are_cached(self, _record):
+        product, freights = views.fetch_aliexpress_product_detail("tok", 7)
+        self.assertEqual([sku["freights"] for sku in views.product_skus(product)],
+                         [freights, freights])
+        views.fetch_aliexpress_product_detail("tok", 7)
+        self.assertEqual(len(self.product_calls()), 1)
+
+    def test_a_failed_quote_of_any_sku_skips_the_cache(self, _record):
+        self.failing = {("BR", "701")}
+        with self.assertLogs("app_aliexpress.views", "ERROR"):
+            product, freights = views.fetch_aliexpress_product_detail("tok", 7)
+            views.fetch_aliexpress_product_detail("tok", 7)
+
+        # The first SKU quoted fine, the second one did not
+        self.assertIsInstance(freights, list)
+        self.assertEqual(views.product_skus(product)[1]["freights"],
+                         {"error": "Freight unavailable"})
+        self.assertEqual(len(self.product_calls()), 2)
+
+
+@mock.patch("app_aliexpress.conditional.render",
+            lambda request, template_name, context: HttpResponse(context["title"]))
+class ConditionalRenderTests(SimpleTestCase):
+    """ ETag and Last-Modified answers of the API pages """
+
+    def setUp(self):
+        shared_cache.clear()
+        self.factory = RequestFactory()
+
+    def get(self, context, cookies=None, **headers):
+        request = self.factory.get("/aliexpress/product/1/", **headers)
+        request.COOKIES.update(cookies or {})
+        return conditional_render(request, "page.html", context)
+
+    def test_matching_etag_answers_304(self):
+        first = self.get({"title": "Lamp"}, {"sessionid": "s1"})
+        self.assertEqual(first.status_code, 200)
+
+        again = self.get({"title": "Lamp"}, {"sessionid": "s1"}, HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(again["ETag"], first["ETag"])
+
+    def test_other_session_or_csrf_cookie_gets_the_page(self):
+        first = self.get({"title": "Lamp"}, {"sessionid": "s1", "csrftoken": "c1"})
+        for cookies in ({"sessionid": "s2", "csrftoken": "c1"},
+                        {"sessionid": "s1", "csrftoken": "c2"}):
+            with self.subTest(cookies=cookies):
+                response = self.get({"title": "Lamp"}, cookies,
+                                    HTTP_IF_NONE_MATCH=first["ETag"])
+                self.assertEqual(response.status_code, 200)
+                self.assertNotEqual(response["ETag"], first["ETag"])
+
+    def test_if_modified_since_answers_304_until_the_content_changes(self):
+        first = self.get({"title": "Lamp"})
+        since = first["Last-Modified"]
+        self.assertEqual(self.get({"title": "Lamp"}, HTTP_IF_MODIFIED_SINCE=since).status_code,
+                         304)
+
+        with mock.patch("app_aliexpress.conditional.time.time", return_value=time.time() + 10):
+            changed = self.get({"title": "Lamp v2"}, HTTP_IF_MODIFIED_SINCE=since)
+        self.assertEqual(changed.status_code, 200)
+        self.assertEqual(changed.content, b"Lamp v2")
+
+    def test_content_reverting_to_an_earlier_version_is_modified(self):
+        first = self.get({"title": "Lamp"})
+        now = time.time()
+        with mock.patch("app_aliexpress.conditional.time.time", return_value=now + 10):
+            self.get({"title": "Lamp v2"})
+        with mock.patch("app_aliexpress.conditional.time.time", return_value=now + 20):
+            reverted = self.get({"title": "Lamp"},
+                                HTTP_IF_MODIFIED_SINCE=first["Last-Modified"])
+        self.assertEqual(reverted.status_code, 200)
+        self.assertEqual(reverted.content, b"Lamp")
+
+
+class CrawlFeedCommandTests(TestCase):
+    """ Resumable crawl of a whole recommend feed """
+
+    def setUp(self):
+        self.failing_pages = set()
+        patcher = mock.patch("app_aliexpress.crawler.get_client")
+        self.api = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+        self.api.execute.side_effect = self.execute
+
+    def execute(self, _method, params, **_kwargs):
+        if params["page_no"] in self.failing_pages:
+            raise AliExpressAPIError("timed out", retriable=True)
+        return recommend_feed_payload(params["feed_name"], params["page_no"],
+                                      params["page_size"], total=6)
+
+    def crawl(self, *args):
+        call_command("crawl_feed", "DS_Brazil", "--page-size", "2", "--batch-size", "1",
+                     *args, stdout=StringIO())
+        return FeedCrawl.objects.get(feed_name="DS_Brazil") # pylint: disable=E1101
+
+    def fetched_pages(self):
+        return sorted(call.args[1]["page_no"] for call in self.api.execute.call_args_list)
+
+    def test_crawls_every_page(self):
+        crawl = self.crawl()
+        self.assertEqual((crawl.last_page, crawl.total_pages, crawl.products), (3, 3, 6))
+        self.assertIsNotNone(crawl.finished_at)
+        self.assertEqual(CatalogProduct.objects.count(), 6) # pylint: disable=E1101
+
+    def test_resumes_after_the_last_stored_page(self):
+        self.failing_pages = {3}
+        with self.assertRaises(CommandError):
+            self.crawl("--concurrency", "1")
+        crawl = FeedCrawl.objects.get(feed_name="DS_Brazil") # pylint: disable=E1101
+        self.assertEqual((crawl.last_page, crawl.products), (2, 4))
+        self.assertIsNone(crawl.finished_at)
+
+        self.failing_pages = set()
+        self.api.execute.reset_mock()
+        crawl = self.crawl()
+        self.assertEqual(self.fetched_pages(), [3])
+        self.assertEqual((crawl.last_page, crawl.products), (3, 6))
+        self.assertIsNotNone(crawl.finished_at)
+
+    def test_error_body_on_the_first_page_fails(self):
+        self.api.execute.side_effect = None
+        self.api.execute.return_value = {"error_response": {"code": "InvalidFeed"}}
+        with self.assertRaisesMessage(CommandError, "InvalidFeed"):
+            self.crawl()
+        crawl = FeedCrawl.objects.get(feed_name="DS_Brazil") # pylint: disable=E1101
+        self.assertEqual(crawl.last_page, 0)
+        self.assertIsNone(crawl.finished_at)
+
+    def test_concurrency_must_be_positive(self):
+        with self.assertRaisesMessage(CommandError, "--concurrency must be at least 1."):
+            self.crawl("--concurrency", "0")
+        self.api.execute.assert_not_called()
+
+
+def _product_detail(_access_token, product_id):
+    if product_id == 2:
+        return None, "Product data not found in API response."
+    if product_id == 3:
+        raise AliExpressAPIError("timed out")
+    return {"product_id": product_id}, []
+
+
+@mock.patch("app_aliexpress.views.fetch_aliexpress_product_detail", _product_detail)
+@mock.patch("app_aliexpress.views.get_access_token", return_value="tok")
+class BatchProductDetailTests(TestCase):
+    """ Batch product endpoint """
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user("staff", password="x", is_staff=True)
+        self.client.force_login(self.user)
+        self.url = reverse("batch_product_detail_aliexpress")
+
+    def lines(self, response):
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        lines = [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+        return sorted(lines, key=lambda line: line["product_id"])
+
+    def test_failed_products_get_their_own_error_line(self, _token):
+        with self.assertLogs("app_aliexpress.views", "ERROR"):
+            lines = self.lines(self.client.get(self.url, {"ids": "1,2,3,1"}))
+        self.assertEqual(lines, [
+            {"product_id": 1, "product": {"product_id": 1}, "freights": []},
+            {"product_id": 2, "error": "Product data not found in API response."},
+            {"product_id": 3, "error": "Internal error processing request."},
+        ])
+
+    def test_json_body(self, _token):
+        response = self.client.post(self.url, {"product_ids": [4, 5], "concurrency": 1},
+                                    content_type="application/json")
+        self.assertEqual([line["product_id"] for line in self.lines(response)], [4, 5])
+
+    def test_rejects_bad_and_oversized_batches(self, _token):
+        self.assertEqual(self.client.get(self.url, {"ids": "1,x"}).status_code, 400)
+        self.assertEqual(self.client.get(self.url).status_code, 400)
+        with mock.patch("app_aliexpress.views.ALIEXPRESS_BATCH_MAX_SIZE", 2):
+            response = self.client.get(self.url, {"ids": "1,2,3"})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {"error": "At most 2 products per batch."})
+
+    def test_anonymous_requests_are_refused(self, _token):
+        self.assertEqual(Client().get(self.url, {"ids": "1"}).status_code, 401)
+
+    def test_api_token_posts_without_csrf(self, _token):
+        client = Client(enforce_csrf_checks=True)
+        with mock.patch("core.auth.API_TOKENS", ["secret"]):
+            response = client.post(self.url, {"product_ids": [1]}, content_type="application/json",
+                                   HTTP_AUTHORIZATION="Bearer secret")
+            self.assertEqual([line["product_id"] for line in self.lines(response)], [1])
+            response = client.post(self.url, {"product_ids": [1]}, content_type="application/json",
+                                   HTTP_AUTHORIZATION="Bearer wrong")
+            self.assertEqual(response.status_code, 401)
+
+    def test_staff_posts_are_csrf_checked(self, _token):
+        client = Client(enforce_csrf_checks=True)
+        client.force_login(self.user)
+        response = client.post(self.url, {"product_ids": [1]}, content_type="application/json")
+        self.assertEqual(response.status_code, 403)
+
+
+def _image_file(image_format, size=(1200, 900), mode="RGB"):
+    channels = len(mode)
+    image = Image.frombytes(mode, size, os.urandom(size[0] * size[1] * channels))
+    buffer = BytesIO()
+    image.save(buffer, format=image_format)
+    buffer.seek(0)
+    return buffer
+
+
+class ReduceImageSizeTests(SimpleTestCase):
+    """ JPEG re-encoding of image search uploads """
+
+    def decoded(self, encoded):
+        return Image.open(BytesIO(base64.b64decode(encoded)))
+
+    def test_noisy_upload_fits_the_budget(self):
+        for image_format, mode in (("PNG", "RGBA"), ("JPEG", "RGB"), ("WEBP", "RGB")):
+            with self.subTest(image_format=image_format):
+                encoded = views.reduce_image_size(_image_file(image_format, mode=mode),
+                                                  max_size_kb=20)
+                self.assertLessEqual(len(base64.b64decode(encoded)), 20 * 1024)
+                image = self.decoded(encoded)
+                self.assertEqual((image.format, image.mode), ("JPEG", "RGB"))
+                self.assertLessEqual(max(image.size), 600)
+
+    def test_small_upload_keeps_its_size(self):
+        image = self.decoded(views.reduce_image_size(_image_file("PNG", size=(40, 30))))
+        self.assertEqual(image.size, (40, 30))
+
+    def test_quality_is_binary_searched(self):
+        with mock.patch("app_aliexpress.views._encode_jpeg",
+                        wraps=views._encode_jpeg) as encode: # pylint: disable=W0212
+            views.reduce_image_size(_image_file("PNG", size=(600, 600)), max_size_kb=60)
+        # Default and minimum quality, any resizes, then about log2(76) quality probes
+        self.assertLessEqual(encode.call_count, 12)
+
+    def test_rejects_other_formats(self):
+        with self.assertRaises(ValueError):
+            views.reduce_image_size(_image_file("GIF", size=(10, 10), mode="L"))
+
+
+def _picture(size, flipped=False):
+    image = Image.new("RGB", (300, 200), "white")
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((20, 30, 140, 170), fill="navy")
+    draw.ellipse((170, 40, 280, 150), fill="orange")
+    if flipped:
+        image = ImageOps.mirror(image)
+    return image.resize(size)
+
+
+def _encoded(image, image_format, **options):
+    buffer = BytesIO()
+    image.save(buffer, format=image_format, **options)
+    buffer.seek(0)
+    return buffer
+
+
+class PerceptualHashCacheTests(SimpleTestCase):
+    """ Image search results keyed on near-duplicate fingerprints """
+
+    def setUp(self):
+        shared_cache.clear()
+        self.cache = PerceptualHashCache("test:phash", maxsize=8, ttl=60, max_distance=4)
+
+    def test_reencoded_upload_keeps_its_fingerprint(self):
+        original = image_fingerprint(_encoded(_picture((300, 200)), "PNG"))
+        upload = _encoded(_picture((900, 600)), "JPEG", quality=40)
+        self.assertLessEqual(hamming_distance(original, image_fingerprint(upload)), 4)
+        self.assertEqual(upload.tell(), 0)
+
+        other = image_fingerprint(_encoded(_picture((300, 200), flipped=True), "PNG"))
+        self.assertGreater(hamming_distance(original, other), 4)
+
+    def test_near_duplicates_hit(self):
+        self.cache.set("BR", 0b1011, ["product"])
+        self.assertEqual(self.cache.get("BR", 0b1011 ^ 0b1000_0001), ["product"])
+        self.assertIsNone(self.cache.get("BR", 0b1011 ^ 0b11111)) # 5 bits away
+        self.assertIsNone(self.cache.get("US", 0b1011))
+
+    def test_exact_hashes_are_shared_across_processes(self):
+        self.cache.set("BR", 42, ["product"])
+        other_process = PerceptualHashCache("test:phash", maxsize=8, ttl=60, max_distance=4)
+        self.assertIsNone(other_process.get("BR", 43)) # near-duplicates are only matched locally
+        self.assertEqual(other_process.get("BR", 42), ["product"])
+        self.assertEqual(other_process.get("BR", 43), ["product"])
+
+    def test_entries_expire(self):
+        self.cache.set("BR", 42, ["product"])
+        with mock.patch("app_aliexpress.cache.time.time", return_value=time.time() + 61):
+            self.assertIsNone(self.cache.get("BR", 42))
+
+
+class CatalogSearchTests(TestCase):
+    """ Local catalog upserts and full-text search """
+
+    def setUp(self):
+        record_products([
+            {"aliexpress_id": "1", "subject": "Wooden desk lamp", "category": "10",
+             "price": Decimal("20.00")},
+            {"aliexpress_id": "2", "subject": "LED strip light", "category": "10",
+             "price": Decimal("8.00")},
+            {"aliexpress_id": "3", "subject": "Lamp shade", "category": "20",
+             "price": Decimal("5.00")},
+        ], "search")
+
+    def ids(self, *args, **kwargs):
+        return [product.aliexpress_id for product in search_catalog(*args, **kwargs)]
+
+    def test_words_match_as_prefixes_in_any_order(self):
+        self.assertCountEqual(self.ids("lamp"), ["1", "3"])
+        self.assertEqual(self.ids("lam woo"), ["1"])
+        self.assertEqual(self.ids("desk strip"), [])
+
+    def test_user_input_is_not_fts_syntax(self):
+        self.assertEqual(self.ids('lamp" OR "strip'), [])
+        self.assertEqual(self.ids('NEAR( "'), [])
+
+    def test_category_and_price_filters(self):
+        self.assertEqual(self.ids("lamp", category="20"), ["3"])
+        self.assertEqual(self.ids("lamp", min_price=Decimal("10")), ["1"])
+        self.assertCountEqual(self.ids("", category="10", max_price=Decimal("20")), ["1", "2"])
+
+    def test_index_follows_updates_and_deletes(self):
+        record_products([{"aliexpress_id": "1", "subject": "Oak desk lamp"}], "feed")
+        self.assertEqual(self.ids("oak"), ["1"])
+        self.assertEqual(self.ids("wooden"), [])
+        CatalogProduct.objects.filter(aliexpress_id="3").delete() # pylint: disable=E1101
+        self.assertEqual(self.ids("shade"), [])
+        self.assertEqual(self.ids("lamp"), ["1"])
+
+    def test_descriptions_are_searchable_and_kept_by_listings(self):
+        record_products([{"aliexpress_id": "2", "subject": "LED strip light",
+                          "description": "Waterproof 5m roll"}], "detail", DETAIL_FIELDS)
+        record_products([{"aliexpress_id": "2", "subject": "LED strip light 5m"}], "feed")
+        self.assertEqual(self.ids("waterproof"), ["2"])
+        product = CatalogProduct.objects.get(aliexpress_id="2") # pylint: disable=E1101
+        self.assertEqual((product.source, product.description), ("feed", "Waterproof 5m roll"))
+
+    def test_prices_from_listings(self):
+        cases = {"12.34": "12.34", "1,234.56": "1234.56", "R$ 12,34": "12.34",
+                 "1.234,5": "1234.50", "": None, "abc": None}
+        for value, expected in cases.items():
+            with self.subTest(value=value):
+                self.assertEqual(parse_price(value),
+                                 Decimal(expected) if expected else None)
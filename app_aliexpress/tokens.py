@@ -0,0 +1,178 @@
+"""Shared AliExpress token store with single-flight and proactive refresh."""
+import logging
+import threading
+import time
+
+from django.db import close_old_connections, transaction
+from decouple import config
+
+from .cache import SingleFlight
+from .client import AliExpressAPIError, get_client
+from .models import AliExpressToken
+
+logger = logging.getLogger(__name__)
+
+# Requests refresh inline only when the token is about to expire; the
+# background refresher renews well before that.
+ALIEXPRESS_TOKEN_REQUEST_MARGIN = config("ALIEXPRESS_TOKEN_REQUEST_MARGIN", default=60, cast=int)
+ALIEXPRESS_TOKEN_REFRESH_MARGIN = config("ALIEXPRESS_TOKEN_REFRESH_MARGIN", default=900, cast=int)
+ALIEXPRESS_TOKEN_REFRESH_INTERVAL = config(
+    "ALIEXPRESS_TOKEN_REFRESH_INTERVAL", default=60, cast=int
+)
+ALIEXPRESS_TOKEN_CACHE_TTL = config("ALIEXPRESS_TOKEN_CACHE_TTL", default=30, cast=int)
+ALIEXPRESS_TOKEN_PROACTIVE_REFRESH = config(
+    "ALIEXPRESS_TOKEN_PROACTIVE_REFRESH", default=True, cast=bool
+)
+
+
+def account_from_response(response_data):
+    """Account identifier of a /auth/token/create response."""
+    for key in ("user_id", "seller_id", "account"):
+        if response_data.get(key):
+            return str(response_data[key])
+    return "default"
+
+
+class TokenStore:
+    """Process-local view of the active AliExpress token, backed by the database.
+
+    The active token is re-read from the database at most every
+    ``cache_ttl`` seconds, so checking it costs no query on most requests.
+    Refreshes run at most once at a time per account in this process, and
+    re-check the stored row first so a refresh done elsewhere is reused.
+    """
+
+    def __init__(self, cache_ttl=ALIEXPRESS_TOKEN_CACHE_TTL,
+                 request_margin=ALIEXPRESS_TOKEN_REQUEST_MARGIN,
+                 refresh_margin=ALIEXPRESS_TOKEN_REFRESH_MARGIN):
+        self.cache_ttl = cache_ttl
+        self.request_margin = request_margin
+        self.refresh_margin = refresh_margin
+        self._active = None
+        self._loaded_at = 0
+        self._lock = threading.Lock()
+        self._flight = SingleFlight()
+        self._refresher = None
+
+    def get_active(self):
+        """Return the active token, or None when no account is authorized."""
+        if ALIEXPRESS_TOKEN_PROACTIVE_REFRESH:
+            self.start_refresher()
+        if time.time() - self._loaded_at > self.cache_ttl:
+            active = AliExpressToken.objects.filter(is_active=True).first() # pylint: disable=E1101
+            self._remember(active)
+        return self._active
+
+    def get_valid(self):
+        """Return the active token, refreshing it inline if it is about to expire.
+
+        Raises:
+            AliExpressAPIError: When the refresh is rejected by AliExpress
+        """
+        token = self.get_active()
+        if token is not None and token.expires_at - time.time() <= self.request_margin:
+            token = self.refresh(token.account, self.request_margin)
+        return token
+
+    def save_from_response(self, response_data):
+        """Store the tokens of a /auth/token/create response as the active account."""
+        account = account_from_response(response_data)
+        with transaction.atomic():
+            AliExpressToken.objects.exclude(account=account).update(is_active=False) # pylint: disable=E1101
+            token, _created = AliExpressToken.objects.update_or_create( # pylint: disable=E1101
+                account=account,
+                defaults={
+                    "access_token": response_data["access_token"],
+                    "refresh_token": response_data["refresh_token"],
+                    "expires_at": int(time.time()) + int(response_data["expires_in"]),
+                    "is_active": True,
+                },
+            )
+        self._remember(token)
+        return token
+
+    def refresh(self, account, margin=None):
+        """Refresh ``account`` unless it has more than ``margin`` seconds left."""
+        margin = self.refresh_margin if margin is None else margin
+        return self._flight.do(account, lambda: self._refresh(account, margin))
+
+    def _refresh(self, account, margin):
+        token = AliExpressToken.objects.filter(account=account).first() # pylint: disable=E1101
+        if token is None:
+            return None
+        if token.expires_at - time.time() > margin:
+            # Another process already refreshed it
+            self._remember_if_active(token)
+            return token
+
+        response_data = get_client().execute(
+            '/auth/token/refresh', {'refresh_token': token.refresh_token}
+        )
+        if str(response_data.get("code", "0")) != "0" or not all(
+                key in response_data for key in ["access_token", "expires_in"]):
+            logger.error("Invalid refresh token API response: %s", response_data)
+            raise AliExpressAPIError("Error refreshing access token. Please re-authorize.")
+
+        token.access_token = response_data["access_token"]
+        token.expires_at = int(time.time()) + int(response_data["expires_in"])
+        # Refresh token may or may not be returned in the refresh response. Update if present.
+        if response_data.get("refresh_token"):
+            token.refresh_token = response_data["refresh_token"]
+        token.save(update_fields=["access_token", "expires_at", "refresh_token", "alter_at"])
+        self._remember_if_active(token)
+        return token
+
+    def _remember(self, token):
+        with self._lock:
+            self._active = token
+            self._loaded_at = time.time()
+
+    def _remember_if_active(self, token):
+        if token.is_active:
+            self._remember(token)
+
+    def start_refresher(self):
+        """Start the background proactive refresher once per process."""
+        if self._refresher is not None:
+            return
+        with self._lock:
+            if self._refresher is None:
+                self._refresher = threading.Thread(
+                    target=self._refresh_loop, name="aliexpress-token-refresher", daemon=True
+                )
+                self._refresher.start()
+
+    def _refresh_loop(self):
+        while True:
+            time.sleep(ALIEXPRESS_TOKEN_REFRESH_INTERVAL)
+            try:
+                self.refresh_expiring()
+            except Exception as exc: # pylint: disable=W0718
+                logger.exception("Proactive token refresh failed: %s", exc)
+            finally:
+                close_old_connections()
+
+    def refresh_expiring(self):
+        """Refresh the active accounts expiring within ``refresh_margin``.
+
+        Each account is refreshed on its own, so one whose refresh token was
+        revoked does not keep the others from being renewed.
+        """
+        deadline = int(time.time()) + self.refresh_margin
+        expiring = AliExpressToken.objects.filter( # pylint: disable=E1101
+            is_active=True, expires_at__lte=deadline
+        ).values_list("account", flat=True)
+        for account in list(expiring):
+            try:
+                self.refresh(account)
+            except Exception as exc: # pylint: disable=W0718
+                logger.exception("Proactive refresh of account %s failed: %s", account, exc)
+
+
+token_store = TokenStore()
+
+
+def get_access_token():
+    """Access token of the active AliExpress account, or None."""
+    token = token_store.get_active()
+    return token.access_token if token is not None else None
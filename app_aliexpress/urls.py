@@ -1,7 +1,7 @@
 """ url for app """
 from django.urls import path
 
-from . import views
+from . import async_views, views
 
 urlpatterns = [
     path(
@@ -19,6 +19,11 @@ urlpatterns = [
     ),
     path("product/<int:product_id>/", views.product_detail_aliexpress, \
         name="product_detail_aliexpress"),
+    path(
+        "batch/products/",
+        views.batch_product_detail_aliexpress,
+        name="batch_product_detail_aliexpress",
+    ),
     path(
         "text_search/",
         views.text_search_aliexpress,
@@ -29,4 +34,25 @@ urlpatterns = [
         views.aliexpress_image_search,
         name="aliexpress_image_search",
     ),
+    path("image/", views.image_proxy_aliexpress, name="image_proxy_aliexpress"),
+    path("catalog/", views.catalog_search_aliexpress, name="catalog_search_aliexpress"),
+    path("cache_stats/", views.cache_stats_aliexpress, name="cache_stats_aliexpress"),
+    # Async variants, for deployments served through core/asgi.py
+    path(
+        "async/recommend_feed_aliexpress/<path:feed_name>/",
+        async_views.recommend_feed_aliexpress_async,
+        name="recommend_feed_aliexpress_async",
+    ),
+    path("async/product/<int:product_id>/", async_views.product_detail_aliexpress_async, \
+        name="product_detail_aliexpress_async"),
+    path(
+        "async/text_search/",
+        async_views.text_search_aliexpress_async,
+        name="text_search_aliexpress_async",
+    ),
+    path(
+        "async/image_search/",
+        async_views.aliexpress_image_search_async,
+        name="aliexpress_image_search_async",
+    ),
 ]
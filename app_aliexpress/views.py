@@ -1,127 +1,166 @@
 """Module providing a function python version."""
 import base64
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextvars import copy_context
 from functools import wraps
-import hashlib
-import hmac
 from io import BytesIO
-import time
 import json
 import logging
-from urllib.parse import quote, unquote
+from urllib.parse import unquote
 from pillow_avif import AvifImagePlugin # pylint: disable=W0611
 from PIL import Image  # Importe o plugin pillow-avif-plugin
-import iop
-import requests
-from django.http import HttpResponseRedirect
+from django.contrib.admin.views.decorators import staff_member_required
+from django.contrib.auth.views import redirect_to_login
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, \
+    JsonResponse, StreamingHttpResponse
 from django.shortcuts import redirect, render
+from django.urls import reverse
 from django.core.paginator import EmptyPage, Paginator, PageNotAnInteger
 
-from bs4 import BeautifulSoup
-from decouple import config
+from decouple import Csv, config
+
+from core.auth import api_token_or_staff
+from core.profiling import phase
+
+from .cache import (
+    ALIEXPRESS_FEED_PAGE_TTL,
+    ALIEXPRESS_TEXT_SEARCH_TTL,
+    RefreshingValue,
+    cache_stats,
+    feed_page_cache,
+    feed_page_flight,
+    image_search_cache,
+    product_cache_key,
+    product_detail_cache,
+    product_detail_flight,
+    request_cache_key,
+    text_search_cache,
+    text_search_flight,
+)
+from .catalog import (
+    parse_price,
+    record_image_search,
+    record_product_detail,
+    record_recommend_feed,
+    record_text_search,
+    search_catalog,
+)
+from .client import AliExpressAPIError, get_client
+from .conditional import conditional_render
+from .description import process_description
+from .imagehash import image_fingerprint
+from .images import (
+    ALIEXPRESS_IMAGE_MAX_AGE,
+    FORMATS,
+    ImageProxyError,
+    allowed_image_url,
+    image_variant,
+    negotiate_format,
+    normalize_image_url,
+    snap_width,
+    valid_image_signature,
+)
+from .ratelimit import LOW, call_with_priority
+from .signing import APP_KEY
+from .tokens import get_access_token, token_store
 
 logger = logging.getLogger(__name__)
 
-APP_KEY = config("ALIEXPRESS_APP_KEY")
-APP_SECRET = config("ALIEXPRESS_APP_SECRET")
-APP_URL_REST = "https://api-sg.aliexpress.com/rest"
-APP_URL_SYNC = "https://api-sg.aliexpress.com/sync"
-
 ALIEXPRESS_TARGET_CURRENCY = "BRL"
 ALIEXPRESS_SHIP_COUNTRY = "BR"
 ALIEXPRESS_LOCALE = "pt_BR"
 
+# Extra ship-to countries quoted for every SKU, on top of ALIEXPRESS_SHIP_COUNTRY
+ALIEXPRESS_FREIGHT_COUNTRIES = config("ALIEXPRESS_FREIGHT_COUNTRIES", default="", cast=Csv())
+ALIEXPRESS_FREIGHT_WORKERS = config("ALIEXPRESS_FREIGHT_WORKERS", default=8, cast=int)
+
+_freight_executor = ThreadPoolExecutor(
+    max_workers=ALIEXPRESS_FREIGHT_WORKERS, thread_name_prefix="aliexpress-freight"
+)
+
+ALIEXPRESS_BATCH_CONCURRENCY = config("ALIEXPRESS_BATCH_CONCURRENCY", default=16, cast=int)
+ALIEXPRESS_BATCH_MAX_CONCURRENCY = config(
+    "ALIEXPRESS_BATCH_MAX_CONCURRENCY", default=64, cast=int
+)
+ALIEXPRESS_BATCH_MAX_SIZE = config("ALIEXPRESS_BATCH_MAX_SIZE", default=1000, cast=int)
+
+ALIEXPRESS_PREFETCH_WORKERS = config("ALIEXPRESS_PREFETCH_WORKERS", default=4, cast=int)
+
+_prefetch_executor = ThreadPoolExecutor(
+    max_workers=ALIEXPRESS_PREFETCH_WORKERS, thread_name_prefix="aliexpress-prefetch"
+)
+
+ALIEXPRESS_FEEDNAME_TTL = config("ALIEXPRESS_FEEDNAME_TTL", default=6 * 3600, cast=int)
+ALIEXPRESS_FEEDNAME_REFRESH_AFTER = config(
+    "ALIEXPRESS_FEEDNAME_REFRESH_AFTER", default=3600, cast=int
+)
+
 def process_product_description(html_content):
-    """parser html aliexpress to app"""
-    soup = BeautifulSoup(html_content, "html.parser")
-    for img in soup.find_all("img"):
-        if "width" in img.attrs:
-            del img["width"]
-        if "height" in img.attrs:
-            del img["height"]
-        img["style"] = "max-width: 100%; height: auto; display: block; margin: 10px 0;"
-    return str(soup)
+    """parser html aliexpress to app, memoized by content hash"""
+    with phase("process_product_description"):
+        return process_description(html_content)
+
+JPEG_MIN_QUALITY = 15
+JPEG_MAX_QUALITY = 90
+JPEG_DEFAULT_QUALITY = 75
+
+def _encode_jpeg(image, quality):
+    """Encode ``image`` as JPEG bytes."""
+    output = BytesIO()
+    image.save(output, format='JPEG', quality=quality)
+    return output.getvalue()
 
 def reduce_image_size(image_file, max_size_kb=70, max_dimension=600):
     """
     Reduz o tamanho da imagem, converte para JPG e codifica em base64.
+
+    JPEG inputs are decoded in draft mode straight at the target scale and
+    other formats are shrunk with Image.reduce before resampling. The JPEG
+    quality is then binary searched instead of stepped through.
     """
     image = Image.open(image_file)
-    output = BytesIO()
 
     valid_extensions = ['png', 'webp', 'jpg', 'jpeg', 'avif']
     file_extension = image.format.lower()
     if file_extension not in valid_extensions:
         raise ValueError(f"Formato de imagem inválido: {file_extension}")
 
-    # Converte a imagem para RGB se necessário
-    if file_extension not in ('jpeg', 'jpg', 'avif'):
-        image = image.convert("RGB")
+    max_bytes = max_size_kb * 1024
 
-    # Redimensiona a imagem se necessário
-    width, height = image.size
-    if width > max_dimension or height > max_dimension:
-        scaling_factor = min(max_dimension / width, max_dimension / height)
-        new_width = int(width * scaling_factor)
-        new_height = int(height * scaling_factor)
-        image = image.resize((new_width, new_height), Image.Resampling.LANCZOS)
+    # Redimensiona a imagem se necessário (reduce-on-decode for big inputs)
+    image.thumbnail((max_dimension, max_dimension), Image.Resampling.LANCZOS, reducing_gap=2.0)
+
+    # Converte a imagem para RGB se necessário (alpha, palette, CMYK...)
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
 
     # Salva inicialmente para verificar o tamanho
-    image.save(output, format='JPEG')
-    initial_size_kb = output.tell() / 1024
-
-    if initial_size_kb <= max_size_kb:
-        output.seek(0)
-        encoded_image = base64.b64encode(output.getvalue()).decode('utf-8')
-        return encoded_image
-
-    # Ajusta a qualidade para reduzir o tamanho do arquivo
-    for quality in range(90, 10, -5):
-        output.seek(0)
-        output.truncate()
-        image.save(output, format='JPEG', quality=quality)
-        if output.tell() / 1024 <= max_size_kb:
-            output.seek(0)
-            encoded_image = base64.b64encode(output.getvalue()).decode('utf-8')
-            return encoded_image
-
-    # Redimensiona ainda mais se a redução de qualidade não for suficiente
-    while output.tell() / 1024 > max_size_kb:
+    encoded = _encode_jpeg(image, JPEG_DEFAULT_QUALITY)
+    if len(encoded) <= max_bytes:
+        return base64.b64encode(encoded).decode('utf-8')
+
+    # Redimensiona até caber na qualidade mínima, estimando a escala pelo tamanho medido
+    encoded = _encode_jpeg(image, JPEG_MIN_QUALITY)
+    while len(encoded) > max_bytes and min(image.size) > 16:
+        scale = min(0.9, (max_bytes / len(encoded)) ** 0.5 * 0.95)
         width, height = image.size
-        new_width = int(width * 0.9)
-        new_height = int(height * 0.9)
-        image = image.resize((new_width, new_height), Image.Resampling.LANCZOS)
-        output.seek(0)
-        output.truncate()
-        image.save(output, format='JPEG', quality=quality)
-
-    output.seek(0)
-    encoded_image = base64.b64encode(output.getvalue()).decode('utf-8')
-    return encoded_image
-
-def generate_sign(secret, api_name, parameters):
-    """Generate sign for Aliexpress API."""
-
-    # URL encode parameters (Crucial for correct signing)
-    encoded_parameters = {k: quote(str(v)) for k, v in parameters.items()}
-
-    # Sort parameters
-    sorted_params = sorted(encoded_parameters)
-
-    # Build the parameter string using f-strings and handle api_name
-    if "/" in api_name:
-        parts = [f"{k}{encoded_parameters[k]}" for k in sorted_params]
-        parameters_str = f"{api_name}{''.join(parts)}"
-    else:
-        parts = [f"{k}{encoded_parameters[k]}" for k in sorted_params]
-        parameters_str = ''.join(parts)
-
-    # Generate the sign using HMAC-SHA256
-    h = hmac.new(
-        secret.encode("utf-8"),  # Encoding is important!
-        parameters_str.encode("utf-8"),  # Encoding must match!
-        digestmod=hashlib.sha256,
-    )
-    return h.hexdigest().upper()
+        image = image.resize(
+            (max(1, int(width * scale)), max(1, int(height * scale))),
+            Image.Resampling.LANCZOS,
+        )
+        encoded = _encode_jpeg(image, JPEG_MIN_QUALITY)
+
+    # Busca binária da maior qualidade que ainda cabe
+    low, high = JPEG_MIN_QUALITY, JPEG_MAX_QUALITY
+    while low < high:
+        quality = (low + high + 1) // 2
+        candidate = _encode_jpeg(image, quality)
+        if len(candidate) <= max_bytes:
+            low, encoded = quality, candidate
+        else:
+            high = quality - 1
+
+    return base64.b64encode(encoded).decode('utf-8')
 
 def token_required(view_func):
     """
@@ -135,34 +174,41 @@ def token_required(view_func):
     """
     @wraps(view_func)
     def _wrapped_view(request, *args, **kwargs):
-        expire_in = request.session.get("aliexpress_expire_in")
+        token_response = check_aliexpress_token(request)
+        if token_response is not None:
+            return token_response
+        return view_func(request, *args, **kwargs)
 
-        if not expire_in:
-            logger.warning("No expiration time set in session.")
-            return redirect("/aliexpress/authorization/", {"error": "Authentication required."})
+    return _wrapped_view
 
-        current_time = int(time.time())
-        if current_time + 60 >= expire_in:  # Check if token needs refresh
-            try:
-                refresh_response = refresh_aliexpress_token(request)
-                # Improved type checking
-                if not isinstance(refresh_response, HttpResponseRedirect):
-                    logger.error("Refresh token function did not return a redirect.")
-                    return redirect("/aliexpress/authorization/", \
-                        {"error": "Token refresh failed."})
-                return refresh_response
+def check_aliexpress_token(request):
+    """Check the shared token store, refreshing the token when close to expiry.
 
-            except ValueError as ve:  # More specific exception
-                logger.exception("ValueError during token refresh: %s", ve)
-                return redirect(
-                    "/aliexpress/authorization/",
-                    {"error": "Token refresh failed. Please re-authenticate."}
-                )
+    The token belongs to the one AliExpress account the shop runs on, so
+    only staff users may spend it.
 
-        return view_func(request, *args, **kwargs)
+    Returns:
+        HttpResponse: A redirect when the view must not run, otherwise None
+    """
+    if not (request.user.is_active and request.user.is_staff):
+        return redirect_to_login(request.get_full_path(), reverse("admin:login"))
 
-    return _wrapped_view
+    try:
+        token = token_store.get_valid()
+    except ValueError as ve:  # More specific exception
+        logger.exception("ValueError during token refresh: %s", ve)
+        return redirect(
+            "/aliexpress/authorization/",
+            {"error": "Token refresh failed. Please re-authenticate."}
+        )
+
+    if token is None:
+        logger.warning("No AliExpress account authorized.")
+        return redirect("/aliexpress/authorization/", {"error": "Authentication required."})
+
+    return None
 
+@staff_member_required
 def authorization_aliexpress(request):
     """ token verification """
     # Verifica se o token de acesso está presente e válido
@@ -172,11 +218,9 @@ def authorization_aliexpress(request):
         f"https://api-sg.aliexpress.com/oauth/authorize?response_type=code \
             &force_auth=true&redirect_uri={redirect_uri}&client_id={APP_KEY}")
 
+@staff_member_required
 def callback_aliexpress(request):
-    """Callback function using the iop library."""
-
-    client = iop.IopClient(APP_URL_REST, APP_KEY, APP_SECRET)
-    request_iop = iop.IopRequest('/auth/token/create')
+    """Callback function exchanging the authorization code for tokens."""
 
     # Get the authorization code from the request
     code = request.GET.get("code")
@@ -186,13 +230,8 @@ def callback_aliexpress(request):
             {"error": "Authorization code is missing."},
         )
 
-    request_iop.add_api_param('code', code)
-
     try:
-        response = client.execute(request_iop)
-
-        # response.body is ALREADY a dictionary.  No need for json.loads()
-        response_data = response.body  # Directly assign the dictionary
+        response_data = get_client().execute('/auth/token/create', {'code': code})
 
         if not all(
             key in response_data
@@ -204,115 +243,121 @@ def callback_aliexpress(request):
                 {"error": "Incomplete or invalid API response."},
             )
 
-        request.session["aliexpress_access_token"] = response_data.get("access_token")
-        request.session["aliexpress_refresh_token"] = response_data.get("refresh_token")
-        request.session["aliexpress_expire_in"] = int(time.time()) + int(
-            response_data.get("expires_in")
-        )
+        token_store.save_from_response(response_data)
 
         return redirect("/aliexpress/dashboard/")
 
-    except (KeyError, TypeError):  # Catch potential dictionary access errors
+    except (KeyError, TypeError, ValueError):  # Catch potential dictionary access errors
         logger.error("Error accessing data in API response.")
         return redirect(
             "/aliexpress/authorization/",
             {"error": "Error processing API response."},
         )
 
-def refresh_aliexpress_token(request):
-    """Refreshes the Aliexpress access token using the refresh token."""
-
-    refresh_token = request.session.get("aliexpress_refresh_token")
-    if not refresh_token:
-        logger.error("No refresh token found in session.")
-        return redirect("/aliexpress/authorization/", {"error": "No refresh token available."})
-
-    client = iop.IopClient(APP_URL_REST, APP_KEY, APP_SECRET)
-    request_iop = iop.IopRequest('/auth/token/refresh')
-    request_iop.add_api_param('refresh_token', refresh_token)
+@token_required
+def dashboard_aliexpress(request):
+    """dashboard aliexpress"""
+    return render(request, "app_aliexpress/aliexpress_dashboard.html")
 
-    try:
-        response = client.execute(request_iop)
+def fetch_aliexpress_product_detail(access_token, product_id):
+    """Fetches product details, served from the product cache when fresh.
 
-        if response.type == "success":
-            response_data = json.loads(response.body)
+    Concurrent misses for the same product share a single upstream call.
+    """
+    key = product_cache_key(product_id, ALIEXPRESS_TARGET_CURRENCY, ALIEXPRESS_SHIP_COUNTRY)
+    cached = product_detail_cache.get(key)
+    if cached is not None:
+        return cached
 
-            if not all(
-                key in response_data
-                for key in ["access_token", "expires_in"]):
-                logger.error("Incomplete or invalid refresh token API response.")
+    return product_detail_flight.do(
+        key, lambda: _load_aliexpress_product_detail(access_token, product_id, key)
+    )
 
-                return redirect("/aliexpress/authorization/", \
-                    {"error": "Invalid refresh token. Please re-authorize."})
-            request.session["aliexpress_access_token"] = response_data.get("access_token")
-            # Update the expiration time
-            request.session["aliexpress_expire_in"] = int(time.time()) \
-                + int(response_data.get("expires_in"))
+def _load_aliexpress_product_detail(access_token, product_id, key):
+    """Fetches product details from AliExpress API and caches the result."""
+    try:
+        response_data = get_client().execute(
+            "aliexpress.ds.product.get", product_detail_params(product_id), access_token
+        )
+    except ValueError as ve:  # More specific exception
+        # Degraded API: an expired copy beats an error page
+        stale = product_detail_cache.get_stale(key)
+        if stale is not None:
+            logger.warning("Serving stale product %s: %s", product_id, ve)
+            return stale
+        logger.exception("ValueError during token refresh: %s", ve)
+        return None, "Internal error processing the request."
 
-            # Refresh token may or may not be returned in the refresh response. Update if present.
-            new_refresh_token = response_data.get("refresh_token")
-            if new_refresh_token:
-                request.session["aliexpress_refresh_token"] = new_refresh_token
+    product, error = product_from_response(response_data)
+    if error:
+        return None, error
 
-            return redirect("/aliexpress/dashboard/")
+    # Quote freight for every SKU while the description is processed below
+    skus = product_skus(product)
+    freight_futures = submit_freight_quotes(
+        access_token, product_id, [sku["sku_id"] for sku in skus]
+    )
 
-        else:
-            # Consider removing the old refresh token if the refresh fails
-            # del request.session["aliexpress_refresh_token"]
-            return redirect(
-                "/aliexpress/authorization/",
-                {"error": "Error refreshing access token. Please re-authorize."},
-            )
+    # Static fields (description, images) outlive price and stock in the cache
+    static = product_detail_cache.get_static(key)
+    error = prepare_static_fields(product, static)
+    if error:
+        for future in freight_futures.values():
+            future.cancel()
+        return None, error
 
-    except json.JSONDecodeError:
-        return redirect(
-            "/aliexpress/authorization/",
-            {"error": "Error decoding refresh token API response."},
-        )
+    # Written while the freight quotes are still in flight
+    record_product_detail(product_id, product)
+    freights = apply_freight_matrix(product, skus, collect_freight_matrix(freight_futures))
 
-@token_required
-def dashboard_aliexpress(request):
-    """dashboard aliexpress"""
-    return render(request, "app_aliexpress/aliexpress_dashboard.html")
+    # Only cache complete answers: a failed quote for any SKU or country is
+    # an error dict that would otherwise be served for the whole TTL
+    if freight_matrix_complete(product["freight_matrix"]):
+        product_detail_cache.set(key, product, freights, static_fresh=static is None)
 
-def fetch_aliexpress_product_detail(access_token, product_id):
-    """Fetches product details from AliExpress API."""
-    method = "aliexpress.ds.product.get"
-    url_full = APP_URL_SYNC + method
+    return product, freights
 
-    params = {
-        "app_key": APP_KEY,
-        "timestamp": str(int(time.time() * 1000)),
-        "sign_method": "sha256",
-        "method": method,
+def product_detail_params(product_id):
+    """Application parameters for aliexpress.ds.product.get."""
+    return {
         "product_id": product_id,
         "target_currency": ALIEXPRESS_TARGET_CURRENCY,
         "ship_to_country": ALIEXPRESS_SHIP_COUNTRY,
-        "access_token": access_token,
     }
 
-    params["sign"] = generate_sign(APP_SECRET, method, params)
+def product_from_response(response_data):
+    """Extract the product from an aliexpress.ds.product.get response.
 
-    headers = {"Content-Type": "application/x-www-form-urlencoded;charset=utf-8"}
+    Returns:
+        tuple: ``(product, None)`` or ``(None, error message)``
+    """
+    result = response_data.get("aliexpress_ds_product_get_response", {})
+    if not result:
+        return None, "Invalid or missing data in API response."
+    product = result.get("result", {})
+    if not product:
+        return None, "Product data not found in API response."
+    return product, None
 
-    try:
-        response = requests.post(url_full, data=params, headers=headers, timeout=10)
-        response.raise_for_status()
-        response_data = response.json()
-        result = response_data.get("aliexpress_ds_product_get_response", {})
-        if result:
-            product = result.get("result", {})
-            if not product:
-                return None, "Product data not found in API response."
-        else:
-            return None, "Invalid or missing data in API response."
+def product_skus(product):
+    """Return the SKU list of a product, empty when it has none."""
+    return product.get("ae_item_sku_info_dtos", {}).get("ae_item_sku_info_d_t_o") or []
 
-    except ValueError as ve:  # More specific exception
-        logger.exception("ValueError during token refresh: %s", ve)
-        return None, "Internal error processing the request."
+def prepare_static_fields(product, static=None):
+    """Set image_urls and the processed description on ``product``.
+
+    Cached ``static`` fields are reused as they are instead of being rebuilt.
+
+    Returns:
+        str: Error message, or None on success
+    """
+    if static is not None:
+        product.update(static)
+        return None
 
     # Process image URLs
-    if "ae_multimedia_info_dto" in product and "image_urls" in product["ae_multimedia_info_dto"]:
+    if "ae_multimedia_info_dto" in product and \
+        "image_urls" in product["ae_multimedia_info_dto"]:
         product["image_urls"] = product["ae_multimedia_info_dto"]["image_urls"].split(";")
     else:
         product["image_urls"] = []
@@ -322,19 +367,22 @@ def fetch_aliexpress_product_detail(access_token, product_id):
         product["ae_item_base_info_dto"]["detail"] = process_product_description(
             product["ae_item_base_info_dto"]["detail"]
         )
-    else:
-        return None, "Product base info or description not found."
-
-    # Process freight
-    if "ae_item_sku_info_dtos" in product and "ae_item_sku_info_d_t_o" \
-        in product["ae_item_sku_info_dtos"] and \
-            product["ae_item_sku_info_dtos"]["ae_item_sku_info_d_t_o"]:
-        sku_id = product["ae_item_sku_info_dtos"]["ae_item_sku_info_d_t_o"][0]["sku_id"]
-        freights = shipping_aliexpress(access_token, product_id, sku_id=sku_id)
-    else:
-        freights = [] #Or return None, "SKU data not found." if it's critical.
+        return None
+    return "Product base info or description not found."
 
-    return product, freights
+def apply_freight_matrix(product, skus, freight_matrix):
+    """Attach the freight matrix to the product and its SKUs.
+
+    Returns:
+        list: Freight options of the first SKU for ALIEXPRESS_SHIP_COUNTRY
+    """
+    product["freight_matrix"] = freight_matrix
+    local_freights = freight_matrix.get(ALIEXPRESS_SHIP_COUNTRY, {})
+    for sku in skus:
+        sku["freights"] = local_freights.get(sku["sku_id"], [])
+    if skus:
+        return skus[0]["freights"]
+    return [] #Or return None, "SKU data not found." if it's critical.
 
 @token_required
 def product_detail_aliexpress(request, product_id):
@@ -347,7 +395,7 @@ def product_detail_aliexpress(request, product_id):
     Returns:
         _type_: _description_
     """
-    access_token = request.session.get("aliexpress_access_token")
+    access_token = get_access_token()
     if not access_token:
         return render(request, "app_aliexpress/aliexpress_product_detail.html", \
             {"error": "Access token missing."})
@@ -362,12 +410,142 @@ def product_detail_aliexpress(request, product_id):
         return render(request, "app_aliexpress/aliexpress_product_detail.html", \
                       {"error": "Failed to retrieve product details."})
 
-    return render(
+    # Unchanged products are answered with a 304 or from the fragment cache
+    return conditional_render(
         request,
         "app_aliexpress/aliexpress_product_detail.html",
         {"product": product, "freights": freights_or_error, "product_id": product_id},
     )
 
+def fetch_aliexpress_product_details(access_token, product_ids,
+                                     concurrency=ALIEXPRESS_BATCH_CONCURRENCY):
+    """Fetch many products concurrently, yielding each result as it completes.
+
+    Args:
+        access_token (str): Authentication token
+        product_ids (list): Product identifiers; duplicates are fetched once
+        concurrency (int): Maximum number of products fetched at the same time
+
+    Yields:
+        dict: ``{"product_id", "product", "freights"}`` or ``{"product_id", "error"}``
+    """
+    product_ids = list(dict.fromkeys(product_ids))
+    if not product_ids:
+        return
+
+    executor = ThreadPoolExecutor(
+        max_workers=max(1, min(concurrency, len(product_ids))),
+        thread_name_prefix="aliexpress-batch",
+    )
+    try:
+        # Batches run in the low rate-limit lane so they never starve interactive pages
+        futures = {
+            executor.submit(
+                call_with_priority, LOW, fetch_aliexpress_product_detail, access_token, product_id
+            ): product_id
+            for product_id in product_ids
+        }
+        for future in as_completed(futures):
+            product_id = futures[future]
+            try:
+                product, freights_or_error = future.result()
+            except ValueError as ve:  # More specific exception
+                logger.exception("ValueError during batch fetch: %s", ve)
+                yield {"product_id": product_id, "error": "Internal error processing request."}
+                continue
+
+            if isinstance(freights_or_error, str):
+                yield {"product_id": product_id, "error": freights_or_error}
+            elif product is None:
+                yield {"product_id": product_id, "error": "Failed to retrieve product details."}
+            else:
+                yield {"product_id": product_id, "product": product, "freights": freights_or_error}
+    finally:
+        # Stop queued work when the consumer goes away mid-batch
+        executor.shutdown(wait=False, cancel_futures=True)
+
+@api_token_or_staff
+def batch_product_detail_aliexpress(request):
+    """Fetch a batch of products and stream one JSON line per product.
+
+    Accepts ``?ids=1,2,3&concurrency=8`` on GET or a JSON body
+    ``{"product_ids": [...], "concurrency": 8}`` on POST. Lines are written in
+    completion order, not request order. Scripts authenticate with an
+    ``Authorization: Bearer`` header holding one of API_TOKENS; staff
+    sessions work too.
+
+    Args:
+        request: HTTP request object
+
+    Returns:
+        StreamingHttpResponse: ``application/x-ndjson`` results or a JSON error
+    """
+    access_token = get_access_token()
+    if not access_token:
+        return JsonResponse({"error": "Access token missing."}, status=401)
+
+    if request.method == "POST":
+        try:
+            payload = json.loads(request.body or b"{}")
+        except ValueError:
+            return JsonResponse({"error": "Invalid JSON body."}, status=400)
+        raw_ids = payload.get("product_ids") or []
+        concurrency = payload.get("concurrency")
+    else:
+        raw_ids = [i for i in request.GET.get("ids", "").split(",") if i.strip()]
+        concurrency = request.GET.get("concurrency")
+
+    try:
+        product_ids = [int(product_id) for product_id in raw_ids]
+        concurrency = int(concurrency or ALIEXPRESS_BATCH_CONCURRENCY)
+    except (TypeError, ValueError):
+        return JsonResponse({"error": "Product ids and concurrency must be integers."},
+                            status=400)
+
+    if not product_ids:
+        return JsonResponse({"error": "No product ids given."}, status=400)
+    if len(product_ids) > ALIEXPRESS_BATCH_MAX_SIZE:
+        return JsonResponse(
+            {"error": f"At most {ALIEXPRESS_BATCH_MAX_SIZE} products per batch."}, status=400
+        )
+    concurrency = max(1, min(concurrency, ALIEXPRESS_BATCH_MAX_CONCURRENCY))
+
+    lines = (
+        json.dumps(item) + "\n"
+        for item in fetch_aliexpress_product_details(access_token, product_ids, concurrency)
+    )
+    return StreamingHttpResponse(lines, content_type="application/x-ndjson")
+
+def load_feednames():
+    """Fetch the feed-name (promo) catalog from AliExpress.
+
+    Raises:
+        AliExpressAPIError: When the call fails or the response is unusable
+    """
+    # Execute request
+    response = get_client().execute('aliexpress.ds.feedname.get')
+    # Process response
+    if response.get('aliexpress_ds_feedname_get_response', {}).get('resp_result', {}) \
+        .get('resp_code', {}) != 200:
+        logger.error("API request failed: %s", response)
+        raise AliExpressAPIError("API request failed")
+
+    result = response.get('aliexpress_ds_feedname_get_response', {}) \
+                   .get('resp_result', {}) \
+                   .get('result', {})
+    if not (result and "promos" in result and "promo" in result["promos"]):
+        logger.error("Invalid API response structure: %s", response)
+        raise AliExpressAPIError("Error retrieving API data")
+    return result["promos"]["promo"]
+
+# One process-wide catalog instead of a copy in every user's session
+feedname_catalog = RefreshingValue(
+    "aliexpress:feednames",
+    load_feednames,
+    ttl=ALIEXPRESS_FEEDNAME_TTL,
+    refresh_after=ALIEXPRESS_FEEDNAME_REFRESH_AFTER,
+)
+
 @token_required
 def feedname_aliexpress(request):
     """Search feedname using AliExpress TOP API.
@@ -383,41 +561,10 @@ def feedname_aliexpress(request):
     # Check if refresh is requested
     refresh = request.GET.get("refresh") == "true" or request.method == "POST"
 
-    if refresh or "promos" not in request.session:
-        try:
-            # Initialize TOP client
-            client = iop.IopClient(APP_URL_SYNC, APP_KEY, APP_SECRET)
-            # Create request
-            request_api = iop.IopRequest('aliexpress.ds.feedname.get')
-            # Add timestamp as API parameter (if required by your implementation)
-            request_api.add_api_param('timestamp', str(int(time.time() * 1000)))
-            # Execute request
-            response = client.execute(request_api)
-            # Process response
-            if response.body.get('aliexpress_ds_feedname_get_response', {}).get('resp_result', {}) \
-                .get('resp_code', {}) == 200:
-                result = response.body.get('aliexpress_ds_feedname_get_response', {}) \
-                               .get('resp_result', {}) \
-                               .get('result', {})
-                if result and "promos" in result and "promo" in result["promos"]:
-                    promos = result["promos"]["promo"]
-                    request.session["promos"] = promos
-                else:
-                    logger.error("Invalid API response structure: %s", response.body)
-                    context["error"] = "Error retrieving API data"
-            else:
-                logger.error("API request failed: %s", response.body)
-                context["error"] = "API request failed"
-
-        except ValueError as ve:  # More specific exception
-            logger.exception("ValueError during token refresh: %s", ve)
-            return redirect(
-                    "/aliexpress/dashboard/",
-                    {"error": "Internal error processing request."}
-            )
-    else:
-        # Use cached session data
-        promos = request.session.get("promos", [])
+    try:
+        promos = feedname_catalog.get(force=refresh)
+    except AliExpressAPIError as error:
+        context["error"] = str(error)
 
     # Pagination
     paginator = Paginator(promos, 20)  # 10 items per page
@@ -449,72 +596,14 @@ def recommend_feed_aliexpress(request, feed_name):
     page_size = 50
 
     try:
-        # Initialize TOP client
-        client = iop.IopClient(APP_URL_SYNC, APP_KEY, APP_SECRET)
-        # Create and configure request
-        request_api = iop.IopRequest('aliexpress.ds.recommend.feed.get')
-        request_api.add_api_param('country', 'BR')
-        request_api.add_api_param('target_currency', 'BRL')
-        request_api.add_api_param('target_language', 'EN')
-        request_api.add_api_param('page_size', str(page_size))
-        request_api.add_api_param('sort', 'volumeDesc')
-        request_api.add_api_param('page_no', str(page_no))
-        request_api.add_api_param('feed_name', unquote(feed_name))
-        request_api.add_api_param('timestamp', str(int(time.time() * 1000)))
-
-        # Execute request
-        response = client.execute(request_api)
-
-        # Check if response is successful
-        if response.body.get('aliexpress_ds_feedname_get_response', {}).get('resp_result', {}) \
-                .get('resp_code', {}) == 200:  # Adjust based on actual success indicator
-            error_message = response.body.get('error_message', 'Unknown API Error')
-            logger.error("API error: %s", error_message)
-            return render(
-                request,
-                "app_aliexpress/aliexpress_dashboard.html",
-                {"error": error_message},
-            )
-
-        # Extract result from response
-        api_result = response.body.get('aliexpress_ds_recommend_feed_get_response', {}) \
-            .get('result', {})
-        if not api_result:
-            logger.error("Empty result in API response: %s", response.body)
-            return render(
-                request,
-                "app_aliexpress/aliexpress_recommend_feed.html",
-                {"error": "No results returned from API"},
-            )
-
-        products = api_result.get('products', {}).get('traffic_product_d_t_o', [])
-        total_record_count = int(api_result.get('total_record_count', 0))
-        is_finished = api_result.get('is_finished', False)
-
-        # Calculate total pages
-        total_pages = (total_record_count + page_size - 1) // page_size
-
-        # Validate page number
-        if page_no < 1 or page_no > total_pages:
-            return render(
-                request,
-                "app_aliexpress/aliexpress_recommend_feed.html",
-                {"error": f"Invalid page number. Valid range: 1 to {total_pages}"},
-            )
-
-        # Render successful response
-        return render(
-            request,
-            "app_aliexpress/aliexpress_recommend_feed.html",
-            {
-                "products": products,
-                "feed_name": feed_name,
-                "current_page": page_no,
-                "total_results": total_record_count,
-                "total_pages": total_pages,
-                "is_finished": is_finished,
-            },
-        )
+        response = fetch_recommend_feed_page(feed_name, page_no, page_size)
+        template, context = recommend_feed_context(response, feed_name, page_no, page_size)
+        # Users page linearly: fetch the next page while this one renders
+        if "products" in context and page_no < context["total_pages"]:
+            prefetch_recommend_feed_page(feed_name, page_no + 1, page_size)
+        if "products" in context:
+            return conditional_render(request, template, context)
+        return render(request, template, context)
 
     except ValueError as ve:  # More specific exception
         logger.exception("ValueError during token refresh: %s", ve)
@@ -523,63 +612,205 @@ def recommend_feed_aliexpress(request, feed_name):
                 {"error": "Internal error processing request."}
         )
 
-def shipping_aliexpress(access_token, product_id, sku_id):
+def recommend_feed_params(feed_name, page_no, page_size):
+    """Application parameters for aliexpress.ds.recommend.feed.get."""
+    return {
+        'country': 'BR',
+        'target_currency': 'BRL',
+        'target_language': 'EN',
+        'page_size': page_size,
+        'sort': 'volumeDesc',
+        'page_no': page_no,
+        'feed_name': unquote(feed_name),
+    }
+
+def fetch_recommend_feed_page(feed_name, page_no, page_size=50):
+    """Return the raw recommend feed response for a page, from the page cache if fresh."""
+    params = recommend_feed_params(feed_name, page_no, page_size)
+    key = request_cache_key(params)
+    response = feed_page_cache.get(key)
+    if response is None:
+        response = feed_page_flight.do(key, lambda: _load_recommend_feed_page(key, params))
+    return response
+
+def _load_recommend_feed_page(key, params):
+    """Fetches a recommend feed page and caches it when it has results."""
+    try:
+        response = get_client().execute('aliexpress.ds.recommend.feed.get', params)
+    except AliExpressAPIError:
+        stale = feed_page_cache.get_stale(key)
+        if stale is None:
+            raise
+        logger.warning("Serving stale feed page %s of %s", params['page_no'], params['feed_name'])
+        return stale
+    if response.get('aliexpress_ds_recommend_feed_get_response', {}).get('result'):
+        feed_page_cache.set(key, response, ALIEXPRESS_FEED_PAGE_TTL)
+        record_recommend_feed(response)
+    return response
+
+def prefetch_recommend_feed_page(feed_name, page_no, page_size=50):
+    """Warm the page cache for a feed page in the background."""
+    key = request_cache_key(recommend_feed_params(feed_name, page_no, page_size))
+    if feed_page_cache.get(key) is not None:
+        return None
+
+    def prefetch():
+        try:
+            fetch_recommend_feed_page(feed_name, page_no, page_size)
+        except ValueError as ve:  # More specific exception
+            logger.warning("Prefetch of %s page %s failed: %s", feed_name, page_no, ve)
+
+    return _prefetch_executor.submit(call_with_priority, LOW, prefetch)
+
+def recommend_feed_context(response, feed_name, page_no, page_size):
+    """Build the ``(template, context)`` pair for a recommend feed response."""
+
+    # Check if response is successful
+    if response.get('aliexpress_ds_feedname_get_response', {}).get('resp_result', {}) \
+            .get('resp_code', {}) == 200:  # Adjust based on actual success indicator
+        error_message = response.get('error_message', 'Unknown API Error')
+        logger.error("API error: %s", error_message)
+        return "app_aliexpress/aliexpress_dashboard.html", {"error": error_message}
+
+    # Extract result from response
+    api_result = response.get('aliexpress_ds_recommend_feed_get_response', {}) \
+        .get('result', {})
+    if not api_result:
+        logger.error("Empty result in API response: %s", response)
+        return "app_aliexpress/aliexpress_recommend_feed.html", \
+            {"error": "No results returned from API"}
+
+    products = api_result.get('products', {}).get('traffic_product_d_t_o', [])
+    total_record_count = int(api_result.get('total_record_count', 0))
+    is_finished = api_result.get('is_finished', False)
+
+    # Calculate total pages
+    total_pages = (total_record_count + page_size - 1) // page_size
+
+    # Validate page number
+    if page_no < 1 or page_no > total_pages:
+        return "app_aliexpress/aliexpress_recommend_feed.html", \
+            {"error": f"Invalid page number. Valid range: 1 to {total_pages}"}
+
+    return "app_aliexpress/aliexpress_recommend_feed.html", {
+        "products": products,
+        "feed_name": feed_name,
+        "current_page": page_no,
+        "total_results": total_record_count,
+        "total_pages": total_pages,
+        "is_finished": is_finished,
+    }
+
+def shipping_aliexpress(access_token, product_id, sku_id,
+                        ship_to_country=ALIEXPRESS_SHIP_COUNTRY):
     """Calculate shipping for a product using AliExpress TOP API.
 
     Args:
         access_token (str): Authentication token
         product_id (str): Product identifier
         sku_id (str): SKU identifier
+        ship_to_country (str): Destination country code
 
     Returns:
         dict: Shipping information or error details
     """
 
+    try:
+        # Execute request with access token
+        response = get_client().execute(
+            'aliexpress.ds.freight.query',
+            freight_query_params(product_id, sku_id, ship_to_country),
+            access_token,
+        )
+        return freights_from_response(response)
+
+    except ValueError as ve:  # More specific exception
+        logger.exception("ValueError during freight query: %s", ve)
+        return {"error": "Internal error processing request."}
+
+def freight_query_params(product_id, sku_id, ship_to_country=ALIEXPRESS_SHIP_COUNTRY):
+    """Application parameters for aliexpress.ds.freight.query."""
+
     # Prepare query delivery request
     query_delivery_req = {
         "productId": product_id,
         "selectedSkuId": sku_id,
         "currency": ALIEXPRESS_TARGET_CURRENCY,
-        "shipToCountry": ALIEXPRESS_SHIP_COUNTRY,
+        "shipToCountry": ship_to_country,
         "quantity": 1,
         "language": ALIEXPRESS_LOCALE,
         "locale": "zh_CN",
     }
+    return {'queryDeliveryReq': json.dumps(query_delivery_req)}
 
-    try:
-        # Initialize TOP client
-        client = iop.IopClient(APP_URL_SYNC, APP_KEY, APP_SECRET)
-        # Create and configure request
-        request = iop.IopRequest('aliexpress.ds.freight.query')
-        request.add_api_param('queryDeliveryReq', json.dumps(query_delivery_req))
-        request.add_api_param('timestamp', str(int(time.time() * 1000)))
+def freights_from_response(response):
+    """Extract the delivery options from a freight query response."""
 
-        # Execute request with access token
-        response = client.execute(request, access_token)
-
-        # Check response
-        if response.body.get('aliexpress_ds_freight_query_response', {}).get('result', {}) \
-                .get('code', {}) != 200:  # Adjust based on actual success indicator
-            error_msg = response.body.get('error_message', 'Unknown API Error')
-            logger.error("API error: %s", error_msg)
-            return {"error": error_msg}
-
-        # Extract result
-        result = response.body.get('aliexpress_ds_freight_query_response', {}).get('result', {}) \
-            .get('delivery_options', {}).get('delivery_option_d_t_o', {})
-        if result:
-            return result
-        else:
-            logger.error("Invalid or empty API response: %s", response.body)
-            return {"error": "Error retrieving API data"}
+    # Check response
+    if response.get('aliexpress_ds_freight_query_response', {}).get('result', {}) \
+            .get('code', {}) != 200:  # Adjust based on actual success indicator
+        error_msg = response.get('error_message', 'Unknown API Error')
+        logger.error("API error: %s", error_msg)
+        return {"error": error_msg}
 
-    except ValueError as ve:  # More specific exception
-        logger.exception("ValueError during token refresh: %s", ve)
-        return redirect(
-                "/aliexpress/dashboard/",
-                {"error": "Internal error processing request."}
+    # Extract result
+    result = response.get('aliexpress_ds_freight_query_response', {}).get('result', {}) \
+        .get('delivery_options', {}).get('delivery_option_d_t_o', {})
+    if result:
+        return result
+    logger.error("Invalid or empty API response: %s", response)
+    return {"error": "Error retrieving API data"}
+
+def submit_freight_quotes(access_token, product_id, sku_ids, countries=None):
+    """Queue a freight quote for every (country, SKU) pair on the freight pool.
+
+    Args:
+        access_token (str): Authentication token
+        product_id (str): Product identifier
+        sku_ids (list): SKU identifiers to quote
+        countries (list): Ship-to countries; defaults to ALIEXPRESS_SHIP_COUNTRY
+            plus ALIEXPRESS_FREIGHT_COUNTRIES
+
+    Returns:
+        dict: Futures keyed on ``(country, sku_id)``
+    """
+    if countries is None:
+        countries = [ALIEXPRESS_SHIP_COUNTRY, *ALIEXPRESS_FREIGHT_COUNTRIES]
+    return {
+        # Quotes keep the caller's context: its rate-limit lane and any profiling session
+        (country, sku_id): _freight_executor.submit(
+            copy_context().run, shipping_aliexpress, access_token, product_id, sku_id, country
         )
+        for country in dict.fromkeys(countries)
+        for sku_id in sku_ids
+    }
+
+def collect_freight_matrix(futures):
+    """Wait for the quotes from submit_freight_quotes and merge them.
+
+    Returns:
+        dict: ``{country: {sku_id: delivery options or error dict}}``
+    """
+    matrix = {}
+    for (country, sku_id), future in futures.items():
+        matrix.setdefault(country, {})[sku_id] = future.result()
+    return matrix
+
+def freight_matrix_complete(freight_matrix):
+    """Whether every quote of a freight matrix succeeded; failed ones are error dicts."""
+    return all(
+        isinstance(freights, list)
+        for quotes in freight_matrix.values() for freights in quotes.values()
+    )
 
+def freight_matrix_aliexpress(access_token, product_id, sku_ids, countries=None):
+    """Quote freight for every SKU and country concurrently."""
+    return collect_freight_matrix(
+        submit_freight_quotes(access_token, product_id, sku_ids, countries)
+    )
+
+
+@token_required
 def text_search_aliexpress(request):
     """Search products by text using AliExpress TOP API.
 
@@ -596,49 +827,11 @@ def text_search_aliexpress(request):
     current_page = int(request.GET.get('page', 1))
 
     try:
-        # Initialize TOP client
-        client = iop.IopClient(APP_URL_SYNC, APP_KEY, APP_SECRET)
-        # Create and configure request
-        request_api = iop.IopRequest('aliexpress.ds.text.search')
-        request_api.add_api_param('keyWord', keyword)
-        request_api.add_api_param('local', 'zh_CN')
-        request_api.add_api_param('countryCode', 'US')
-        request_api.add_api_param('sortBy', 'min_price')
-        request_api.add_api_param('pageSize', page_size)
-        request_api.add_api_param('pageIndex', page_index)
-        request_api.add_api_param('currency', 'USD')
-        request_api.add_api_param('timestamp', str(int(time.time() * 1000)))
-
-        # Execute request
-        response = client.execute(request_api, request.session["aliexpress_access_token"])
-
-        if response.body.get('aliexpress_ds_text_search_response', {}).get('data', {}) \
-            .get('products', {}) is None:  # Adjust based on actual success indicator
-            error_message = response.body.get('error_message', 'Unknown API Error')
-            logger.error("API error: %s", error_message)
-            return render(
-                request,
-                "app_aliexpress/aliexpress_text_search.html",
-                {"error": error_message}
-            )
-
-        # Process response
-        result = response.body.get('aliexpress_ds_text_search_response', {}).get('data', {})
-        products = result.get('products', {}).get('selection_search_product', [])
-        total_count = result.get('totalCount', 0)  # Adjust based on actual field name
-        total_pages = (int(total_count) + int(page_size) - 1) // int(page_size)
-        is_finished = current_page >= total_pages
-
-        context = {
-            'products': products,
-            'keyword': keyword,
-            'current_page': current_page,
-            'total_pages': total_pages,
-            'is_finished': is_finished,
-            'total_results': total_count,
-        }
-
-        return render(request, "app_aliexpress/aliexpress_text_search.html", context)
+        response = fetch_text_search_page(keyword, page_index, page_size, get_access_token())
+        context = text_search_context(response, keyword, current_page, page_size)
+        if "error" in context:
+            return render(request, "app_aliexpress/aliexpress_text_search.html", context)
+        return conditional_render(request, "app_aliexpress/aliexpress_text_search.html", context)
     except ValueError as ve:  # More specific exception
         logger.exception("ValueError during token refresh: %s", ve)
         return redirect(
@@ -646,6 +839,126 @@ def text_search_aliexpress(request):
                 {"error": "Internal error processing request."}
         )
 
+def normalize_keyword(keyword):
+    """Case and whitespace-insensitive form of a search keyword."""
+    return " ".join(keyword.lower().split())
+
+def text_search_params(keyword, page_index, page_size, sort_by='min_price',
+                       currency='USD', country_code='US'):
+    """Application parameters for aliexpress.ds.text.search."""
+    return {
+        'keyWord': normalize_keyword(keyword),
+        'local': 'zh_CN',
+        'countryCode': country_code,
+        'sortBy': sort_by,
+        'pageSize': str(page_size),
+        'pageIndex': str(page_index),
+        'currency': currency,
+    }
+
+def fetch_text_search_page(keyword, page_index, page_size, access_token):
+    """Return the raw text search response for a page, from the result cache if fresh.
+
+    Requests differing only in keyword case or spacing share one entry, and
+    concurrent misses for the same search share one upstream call.
+    """
+    params = text_search_params(keyword, page_index, page_size)
+    key = request_cache_key(params)
+    response = text_search_cache.get(key)
+    if response is None:
+        response = text_search_flight.do(
+            key, lambda: _load_text_search_page(key, params, access_token)
+        )
+    return response
+
+def _load_text_search_page(key, params, access_token):
+    """Runs a text search and caches the response when it has products."""
+    try:
+        response = get_client().execute('aliexpress.ds.text.search', params, access_token)
+    except AliExpressAPIError:
+        stale = text_search_cache.get_stale(key)
+        if stale is None:
+            raise
+        logger.warning("Serving stale text search for %r", params['keyWord'])
+        return stale
+    if response.get('aliexpress_ds_text_search_response', {}).get('data', {}) \
+            .get('products') is not None:
+        text_search_cache.set(key, response, ALIEXPRESS_TEXT_SEARCH_TTL)
+        record_text_search(response)
+    return response
+
+def text_search_context(response, keyword, current_page, page_size):
+    """Build the template context for a text search response."""
+    if response.get('aliexpress_ds_text_search_response', {}).get('data', {}) \
+        .get('products', {}) is None:  # Adjust based on actual success indicator
+        error_message = response.get('error_message', 'Unknown API Error')
+        logger.error("API error: %s", error_message)
+        return {"error": error_message}
+
+    # Process response
+    result = response.get('aliexpress_ds_text_search_response', {}).get('data', {})
+    products = result.get('products', {}).get('selection_search_product', [])
+    total_count = result.get('totalCount', 0)  # Adjust based on actual field name
+    total_pages = (int(total_count) + int(page_size) - 1) // int(page_size)
+    is_finished = current_page >= total_pages
+
+    return {
+        'products': products,
+        'keyword': keyword,
+        'current_page': current_page,
+        'total_pages': total_pages,
+        'is_finished': is_finished,
+        'total_results': total_count,
+    }
+
+@staff_member_required
+def catalog_search_aliexpress(request):
+    """Search the products already seen through the API, without spending quota."""
+    query = request.GET.get('q', '').strip()
+    category = request.GET.get('category', '').strip()
+    min_price = parse_price(request.GET.get('min_price'))
+    max_price = parse_price(request.GET.get('max_price'))
+    products = search_catalog(query, category or None, min_price, max_price)
+    return render(request, "app_aliexpress/aliexpress_catalog.html", {
+        "products": products,
+        "query": query,
+        "category": category,
+        "min_price": min_price if min_price is not None else "",
+        "max_price": max_price if max_price is not None else "",
+    })
+
+@staff_member_required
+def cache_stats_aliexpress(request): # pylint: disable=W0613
+    """Hit and miss counters of the AliExpress caches, for tuning their TTLs."""
+    return JsonResponse(cache_stats())
+
+def image_proxy_aliexpress(request):
+    """Resized AVIF/WebP copy of an AliExpress image, cached on disk.
+
+    Takes the image ``url``, the wanted width ``w`` and their signature
+    ``s``, as the ``image_proxy`` template filter builds them; the format
+    follows the browser's Accept header. Falls back to the original image
+    when it cannot be converted.
+    """
+    url = normalize_image_url(request.GET.get("url"))
+    if not allowed_image_url(url):
+        return HttpResponseBadRequest("Image host not allowed.")
+    width = snap_width(request.GET.get("w"))
+    if not valid_image_signature(url, width, request.GET.get("s")):
+        return HttpResponseForbidden("Invalid image signature.")
+    image_format = negotiate_format(request.headers.get("Accept", ""))
+    try:
+        data = image_variant(url, width, image_format)
+    except ImageProxyError as ipe:
+        logger.warning("Serving original image %s: %s", url, ipe)
+        return redirect(url)
+
+    response = HttpResponse(data, content_type=FORMATS[image_format][1])
+    # Variants of a URL never change, so browsers and CDNs may keep them for good
+    response["Cache-Control"] = f"public, max-age={ALIEXPRESS_IMAGE_MAX_AGE}, immutable"
+    response["Vary"] = "Accept"
+    return response
+
 @token_required
 def aliexpress_image_search(request):
     """View to perform Aliexpress image search."""
@@ -658,34 +971,26 @@ def aliexpress_image_search(request):
                 {"error": "Please provide an image."})
 
         try:
+            # Repeated or near-identical uploads are answered from the cache
+            fingerprint = image_fingerprint(image_file)
+            scope = image_search_scope()
+            products = image_search_cache.get(scope, fingerprint)
+            if products is not None:
+                return render(request, "app_aliexpress/aliexpress_image_search.html", \
+                    {"products": products})
+
             # Reduce the image size
             reduced_image = reduce_image_size(image_file)
-            client = iop.IopClient(APP_URL_SYNC, APP_KEY, APP_SECRET)
-            request_api = iop.IopRequest('aliexpress.ds.image.searchV2')
-
-            # Construct the param0 JSON
-            params = {
-                "sort_type": "price",
-                "image_base64": reduced_image,
-                "lang": "en",
-                "sort_order": "asc",
-                "ship_to": "BR"
-            }
-            request_api.add_api_param('param0', json.dumps(params))  # Convert to JSON string
-
-            access_token = request.session.get("aliexpress_access_token")
-            response = client.execute(request_api, access_token)
-            if response.body.get("aliexpress_ds_image_searchV2_response", {}) \
-                .get("result", {}).get("data", {}).get("data", []):
-                context = {
-                    "products": response.body.get("aliexpress_ds_image_searchV2_response", {}) \
-                    .get("result", {}).get("data", {}).get("data", [])
-                }
-                return render(request, "app_aliexpress/aliexpress_image_search.html", \
-                    context)
-            else:
-                return render(request, "app_aliexpress/aliexpress_image_search.html", \
-                    {"error": "Image search none."})
+
+            access_token = get_access_token()
+            response = get_client().execute(
+                'aliexpress.ds.image.searchV2', image_search_params(reduced_image), access_token
+            )
+            context = image_search_context(response)
+            if "products" in context:
+                image_search_cache.set(scope, fingerprint, context["products"])
+                record_image_search(context["products"])
+            return render(request, "app_aliexpress/aliexpress_image_search.html", context)
 
         except ValueError as ve:  # More specific exception
             logger.exception("ValueError during token refresh: %s", ve)
@@ -695,4 +1000,28 @@ def aliexpress_image_search(request):
             )
     else:
         return render(request, "app_aliexpress/aliexpress_image_search.html", {"results": ""})
-        
\ No newline at end of file
+
+def image_search_params(reduced_image, sort_type="price", sort_order="asc", ship_to="BR"):
+    """Application parameters for aliexpress.ds.image.searchV2."""
+
+    # Construct the param0 JSON
+    params = {
+        "sort_type": sort_type,
+        "image_base64": reduced_image,
+        "lang": "en",
+        "sort_order": sort_order,
+        "ship_to": ship_to
+    }
+    return {'param0': json.dumps(params)}  # Convert to JSON string
+
+def image_search_scope(sort_type="price", sort_order="asc", ship_to="BR"):
+    """Image search cache scope: results only match under the same search options."""
+    return f"{sort_type}:{sort_order}:{ship_to}"
+
+def image_search_context(response):
+    """Build the template context for an image search response."""
+    products = response.get("aliexpress_ds_image_searchV2_response", {}) \
+        .get("result", {}).get("data", {}).get("data", [])
+    if products:
+        return {"products": products}
+    return {"error": "Image search none."}
@@ -1,6 +1,8 @@
 from django.contrib import admin
 
-from .models import Product, Order
+from .models import ImportItem, ImportJob, Product, Order
 
 admin.site.register(Product)
 admin.site.register(Order)
+admin.site.register(ImportJob)
+admin.site.register(ImportItem)
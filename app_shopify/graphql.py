@@ -0,0 +1,281 @@
+"""Shopify Admin GraphQL documents, the helpers that build their inputs and the calls
+that create products."""
+from decimal import Decimal, InvalidOperation
+import json
+import urllib.error
+
+import shopify
+from decouple import config
+
+from core.metrics import track_upstream
+
+PRODUCT_CREATE = """
+mutation productCreate($product: ProductCreateInput!, $media: [CreateMediaInput!]) {
+    productCreate(product: $product, media: $media) {
+        product {
+            id
+        }
+        userErrors {
+            field
+            message
+        }
+    }
+}
+"""
+
+VARIANTS_BULK_CREATE = """
+mutation productVariantsBulkCreate($productId: ID!, $variants: [ProductVariantsBulkInput!]!) {
+    productVariantsBulkCreate(
+        productId: $productId, variants: $variants, strategy: REMOVE_STANDALONE_VARIANT
+    ) {
+        productVariants {
+            id
+            sku
+        }
+        userErrors {
+            field
+            message
+        }
+    }
+}
+"""
+
+PRIMARY_LOCATION = """
+{
+    locations(first: 1) {
+        edges {
+            node {
+                id
+            }
+        }
+    }
+}
+"""
+
+# Only what the product list shows: a plain-text description cut server side
+# and the lowest variant price instead of the variants connection
+PRODUCTS_PAGE = """
+query productsPage($first: Int, $after: String, $last: Int, $before: String) {
+    products(first: $first, after: $after, last: $last, before: $before, sortKey: ID) {
+        pageInfo {
+            hasNextPage
+            hasPreviousPage
+            startCursor
+            endCursor
+        }
+        nodes {
+            id
+            title
+            description(truncateAt: 160)
+            status
+            priceRangeV2 {
+                minVariantPrice {
+                    amount
+                }
+            }
+        }
+    }
+}
+"""
+
+# Used when the variants do not share one option name
+DEFAULT_OPTION_NAME = "Variant"
+
+
+class ShopifyGraphQLError(ValueError):
+    """Raised when a GraphQL call fails or returns errors.
+
+    Subclasses ValueError so the views' ``except ValueError`` blocks handle it.
+    """
+
+
+def execute(operation, query, variables=None):
+    """Run ``query`` on the active Shopify session and return its ``data``.
+
+    Args:
+        operation: Name the call is timed under in the upstream metrics
+        query: GraphQL document
+        variables: Its variables
+
+    Raises:
+        ShopifyGraphQLError: On transport errors, top-level errors or userErrors
+    """
+    try:
+        with track_upstream("shopify", f"graphql.{operation}") as call:
+            raw_result = shopify.GraphQL().execute(query, variables)
+            call["size"] = len(raw_result)
+        result = json.loads(raw_result)
+    except (urllib.error.URLError, ValueError) as exc:
+        raise ShopifyGraphQLError(f"Shopify {operation} failed: {exc}") from exc
+
+    if result.get("errors"):
+        raise ShopifyGraphQLError(f"Shopify {operation} failed: {result['errors']}")
+    data = result.get("data") or {}
+    for payload in data.values():
+        if isinstance(payload, dict) and payload.get("userErrors"):
+            raise ShopifyGraphQLError(f"Shopify {operation} rejected: {payload['userErrors']}")
+    return data
+
+
+def variant_price(value):
+    """``value`` as a Shopify money string; None when missing, not a number or not above zero."""
+    try:
+        price = Decimal(str(value)).quantize(Decimal("0.01"))
+    except (InvalidOperation, ValueError):
+        return None
+    return str(price) if price.is_finite() and price > 0 else None
+
+
+def _quantity(value):
+    try:
+        return max(0, int(value))
+    except (TypeError, ValueError):
+        return 0
+
+
+def variant_options(variants):
+    """Option name and one distinct option value per variant.
+
+    Shopify needs every variant under the same option names and rejects
+    duplicate values, so repeated values are told apart by their SKU.
+    """
+    names = {(variant.get("option1") or "").strip() for variant in variants}
+    name = names.pop() if len(names) == 1 and "" not in names else DEFAULT_OPTION_NAME
+    values, seen = [], set()
+    for index, variant in enumerate(variants, start=1):
+        value = (variant.get("value1") or variant.get("option1") or "").strip() \
+            or (variant.get("sku") or "").strip() or f"{DEFAULT_OPTION_NAME} {index}"
+        if value in seen:
+            value = f"{value} {variant.get('sku') or index}"
+        seen.add(value)
+        values.append(value)
+    return name, values
+
+
+def product_create_variables(push):
+    """Variables of PRODUCT_CREATE for a push.
+
+    A push is a dict of title, description, tags, image_urls and variants, as
+    built by ``views.push_from_request`` or ``imports.push_from_product``.
+    """
+    option_name, option_values = variant_options(push["variants"])
+    return {
+        "product": {
+            "title": push["title"],
+            "descriptionHtml": push["description"],
+            "vendor": "AliExpress",
+            "productType": "AliExpress Product",
+            "tags": push["tags"],
+            "productOptions": [{
+                "name": option_name,
+                "values": [{"name": value} for value in option_values],
+            }],
+        },
+        "media": [
+            {"originalSource": url, "mediaContentType": "IMAGE", "alt": push["title"]}
+            for url in push["image_urls"]
+        ],
+    }
+
+
+def variants_bulk_create_variables(product_gid, push, location_id=None):
+    """Variables of VARIANTS_BULK_CREATE creating every variant of ``push`` at once."""
+    option_name, option_values = variant_options(push["variants"])
+    variants = []
+    for variant, value in zip(push["variants"], option_values):
+        entry = {
+            "price": variant_price(variant.get("price")),
+            "optionValues": [{"optionName": option_name, "name": value}],
+            "inventoryItem": {"sku": variant.get("sku") or "", "tracked": True},
+        }
+        if location_id:
+            entry["inventoryQuantities"] = [{
+                "locationId": location_id,
+                "availableQuantity": _quantity(variant.get("quantity")),
+            }]
+        variants.append(entry)
+    return {"productId": product_gid, "variants": variants}
+
+
+def primary_location_id():
+    """Global id of the shop's first location, or None."""
+    edges = execute("locations", PRIMARY_LOCATION)["locations"]["edges"]
+    return edges[0]["node"]["id"] if edges else None
+
+
+def store_location_id(store):
+    """Global id of the store's location, looked up on first use and kept on ``store``."""
+    if not store.location_id:
+        store.location_id = primary_location_id()
+        store.save(update_fields=["location_id", "alter_at"])
+    return store.location_id
+
+
+def create_shopify_product(push, location_id=None):
+    """Create a product and all its variants in two GraphQL calls.
+
+    With ``location_id``, variant stock is set in the same call that creates
+    the variants.
+
+    Returns:
+        str: Global id of the new Shopify product
+    """
+    # Checked before anything is created, so a bad price never leaves a bare product behind
+    if any(variant_price(variant.get("price")) is None for variant in push["variants"]):
+        raise ShopifyGraphQLError("Every variant needs a price above zero.")
+
+    data = execute("productCreate", PRODUCT_CREATE, product_create_variables(push))
+    product_gid = data["productCreate"]["product"]["id"]
+
+    execute(
+        "productVariantsBulkCreate",
+        VARIANTS_BULK_CREATE,
+        variants_bulk_create_variables(product_gid, push, location_id),
+    )
+    return product_gid
+
+
+def activate_store_session(store):
+    """Point the Shopify client at ``store`` for the calling thread."""
+    shopify.Session.setup(
+        api_key=config("SHOPIFY_CLIENT_ID"), secret=config("SHOPIFY_CLIENT_SECRET")
+    )
+    session = shopify.Session(store.shop_url, config("SHOPIFY_API_VERSION"))
+    session.token = store.access_token
+    shopify.ShopifyResource.activate_session(session)
+
+
+def products_page(page_size, after=None, before=None):
+    """One page of the store's products, walking forward from ``after`` or back from ``before``.
+
+    Returns:
+        tuple: ``(products, page_info)``, products as the list template shows them
+    """
+    variables = {"last": page_size, "before": before} if before \
+        else {"first": page_size, "after": after}
+    connection = execute("products", PRODUCTS_PAGE, variables)["products"]
+    products = [
+        {
+            "id": node["id"],
+            "title": node["title"],
+            "description": node["description"],
+            "price": node["priceRangeV2"]["minVariantPrice"]["amount"],
+            "status": node["status"],
+        }
+        for node in connection["nodes"]
+    ]
+    return products, connection["pageInfo"]
+
+
+def iter_products(page_size, after=None):
+    """Yield the store's products page by page, following ``endCursor`` to the end.
+
+    Only one page is held at a time.
+    """
+    while True:
+        products, page_info = products_page(page_size, after=after)
+        if products:
+            yield products
+        if not page_info["hasNextPage"]:
+            return
+        after = page_info["endCursor"]
@@ -0,0 +1,251 @@
+"""Background import of AliExpress products into a Shopify store.
+
+The import view only queues an ImportJob; the ``run_import_jobs`` worker
+claims queued jobs and pushes their items with a bounded pool of threads.
+"""
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+import logging
+
+from django.db import DatabaseError, close_old_connections
+from django.db.models import F
+from django.utils import timezone
+from decouple import config
+
+from app_aliexpress.images import normalize_image_url
+from app_aliexpress.ratelimit import LOW, call_with_priority
+from app_aliexpress.tokens import get_access_token
+from app_aliexpress.views import fetch_aliexpress_product_detail, product_skus
+
+from .graphql import activate_store_session, create_shopify_product, store_location_id
+from .models import ImportItem, ImportJob, Product
+
+logger = logging.getLogger(__name__)
+
+# Items of a job fetched and pushed at the same time
+SHOPIFY_IMPORT_CONCURRENCY = config("SHOPIFY_IMPORT_CONCURRENCY", default=4, cast=int)
+SHOPIFY_IMPORT_MAX_SIZE = config("SHOPIFY_IMPORT_MAX_SIZE", default=1000, cast=int)
+# Shopify price of a variant, as a multiple of its AliExpress cost
+SHOPIFY_IMPORT_PRICE_MARKUP = config("SHOPIFY_IMPORT_PRICE_MARKUP", default="4", cast=Decimal)
+
+
+def create_import_job(store, product_ids):
+    """Queue ``product_ids`` for import into ``store``; duplicates are imported once."""
+    product_ids = list(dict.fromkeys(str(product_id) for product_id in product_ids))
+    job = ImportJob.objects.create(store=store, total=len(product_ids)) # pylint: disable=E1101
+    ImportItem.objects.bulk_create( # pylint: disable=E1101
+        ImportItem(job=job, aliexpress_id=product_id) for product_id in product_ids
+    )
+    return job
+
+
+def claim_next_job():
+    """Oldest pending job, marked running; None when the queue is empty.
+
+    The claim is a conditional update, so concurrent workers never take the
+    same job.
+    """
+    while True:
+        job = ImportJob.objects.filter(status="pending").order_by("id").first() # pylint: disable=E1101
+        if job is None:
+            return None
+        claimed = ImportJob.objects.filter(id=job.id, status="pending").update( # pylint: disable=E1101
+            status="running", started_at=timezone.now()
+        )
+        if claimed:
+            job.refresh_from_db()
+            return job
+
+
+def requeue_running_jobs():
+    """Queue again the jobs left running by a worker that stopped mid-job.
+
+    Only safe while no other worker is running.
+    """
+    return ImportJob.objects.filter(status="running").update(status="pending") # pylint: disable=E1101
+
+
+def _marked_up(cost):
+    try:
+        price = (Decimal(str(cost)) * SHOPIFY_IMPORT_PRICE_MARKUP).quantize(Decimal("0.01"))
+    except (InvalidOperation, ValueError):
+        return None
+    return price if price > 0 else None
+
+
+def push_from_product(product):
+    """Push for a product as ``fetch_aliexpress_product_detail`` returns it.
+
+    Mirrors what shopify_push_product.html posts: the SKU properties become
+    the option and its value, and the price is the SKU cost times
+    SHOPIFY_IMPORT_PRICE_MARKUP. SKUs without a usable cost are left out.
+    """
+    base = product.get("ae_item_base_info_dto", {})
+    variants = []
+    for sku in product_skus(product):
+        price = _marked_up(sku.get("offer_sale_price") or sku.get("sku_price"))
+        if price is None:
+            continue
+        properties = sku.get("ae_sku_property_dtos", {}).get("ae_sku_property_d_t_o") or []
+        variants.append({
+            "option1": " / ".join(
+                prop["sku_property_name"] for prop in properties if prop.get("sku_property_name")
+            ),
+            "value1": " / ".join(
+                prop.get("property_value_definition_name") or prop.get("sku_property_value", "")
+                for prop in properties
+            ),
+            "price": price,
+            "quantity": sku.get("sku_available_stock", 0),
+            "sku": sku.get("sku_code") or str(sku.get("sku_id", "")),
+        })
+    return {
+        "title": base.get("subject", ""),
+        "description": base.get("detail", ""),
+        "tags": [],
+        "image_urls": [
+            normalize_image_url(url) for url in product.get("image_urls", []) if url.strip()
+        ],
+        "variants": variants,
+    }
+
+
+def record_import(aliexpress_id, push, product_gid):
+    """Keep the imported product in the local Product table."""
+    Product.objects.update_or_create( # pylint: disable=E1101
+        aliexpress_id=aliexpress_id,
+        defaults={
+            "title": push["title"][:200],
+            "description": push["description"],
+            "price": push["variants"][0]["price"],
+            "stock": sum(int(variant["quantity"] or 0) for variant in push["variants"]),
+            "shopify_id": product_gid,
+        },
+    )
+
+
+def import_product(aliexpress_id, store, location_id, access_token):
+    """Fetch, transform and push one product; runs in the import threads.
+
+    Returns:
+        tuple: ``(push, product_gid)``
+
+    Raises:
+        ValueError: When the product cannot be fetched or created
+    """
+    try:
+        product, freights_or_error = fetch_aliexpress_product_detail(access_token, aliexpress_id)
+        if product is None or isinstance(freights_or_error, str):
+            raise ValueError(freights_or_error or "Failed to retrieve product details.")
+        push = push_from_product(product)
+        if not push["title"] or not push["variants"]:
+            raise ValueError("Product has no title or no variants.")
+
+        activate_store_session(store)
+        return push, create_shopify_product(push, location_id)
+    finally:
+        # The product fetch records the catalog from this thread
+        close_old_connections()
+
+
+def record_item_result(item, future):
+    """Store how the import of ``item`` went and count it on its job."""
+    try:
+        push, product_gid = future.result()
+    except Exception as exc: # pylint: disable=W0718
+        logger.exception("Import of product %s failed: %s", item.aliexpress_id, exc)
+        item.status, item.error = "failed", str(exc)
+        item.save(update_fields=["status", "error", "alter_at"])
+        ImportJob.objects.filter(id=item.job_id).update(failed=F("failed") + 1) # pylint: disable=E1101
+        return
+
+    # The product exists in the store from here on, so its id is kept first
+    item.status, item.shopify_id, item.error = "done", product_gid, ""
+    item.save(update_fields=["status", "shopify_id", "error", "alter_at"])
+    ImportJob.objects.filter(id=item.job_id).update(succeeded=F("succeeded") + 1) # pylint: disable=E1101
+    try:
+        record_import(item.aliexpress_id, push, product_gid)
+    except DatabaseError as exc:
+        logger.warning("Imported product %s not recorded locally: %s", item.aliexpress_id, exc)
+
+
+def final_status(job):
+    """``done`` when nothing failed, ``failed`` when nothing succeeded, else ``partial``."""
+    if not job.failed:
+        return "done"
+    return "partial" if job.succeeded else "failed"
+
+
+def _finish(job, status, error=""):
+    job.status = status
+    job.error = error
+    job.finished_at = timezone.now()
+    job.save(update_fields=["status", "error", "finished_at", "alter_at"])
+
+
+def run_import_job(job, concurrency=SHOPIFY_IMPORT_CONCURRENCY):
+    """Import every unfinished item of a claimed job, ``concurrency`` at a time.
+
+    Items run in the low rate-limit lane so imports never starve interactive
+    pages. A failed item is recorded and the others go on; the job ends
+    ``partial`` when some items failed and ``failed`` when all of them did.
+    """
+    access_token = get_access_token()
+    if not access_token:
+        _finish(job, "failed", "Access token missing.")
+        return job
+
+    store = job.store
+    try:
+        # Looked up once here; the worker threads only read it
+        activate_store_session(store)
+        location_id = store_location_id(store)
+    except ValueError as exc:
+        logger.exception("Import job %s could not start: %s", job.id, exc)
+        _finish(job, "failed", str(exc))
+        return job
+
+    # Items left running by a stopped worker are retried
+    items = iter(list(job.items.filter(status__in=["pending", "running"]).order_by("id")))
+    concurrency = max(1, concurrency)
+    in_flight = {}
+    with ThreadPoolExecutor(max_workers=concurrency,
+                            thread_name_prefix="shopify-import") as executor:
+        while True:
+            for item in islice(items, concurrency - len(in_flight)):
+                item.status = "running"
+                item.save(update_fields=["status", "alter_at"])
+                in_flight[executor.submit(
+                    call_with_priority, LOW, import_product,
+                    item.aliexpress_id, store, location_id, access_token,
+                )] = item
+            if not in_flight:
+                break
+            # Results are written from this thread only, so SQLite sees one writer
+            done, _pending = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                record_item_result(in_flight.pop(future), future)
+
+    job.refresh_from_db()
+    _finish(job, final_status(job))
+    return job
+
+
+def job_status(job):
+    """JSON-ready progress of ``job`` and the status of each of its items."""
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "total": job.total,
+        "succeeded": job.succeeded,
+        "failed": job.failed,
+        "pending": job.total - job.succeeded - job.failed,
+        "error": job.error,
+        "created_at": job.created_at.isoformat(),
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+        "items": list(job.items.order_by("id").values(
+            "aliexpress_id", "status", "shopify_id", "error"
+        )),
+    }
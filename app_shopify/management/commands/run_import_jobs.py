@@ -0,0 +1,54 @@
+"""Work through the queued Shopify import jobs."""
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from app_shopify.imports import (
+    SHOPIFY_IMPORT_CONCURRENCY,
+    claim_next_job,
+    requeue_running_jobs,
+    run_import_job,
+)
+
+
+class Command(BaseCommand):
+    """Claim pending ImportJobs one at a time and import their products."""
+
+    help = "Import the products of queued Shopify import jobs, polling for new jobs " \
+        "until stopped."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--concurrency", type=int, default=SHOPIFY_IMPORT_CONCURRENCY,
+                            help="Products of a job imported at the same time.")
+        parser.add_argument("--poll-interval", type=float, default=5,
+                            help="Seconds to wait when the queue is empty.")
+        parser.add_argument("--once", action="store_true",
+                            help="Exit once the queue is empty instead of polling.")
+        parser.add_argument("--requeue", action="store_true",
+                            help="First queue again the jobs left running by a stopped "
+                            "worker; only when no other worker is running.")
+
+    def handle(self, *args, **options):
+        if options["requeue"]:
+            self.stdout.write(f"Requeued {requeue_running_jobs()} running jobs")
+
+        while True:
+            job = claim_next_job()
+            if job is None:
+                if options["once"]:
+                    return
+                close_old_connections()
+                time.sleep(options["poll_interval"])
+                continue
+
+            started = time.perf_counter()
+            self.stdout.write(f"Job {job.id}: importing {job.total} products")
+            job = run_import_job(job, options["concurrency"])
+            style = {"done": self.style.SUCCESS, "partial": self.style.WARNING} \
+                .get(job.status, self.style.ERROR)
+            self.stdout.write(style(
+                f"Job {job.id} {job.status}: {job.succeeded} imported, {job.failed} failed "
+                f"in {time.perf_counter() - started:.1f}s"
+                + (f" ({job.error})" if job.error else "")
+            ))
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.19 on 2026-10-18 07:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_shopify', '0003_importjob_importitem'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='importjob',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('partial', 'Partly failed'), ('failed', 'Failed')], db_index=True, default='pending', max_length=10),
+        ),
+    ]
@@ -35,3 +35,48 @@ class ShopStore(models.Model):
 
     def __str__(self):
         return f"ShopStore {self.shop_url}"
+
+class ImportJob(models.Model):
+    """ Database batch of AliExpress products to push to a store """
+    STATUS_CHOICES = [
+        ("pending", "Pending"),
+        ("running", "Running"),
+        ("done", "Done"),
+        ("partial", "Partly failed"),
+        ("failed", "Failed"),
+    ]
+
+    store = models.ForeignKey(ShopStore, on_delete=models.CASCADE)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default="pending",
+                              db_index=True)
+    total = models.IntegerField(default=0)
+    succeeded = models.IntegerField(default=0)
+    failed = models.IntegerField(default=0)
+    error = models.TextField(blank=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    alter_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"ImportJob {self.id}"
+
+class ImportItem(models.Model):
+    """ Database one product of an import job """
+    STATUS_CHOICES = [
+        ("pending", "Pending"),
+        ("running", "Running"),
+        ("done", "Done"),
+        ("failed", "Failed"),
+    ]
+
+    job = models.ForeignKey(ImportJob, on_delete=models.CASCADE, related_name="items")
+    aliexpress_id = models.CharField(max_length=100)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default="pending")
+    shopify_id = models.CharField(max_length=100, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    alter_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"ImportItem {self.aliexpress_id}"
@@ -1,3 +1,373 @@
-from django.test import TestCase
+import json
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.test import Client, RequestFactory, SimpleTestCase, TestCase
+from django.urls import reverse
+
+from .graphql import (
+    DEFAULT_OPTION_NAME,
+    ShopifyGraphQLError,
+    create_shopify_product,
+    iter_products,
+    products_page,
+    variant_options,
+    variant_price,
+    variants_bulk_create_variables,
+)
+from .imports import create_import_job, run_import_job
+from .models import ImportItem, ImportJob, ShopStore
+from .views import SHOPIFY_PRODUCTS_PAGE_SIZE, push_from_request
+
+
+class VariantOptionsTests(SimpleTestCase):
+    """ Option names and values sent to Shopify """
+
+    def test_shared_option_name(self):
+        self.assertEqual(
+            variant_options([
+                {"option1": "Color", "value1": "Red"},
+                {"option1": "Color", "value1": "Blue"},
+            ]),
+            ("Color", ["Red", "Blue"]),
+        )
+
+    def test_mixed_option_names_fall_back_to_default(self):
+        name, values = variant_options([
+            {"option1": "Color", "value1": "Red"},
+            {"option1": "Size", "value1": "XL"},
+        ])
+        self.assertEqual(name, DEFAULT_OPTION_NAME)
+        self.assertEqual(values, ["Red", "XL"])
+
+    def test_duplicate_values_are_told_apart_by_sku(self):
+        _name, values = variant_options([
+            {"option1": "Color", "value1": "Red", "sku": "A1"},
+            {"option1": "Color", "value1": "Red", "sku": "A2"},
+            {"option1": "Color", "value1": "Red", "sku": ""},
+        ])
+        self.assertEqual(values, ["Red", "Red A2", "Red 3"])
+
+
+class VariantPriceTests(SimpleTestCase):
+    """ Money strings of variant prices """
+
+    def test_valid_prices(self):
+        self.assertEqual(variant_price("12.5"), "12.50")
+        self.assertEqual(variant_price(3), "3.00")
+
+    def test_unusable_prices(self):
+        for value in (None, "", "abc", "0", -1, "NaN", "Infinity"):
+            with self.subTest(value=value):
+                self.assertIsNone(variant_price(value))
+
+
+class VariantsBulkCreateTests(SimpleTestCase):
+    """ Variables of the variants bulk create mutation """
+
+    push = {"variants": [
+        {"option1": "Color", "value1": "Red", "price": "9.9", "quantity": "7", "sku": "R"},
+        {"option1": "Color", "value1": "Blue", "price": 12, "quantity": None, "sku": "B"},
+    ]}
+
+    def test_without_location(self):
+        variables = variants_bulk_create_variables("gid://shopify/Product/1", self.push)
+        self.assertEqual(variables, {
+            "productId": "gid://shopify/Product/1",
+            "variants": [
+                {
+                    "price": "9.90",
+                    "optionValues": [{"optionName": "Color", "name": "Red"}],
+                    "inventoryItem": {"sku": "R", "tracked": True},
+                },
+                {
+                    "price": "12.00",
+                    "optionValues": [{"optionName": "Color", "name": "Blue"}],
+                    "inventoryItem": {"sku": "B", "tracked": True},
+                },
+            ],
+        })
+
+    def test_with_location_sets_stock(self):
+        variables = variants_bulk_create_variables(
+            "gid://shopify/Product/1", self.push, "gid://shopify/Location/5"
+        )
+        self.assertEqual(
+            [variant["inventoryQuantities"] for variant in variables["variants"]],
+            [
+                [{"locationId": "gid://shopify/Location/5", "availableQuantity": 7}],
+                [{"locationId": "gid://shopify/Location/5", "availableQuantity": 0}],
+            ],
+        )
+
+    def test_bad_price_is_rejected_before_any_call(self):
+        push = {"title": "T", "description": "", "tags": [], "image_urls": [],
+                "variants": [{"option1": "Color", "value1": "Red", "price": "0"}]}
+        with mock.patch("app_shopify.graphql.execute") as execute:
+            with self.assertRaises(ShopifyGraphQLError):
+                create_shopify_product(push)
+        execute.assert_not_called()
+
+
+class PushFromRequestTests(TestCase):
+    """ Push built from the form of shopify_push_product.html """
+
+    def post(self, variants):
+        return RequestFactory().post("/", {"title": "Lamp", "variants": json.dumps(variants)})
+
+    def test_typed_prices_are_kept(self):
+        push, error = push_from_request(self.post([{"price": 19.9, "sku": "L"}]), "1")
+        self.assertIsNone(error)
+        self.assertEqual(push["variants"], [{"price": 19.9, "sku": "L"}])
+
+    def test_missing_price_is_an_error(self):
+        push, error = push_from_request(self.post([{"price": None, "sku": "L"}]), "1")
+        self.assertIsNone(push)
+        self.assertEqual(error, "Every variant needs a price above zero.")
+
+    def test_nothing_to_push(self):
+        request = RequestFactory().post("/", {"variants": "[]"})
+        self.assertEqual(push_from_request(request, "1"), (None, "Product data missing."))
+
+
+class ImportProductsViewTests(TestCase):
+    """ Queueing of import jobs """
+
+    def setUp(self):
+        self.store = ShopStore.objects.create( # pylint: disable=E1101
+            shop_url="example.myshopify.com", access_token="t", is_active=True
+        )
+        self.user = get_user_model().objects.create_user("staff", password="x", is_staff=True)
+        self.client.force_login(self.user)
+        self.url = reverse("import_products_shopify")
+
+    def queued_ids(self, response):
+        self.assertEqual(response.status_code, 202)
+        job = ImportJob.objects.get(id=response.json()["job_id"]) # pylint: disable=E1101
+        return list(job.items.order_by("id").values_list("aliexpress_id", flat=True))
+
+    def test_form_ids_split_on_commas_and_whitespace(self):
+        response = self.client.post(self.url, {"product_ids": "11, 12\n13 11"})
+        self.assertEqual(self.queued_ids(response), ["11", "12", "13"])
+
+    def test_json_ids(self):
+        response = self.client.post(
+            self.url, {"product_ids": [21, "22"]}, content_type="application/json"
+        )
+        self.assertEqual(self.queued_ids(response), ["21", "22"])
+
+    def test_rejects_bad_requests(self):
+        cases = [
+            ({"product_ids": "1 two"}, "Product ids must be integers."),
+            ({"product_ids": " "}, "No product ids given."),
+        ]
+        for data, error in cases:
+            with self.subTest(data=data):
+                response = self.client.post(self.url, data)
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json()["error"], error)
+        response = self.client.post(self.url, "{", content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+
+    def test_caps_the_job_size(self):
+        with mock.patch("app_shopify.views.SHOPIFY_IMPORT_MAX_SIZE", 2):
+            response = self.client.post(self.url, {"product_ids": "1 2 3"})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(ImportJob.objects.exists()) # pylint: disable=E1101
+
+    def test_needs_an_active_store(self):
+        self.store.is_active = False
+        self.store.save()
+        response = self.client.post(self.url, {"product_ids": "1"})
+        self.assertEqual(response.status_code, 409)
+
+    def test_anonymous_requests_are_refused(self):
+        response = Client().post(self.url, {"product_ids": "1"})
+        self.assertEqual(response.status_code, 401)
+
+    def test_api_token_skips_csrf(self):
+        client = Client(enforce_csrf_checks=True)
+        with mock.patch("core.auth.API_TOKENS", ["tok"]):
+            response = client.post(self.url, {"product_ids": "1"},
+                                   HTTP_AUTHORIZATION="Bearer tok")
+            self.assertEqual(response.status_code, 202)
+            response = client.post(self.url, {"product_ids": "1"},
+                                   HTTP_AUTHORIZATION="Bearer nope")
+            self.assertEqual(response.status_code, 401)
+
+    def test_staff_session_is_csrf_checked(self):
+        client = Client(enforce_csrf_checks=True)
+        client.force_login(self.user)
+        response = client.post(self.url, {"product_ids": "1"})
+        self.assertEqual(response.status_code, 403)
+
+
+def _import_product(aliexpress_id, store, location_id, access_token): # pylint: disable=W0613
+    if aliexpress_id.startswith("9"):
+        raise ValueError("Product not found.")
+    push = {"title": f"Product {aliexpress_id}", "description": "", "tags": [],
+            "image_urls": [], "variants": [{"price": "4.00", "quantity": 2, "sku": ""}]}
+    return push, f"gid://shopify/Product/{aliexpress_id}"
+
+
+@mock.patch("app_shopify.imports.import_product", _import_product)
+@mock.patch("app_shopify.imports.store_location_id", return_value="gid://shopify/Location/1")
+@mock.patch("app_shopify.imports.activate_store_session")
+@mock.patch("app_shopify.imports.get_access_token", return_value="token")
+class RunImportJobTests(TestCase):
+    """ Final status of import jobs """
+
+    def setUp(self):
+        self.store = ShopStore.objects.create( # pylint: disable=E1101
+            shop_url="example.myshopify.com", access_token="t", is_active=True
+        )
+
+    def run_job(self, product_ids):
+        job = create_import_job(self.store, product_ids)
+        return run_import_job(job, concurrency=2)
+
+    def test_done_when_every_item_succeeds(self, *_mocks):
+        job = self.run_job(["1", "2", "3"])
+        self.assertEqual((job.status, job.succeeded, job.failed), ("done", 3, 0))
+        self.assertEqual(
+            set(job.items.values_list("status", flat=True)), {"done"}
+        )
+
+    def test_partial_when_some_items_fail(self, *_mocks):
+        with self.assertLogs("app_shopify.imports", "ERROR"):
+            job = self.run_job(["1", "91", "2"])
+        self.assertEqual((job.status, job.succeeded, job.failed), ("partial", 2, 1))
+        failed = ImportItem.objects.get(job=job, aliexpress_id="91") # pylint: disable=E1101
+        self.assertEqual((failed.status, failed.error), ("failed", "Product not found."))
+
+    def test_failed_when_every_item_fails(self, *_mocks):
+        with self.assertLogs("app_shopify.imports", "ERROR") as logs:
+            job = self.run_job(["91", "92"])
+        self.assertEqual(len(logs.records), 2)
+        self.assertEqual((job.status, job.succeeded, job.failed), ("failed", 0, 2))
+
+    def test_failed_without_access_token(self, get_access_token, *_mocks):
+        get_access_token.return_value = None
+        job = self.run_job(["1"])
+        self.assertEqual((job.status, job.error), ("failed", "Access token missing."))
+        self.assertEqual(job.items.get().status, "pending")
+
+
+class FakeProductsConnection:
+    """ Stand-in for shopify.GraphQL serving a store of products sorted by ID """
+
+    def __init__(self, count):
+        self.ids = [f"gid://shopify/Product/{number}" for number in range(1, count + 1)]
+        self.calls = []
+
+    def cursor(self, index):
+        return f"cursor-{index}"
+
+    def execute(self, query, variables):
+        self.calls.append(variables)
+        if "sortKey: ID" not in query:
+            raise AssertionError("Pages must follow a stable sort key.")
+        cursor = variables.get("after") or variables.get("before")
+        if cursor is not None and cursor not in {self.cursor(i) for i in range(len(self.ids))}:
+            return json.dumps({"errors": [{"message": "Invalid cursor."}]})
+        if variables.get("before"):
+            end = int(variables["before"].split("-")[1])
+            start = max(0, end - variables["last"])
+        else:
+            start = int(variables["after"].split("-")[1]) + 1 if variables.get("after") else 0
+            end = min(len(self.ids), start + variables["first"])
+        nodes = [
+            {"id": id_, "title": id_.rsplit("/", 1)[1], "description": "", "status": "ACTIVE",
+             "priceRangeV2": {"minVariantPrice": {"amount": "1.0"}}}
+            for id_ in self.ids[start:end]
+        ]
+        return json.dumps({"data": {"products": {
+            "nodes": nodes,
+            "pageInfo": {
+                "hasNextPage": end < len(self.ids),
+                "hasPreviousPage": start > 0,
+                "startCursor": self.cursor(start) if nodes else None,
+                "endCursor": self.cursor(end - 1) if nodes else None,
+            },
+        }}})
+
+
+class ProductPaginationTests(SimpleTestCase):
+    """ Cursor pagination of the store's products """
+
+    def setUp(self):
+        self.store = FakeProductsConnection(5)
+        patcher = mock.patch("app_shopify.graphql.shopify.GraphQL", return_value=self.store)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def titles(self, products):
+        return [product["title"] for product in products]
+
+    def test_pages_walk_forward_and_back_in_id_order(self):
+        first, info = products_page(2)
+        self.assertEqual(self.titles(first), ["1", "2"])
+        self.assertFalse(info["hasPreviousPage"])
+        second, info = products_page(2, after=info["endCursor"])
+        self.assertEqual(self.titles(second), ["3", "4"])
+        last, last_info = products_page(2, after=info["endCursor"])
+        self.assertEqual(self.titles(last), ["5"])
+        self.assertFalse(last_info["hasNextPage"])
+        back, _info = products_page(2, before=last_info["startCursor"])
+        self.assertEqual(self.titles(back), ["3", "4"])
+
+    def test_iteration_stops_after_the_last_page(self):
+        pages = [self.titles(products) for products in iter_products(2)]
+        self.assertEqual(pages, [["1", "2"], ["3", "4"], ["5"]])
+        self.assertEqual(len(self.store.calls), 3)
+
+        self.store.ids = self.store.ids[:4]
+        self.store.calls.clear()
+        self.assertEqual(len(list(iter_products(2))), 2)
+        self.assertEqual(len(self.store.calls), 2)
+
+    def test_bad_cursor_is_an_error(self):
+        with self.assertRaises(ShopifyGraphQLError):
+            products_page(2, after="forged")
+        with self.assertRaises(ShopifyGraphQLError):
+            products_page(2, before="forged")
+
+
+@mock.patch("app_shopify.views.activate_store_session")
+class ListProductsViewTests(TestCase):
+    """ Product list page links and error handling """
+
+    def setUp(self):
+        self.store = FakeProductsConnection(3)
+        patcher = mock.patch("app_shopify.graphql.shopify.GraphQL", return_value=self.store)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        shop = ShopStore.objects.create( # pylint: disable=E1101
+            shop_url="example.myshopify.com", access_token="t", is_active=True
+        )
+        self.url = reverse("list_products_shopify", args=[shop.id])
+
+    def test_next_link_until_the_last_page(self, _activate):
+        response = self.client.get(self.url, {"page_size": 2})
+        self.assertContains(response, "?after=cursor-1&page_size=2")
+        self.assertNotContains(response, "?before=")
+        response = self.client.get(self.url, {"page_size": 2, "after": "cursor-1"})
+        self.assertContains(response, "?before=cursor-2&page_size=2")
+        self.assertNotContains(response, "?after=")
+
+    def test_page_size_is_clamped(self, _activate):
+        self.client.get(self.url, {"page_size": 1000})
+        self.client.get(self.url, {"page_size": "abc"})
+        self.assertEqual(self.store.calls[0]["first"], 250)
+        self.assertEqual(self.store.calls[1]["first"], SHOPIFY_PRODUCTS_PAGE_SIZE)
+
+    def test_bad_cursor_redirects(self, _activate):
+        with self.assertLogs("venv", "ERROR"):
+            response = self.client.get(self.url, {"after": "forged"})
+        self.assertEqual(response.status_code, 302)
+
+    def test_streamed_list_has_every_product(self, _activate):
+        response = self.client.get(self.url, {"page_size": 2, "stream": 1})
+        body = b"".join(response.streaming_content).decode()
+        self.assertEqual(body.count("badge bg-success"), 3)
+        self.assertEqual(len(self.store.calls), 2)
@@ -28,4 +28,14 @@ urlpatterns = [
         views.push_product_shopify,
         name="push_product_shopify",
     ),
+    path(
+        "import/",
+        views.import_products_shopify,
+        name="import_products_shopify",
+    ),
+    path(
+        "import/<int:job_id>/",
+        views.import_job_shopify,
+        name="import_job_shopify",
+    ),
 ]
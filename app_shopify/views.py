@@ -1,13 +1,28 @@
 """modules to  shopiffy views"""
 import json
 from venv import logger
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, redirect, render
+from django.template.loader import render_to_string
+from django.urls import reverse
 import shopify
 from decouple import config
 
+from app_aliexpress.images import normalize_image_url
+from app_aliexpress.tokens import get_access_token
 from app_aliexpress.views import fetch_aliexpress_product_detail
+from core.auth import api_token_or_staff
+from core.metrics import track_upstream
 
-from .models import Product, ShopStore
+from .graphql import activate_store_session, create_shopify_product, iter_products, \
+    products_page, store_location_id, variant_price
+from .imports import SHOPIFY_IMPORT_MAX_SIZE, create_import_job, job_status
+from .models import ImportJob, Product, ShopStore
+
+SHOPIFY_PRODUCTS_PAGE_SIZE = config("SHOPIFY_PRODUCTS_PAGE_SIZE", default=50, cast=int)
+# Where the streamed product list inserts its rows
+STREAM_ROWS_MARKER = "<!-- product rows -->"
 
 def install_shopify(request):
     """
@@ -79,7 +94,8 @@ def callback_shopify(request):
     shopify.ShopifyResource.activate_session(session)
 
     try:
-        shopify_token = session.request_token(params)
+        with track_upstream("shopify", "oauth.access_token"):
+            shopify_token = session.request_token(params)
 
         request.session["shopify_token"] = shopify_token
 
@@ -138,13 +154,18 @@ def remove_store_shopify(store_id):
     return redirect("/shopify/dashboard/")
 
 def list_products_shopify(request, store_id):
-    """
+    """List the store's products one page at a time.
+
+    ``?after=`` and ``?before=`` take the cursors of the next and previous
+    links. ``?stream=1`` instead walks every page into one streamed
+    response, holding a single page in memory at a time.
 
     Args:
-        request (_type_): _description_
+        request: HTTP request object
+        store_id: ShopStore id
 
     Returns:
-        _type_: _description_
+        HttpResponse: Product list page, or StreamingHttpResponse when streaming
     """
     store = ShopStore.objects.get(id=store_id) # pylint: disable=E1101
 
@@ -153,56 +174,30 @@ def list_products_shopify(request, store_id):
             request, "error.html", {"error": "Nenhuma loja ativa encontrada."}
         )
 
-    shopify.Session.setup(
-        api_key=config("SHOPIFY_CLIENT_ID"), secret=config("SHOPIFY_CLIENT_SECRET")
-    )
-    session = shopify.Session(store.shop_url, config("SHOPIFY_API_VERSION"))
-    session.token = store.access_token
-    shopify.ShopifyResource.activate_session(session)
-
     try:
-        # Consulta GraphQL para buscar produtos
-        query = """
-        {
-            products(first: 10) {
-                edges {
-                    node {
-                        id
-                        title
-                        descriptionHtml
-                        variants(first: 1) {
-                            edges {
-                                node {
-                                    price
-                                    inventoryQuantity
-                                }
-                            }
-                        }
-                        status
-                    }
-                }
-            }
-        }
-        """
-        result = json.loads(shopify.GraphQL().execute(query))
-        products = result["data"]["products"]["edges"]
-
-        # Formata os produtos para o template
-        formatted_products = []
-        for edge in products:
-            product = edge["node"]
-            formatted_products.append(
-                {
-                    "id": product["id"],
-                    "title": product["title"],
-                    "description": product["descriptionHtml"],
-                    "price": product["variants"]["edges"][0]["node"]["price"],
-                    "status": product["status"],
-                }
-            )
+        page_size = int(request.GET.get("page_size") or SHOPIFY_PRODUCTS_PAGE_SIZE)
+    except ValueError:
+        page_size = SHOPIFY_PRODUCTS_PAGE_SIZE
+    # Shopify serves at most 250 nodes per page
+    page_size = max(1, min(page_size, 250))
+
+    if request.GET.get("stream"):
+        return StreamingHttpResponse(stream_products_shopify(request, store, page_size))
 
+    activate_store_session(store)
+    try:
+        products, page_info = products_page(
+            page_size, after=request.GET.get("after"), before=request.GET.get("before")
+        )
         return render(
-            request, "app_shopify/list_products.html", {"products": formatted_products}
+            request,
+            "app_shopify/list_products.html",
+            {
+                "products": products,
+                "page_info": page_info,
+                "page_size": page_size,
+                "store_id": store_id,
+            },
         )
     except ValueError as ve:  # More specific exception
         logger.exception("ValueError during token refresh: %s", ve)
@@ -212,6 +207,35 @@ def list_products_shopify(request, store_id):
         # Desativa a sessão da Shopify
         shopify.ShopifyResource.clear_session()
 
+def stream_products_shopify(request, store, page_size):
+    """Yield the product list page with one chunk of table rows per page of products."""
+    page = render_to_string(
+        "app_shopify/list_products.html",
+        {"stream": True, "store_id": store.id, "rows_marker": STREAM_ROWS_MARKER},
+        request,
+    )
+    head, tail = page.split(STREAM_ROWS_MARKER, 1)
+    yield head
+
+    # The body is produced after the view returns, so the session is set up here
+    activate_store_session(store)
+    listed = 0
+    try:
+        for products in iter_products(page_size):
+            listed += len(products)
+            yield render_to_string("app_shopify/product_rows.html", {"products": products})
+        if not listed:
+            yield render_to_string("app_shopify/product_rows.html", {"products": []})
+    except ValueError as ve:
+        logger.exception("ValueError while streaming products: %s", ve)
+        yield render_to_string("app_shopify/product_rows.html",
+                               {"error": "Listing stopped: internal error processing request."})
+    finally:
+        # Desativa a sessão da Shopify
+        shopify.ShopifyResource.clear_session()
+    yield tail
+
+@staff_member_required
 def push_product_shopify(request, product_id):
     """
 
@@ -223,7 +247,7 @@ def push_product_shopify(request, product_id):
     """
     if request.method == 'GET':
         try:
-            access_token = request.session.get("aliexpress_access_token")
+            access_token = get_access_token()
             if not access_token:
                 return redirect("/aliexpress/dashboard/", {"error": "Access token missing."})
 
@@ -245,39 +269,21 @@ def push_product_shopify(request, product_id):
             return redirect("/aliexpress/dashboard/", {"error": "Internal error \
                 processing request."})
     if request.method == 'POST':
-        print(request.POST)
         try:
             store = ShopStore.objects.get(is_active=True) # pylint: disable=E1101
             if not store:
                 return redirect("/shopify/dashboard/", {"error": "No active store found."})
 
-            shopify.Session.setup(
-                api_key=config("SHOPIFY_CLIENT_ID"), secret=config("SHOPIFY_CLIENT_SECRET")
-            )
-            session = shopify.Session(store.shop_url, config("SHOPIFY_API_VERSION"))
-            session.token = store.access_token
-            shopify.ShopifyResource.activate_session(session)
-
-            product = Product.objects.get(aliexpress_id=product_id) # pylint: disable=E1101
-
-            # Create a new Shopify product
-            new_product = shopify.Product()
-            new_product.title = product.title
-            new_product.body_html = product.description
-            new_product.vendor = "AliExpress"
-            new_product.product_type = "AliExpress Product"
-            new_product.save()
-
-            # Create a new Shopify variant
-            new_variant = shopify.Variant()
-            new_variant.product_id = new_product.id
-            new_variant.price = product.price
-            new_variant.inventory_quantity = product.stock
-            new_variant.save()
-
-            # Associate the Shopify product with the Shopify store
-            store.shopify_id = new_product.id
-            store.save()
+            push, error = push_from_request(request, product_id)
+            if error:
+                return redirect("/shopify/dashboard/", {"error": error})
+
+            activate_store_session(store)
+            product_gid = create_shopify_product(push, store_location_id(store))
+
+            # Remember which Shopify product the AliExpress one became
+            Product.objects.filter(aliexpress_id=product_id) \
+                .update(shopify_id=product_gid) # pylint: disable=E1101
 
             return redirect("/shopify/dashboard/")
         except ValueError as ve:  # More specific exception
@@ -287,3 +293,102 @@ def push_product_shopify(request, product_id):
         finally:
             # Desativa a sessão da Shopify
             shopify.ShopifyResource.clear_session()
+
+def push_from_request(request, product_id):
+    """Product fields and variants posted by shopify_push_product.html.
+
+    Anything the form did not send comes from the stored Product.
+
+    Returns:
+        tuple: ``(push, error)``; push is a dict of title, description, tags,
+            image_urls and variants, None when error says what is missing
+    """
+    stored = Product.objects.filter(aliexpress_id=product_id).first() # pylint: disable=E1101
+    post = request.POST
+
+    try:
+        variants = json.loads(post.get("variants") or "[]")
+    except ValueError:
+        variants = []
+    variants = [variant for variant in variants if isinstance(variant, dict)] \
+        if isinstance(variants, list) else []
+    if not variants and stored is not None:
+        variants = [{"price": stored.price, "quantity": stored.stock, "sku": ""}]
+
+    title = post.get("title") or (stored.title if stored else "")
+    if not title or not variants:
+        return None, "Product data missing."
+    if any(variant_price(variant.get("price")) is None for variant in variants):
+        return None, "Every variant needs a price above zero."
+    return {
+        "title": title,
+        "description": post.get("description") or (stored.description if stored else ""),
+        "tags": [tag.strip() for tag in post.get("tags", "").split(",") if tag.strip()],
+        "image_urls": [
+            normalize_image_url(url) for url in post.getlist("image_urls") if url.strip()
+        ],
+        "variants": variants,
+    }, None
+
+@api_token_or_staff
+def import_products_shopify(request):
+    """Queue many AliExpress products for import into the active store.
+
+    Accepts a JSON body ``{"product_ids": [...]}`` or a ``product_ids`` form
+    field with the ids separated by commas or whitespace. Scripts
+    authenticate with an ``Authorization: Bearer`` header holding one of
+    API_TOKENS; staff sessions work too. The products are imported by the
+    ``run_import_jobs`` worker.
+
+    Args:
+        request: HTTP request object
+
+    Returns:
+        JsonResponse: ``{"job_id", "status_url"}`` with status 202, or an error
+    """
+    if request.method != "POST":
+        return JsonResponse({"error": "Use POST."}, status=405)
+
+    if request.content_type == "application/json":
+        try:
+            raw_ids = json.loads(request.body or b"{}").get("product_ids") or []
+        except (AttributeError, ValueError):
+            return JsonResponse({"error": "Invalid JSON body."}, status=400)
+    else:
+        raw_ids = request.POST.get("product_ids", "").replace(",", " ").split()
+
+    try:
+        product_ids = [int(product_id) for product_id in raw_ids]
+    except (TypeError, ValueError):
+        return JsonResponse({"error": "Product ids must be integers."}, status=400)
+
+    if not product_ids:
+        return JsonResponse({"error": "No product ids given."}, status=400)
+    if len(product_ids) > SHOPIFY_IMPORT_MAX_SIZE:
+        return JsonResponse(
+            {"error": f"At most {SHOPIFY_IMPORT_MAX_SIZE} products per import."}, status=400
+        )
+
+    store = ShopStore.objects.filter(is_active=True).first() # pylint: disable=E1101
+    if store is None:
+        return JsonResponse({"error": "No active store found."}, status=409)
+
+    job = create_import_job(store, product_ids)
+    return JsonResponse(
+        {"job_id": job.id, "status_url": reverse("import_job_shopify", args=[job.id])},
+        status=202,
+    )
+
+@api_token_or_staff
+def import_job_shopify(request, job_id): # pylint: disable=W0613
+    """Progress of an import job and the status of each of its products.
+
+    Args:
+        request: HTTP request object
+        job_id: ImportJob id
+
+    Returns:
+        JsonResponse: Job status, counters and items
+    """
+    job = get_object_or_404(ImportJob, id=job_id)
+    return JsonResponse(job_status(job))
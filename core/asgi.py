@@ -2,6 +2,8 @@
 ASGI config for core project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Serve it with ``uvicorn core.asgi:application`` so the async AliExpress views
+(``/aliexpress/async/...``) keep their upstream calls on the event loop.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
@@ -0,0 +1,177 @@
+"""In-process metrics aggregator rendered in the Prometheus text format.
+
+Observations only bump a few counters under a per-metric lock; buckets are
+made cumulative and labels formatted when ``/metrics`` is scraped.
+"""
+from bisect import bisect_left
+from contextlib import contextmanager
+import threading
+import time
+
+from .profiling import record_phase
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+_metrics = []
+_collectors = []
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter per label set."""
+
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def inc(self, *labels, amount=1):
+        """Add ``amount`` to the counter of ``labels``."""
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        """``(suffix, labels text, value)`` rows of the current values."""
+        with self._lock:
+            values = list(self._values.items())
+        return [("", _labels(self.labelnames, labels), value) for labels, value in values]
+
+
+class Histogram:
+    """Bucketed distribution per label set."""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def observe(self, value, *labels):
+        """Record one observation of ``value`` for ``labels``."""
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def samples(self):
+        """``(suffix, labels text, value)`` rows with cumulative buckets."""
+        with self._lock:
+            values = [(labels, (list(counts), total, count))
+                      for labels, (counts, total, count) in self._values.items()]
+        rows = []
+        for labels, (counts, total, count) in values:
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += bucket_count
+                le = bound if bound == "+Inf" else _number(float(bound))
+                rows.append(("_bucket", _labels(self.labelnames, labels, f'le="{le}"'),
+                             cumulative))
+            rows.append(("_sum", _labels(self.labelnames, labels), total))
+            rows.append(("_count", _labels(self.labelnames, labels), count))
+        return rows
+
+
+def register_collector(collector):
+    """Add a callable returning ``(name, kind, help, [(labels dict, value)])`` tuples.
+
+    Collectors run at scrape time, for values already kept elsewhere such
+    as cache counters or circuit breaker states.
+    """
+    _collectors.append(collector)
+    return collector
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in _metrics:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for suffix, labels, value in metric.samples():
+            lines.append(f"{metric.name}{suffix}{labels} {_number(value)}")
+    for collector in _collectors:
+        for name, kind, documentation, samples in collector():
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                lines.append(
+                    f"{name}{_labels(labels.keys(), labels.values())} {_number(value)}"
+                )
+    return "\n".join(lines) + "\n"
+
+
+http_request_duration = Histogram(
+    "http_request_duration_seconds", "Django view latency.", ("view", "method", "status")
+)
+http_response_size = Histogram(
+    "http_response_size_bytes", "Size of non-streaming response bodies.", ("view",),
+    buckets=SIZE_BUCKETS,
+)
+upstream_request_duration = Histogram(
+    "upstream_request_duration_seconds", "Latency of calls to AliExpress and Shopify.",
+    ("service", "method"),
+)
+upstream_response_size = Histogram(
+    "upstream_response_size_bytes", "Size of upstream response bodies.", ("service", "method"),
+    buckets=SIZE_BUCKETS,
+)
+upstream_errors = Counter(
+    "upstream_errors_total", "Failed upstream calls by error type.",
+    ("service", "method", "error"),
+)
+
+
+def observe_upstream(service, method, seconds, size=None, error=None):
+    """Record one upstream call; failed calls only count in ``upstream_errors``."""
+    record_phase(f"upstream {service} {method}", seconds)
+    if error is not None:
+        upstream_errors.inc(service, method, error)
+        return
+    upstream_request_duration.observe(seconds, service, method)
+    if size is not None:
+        upstream_response_size.observe(size, service, method)
+
+
+@contextmanager
+def track_upstream(service, method):
+    """Time the upstream call made inside the block.
+
+    Yields a dict whose ``"size"`` key the block may set to the response size.
+    """
+    call = {"size": None}
+    started = time.perf_counter()
+    try:
+        yield call
+    except Exception as exc:
+        observe_upstream(service, method, 0, error=type(exc).__name__)
+        raise
+    observe_upstream(service, method, time.perf_counter() - started, call["size"])
@@ -0,0 +1,96 @@
+"""Project-wide middleware."""
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.urls import reverse
+
+from .metrics import http_request_duration, http_response_size
+from .profiling import profile_request, write_report
+
+
+def _view_name(request):
+    # Route names keep the label set bounded, unlike raw paths
+    match = getattr(request, "resolver_match", None)
+    return match.view_name if match is not None else "unmatched"
+
+
+class MetricsMiddleware:
+    """Record the latency, status and response size of every request."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        started = time.perf_counter()
+        response = self.get_response(request)
+        self._record(request, response, started)
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        response = await self.get_response(request)
+        self._record(request, response, started)
+        return response
+
+    @staticmethod
+    def _record(request, response, started):
+        view = _view_name(request)
+        http_request_duration.observe(
+            time.perf_counter() - started, view, request.method, response.status_code
+        )
+        if not response.streaming:
+            http_response_size.observe(len(response.content), view)
+
+
+def _wants_profile(request):
+    return bool(request.headers.get("X-Profile") or request.GET.get("profile"))
+
+
+class ProfilingMiddleware:
+    """Profile a single request on demand, for staff users only.
+
+    Triggered by an ``X-Profile`` header or a ``profile`` query parameter.
+    The report link is returned in the ``X-Profile-Report`` header. Other
+    requests pass straight through.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not (_wants_profile(request) and request.user.is_staff):
+            return self.get_response(request)
+        started = time.perf_counter()
+        with profile_request(request) as session:
+            response = self.get_response(request)
+        return self._attach(session, response, started)
+
+    async def __acall__(self, request):
+        if not _wants_profile(request) or \
+                not await sync_to_async(lambda: request.user.is_staff)():
+            return await self.get_response(request)
+        started = time.perf_counter()
+        # cProfile follows one thread, which the event loop shares with other requests
+        with profile_request(request, use_profiler=False) as session:
+            response = await self.get_response(request)
+        return self._attach(session, response, started)
+
+    @staticmethod
+    def _attach(session, response, started):
+        report_id = write_report(session, response.status_code, time.perf_counter() - started)
+        response["X-Profile-Report"] = reverse("profile_report", args=[report_id, "txt"])
+        return response
@@ -0,0 +1,147 @@
+"""Per-request profiling sessions and phase timings.
+
+Nothing is recorded unless a session is active in the current context, so
+the hooks left in the request path cost one context variable lookup.
+"""
+from contextlib import contextmanager
+import contextvars
+import cProfile
+from datetime import datetime, timezone
+import io
+from pathlib import Path
+import pstats
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from decouple import config
+
+PROFILE_REPORT_DIR = Path(config(
+    "PROFILE_REPORT_DIR", default=str(Path(settings.BASE_DIR) / "profiles")
+))
+PROFILE_MAX_REPORTS = config("PROFILE_MAX_REPORTS", default=50, cast=int)
+PROFILE_TOP_FUNCTIONS = config("PROFILE_TOP_FUNCTIONS", default=40, cast=int)
+
+# Functions whose cumulative profiler time is reported as a phase of its own
+PROFILED_PHASES = {
+    "template render": ("django/template/backends/django.py", "render"),
+}
+
+_session = contextvars.ContextVar("profile_session", default=None)
+
+
+class ProfileSession:
+    """Phase timings collected while one request is being profiled."""
+
+    def __init__(self, request):
+        self.report_id = uuid.uuid4().hex
+        self.label = f"{request.method} {request.get_full_path()}"
+        self.started_at = datetime.now(timezone.utc)
+        self.phases = {}
+        self.profiler = None
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds):
+        """Add one timing of phase ``name``."""
+        with self._lock:
+            calls, total, longest = self.phases.get(name, (0, 0.0, 0.0))
+            self.phases[name] = (calls + 1, total + seconds, max(longest, seconds))
+
+    def add_profiled_phases(self, stats):
+        """Add the PROFILED_PHASES found in the profiler ``stats``."""
+        for (path, _line, func), (_cc, _calls, _tt, cumtime, _callers) in stats.stats.items():
+            for name, (filename, function) in PROFILED_PHASES.items():
+                if func == function and path.replace("\\", "/").endswith(filename):
+                    self.add(name, cumtime)
+
+
+def active_session():
+    """Session of the request being profiled in this context, or None."""
+    return _session.get()
+
+
+def record_phase(name, seconds):
+    """Record a timing measured elsewhere, when a session is active."""
+    session = _session.get()
+    if session is not None:
+        session.add(name, seconds)
+
+
+@contextmanager
+def phase(name):
+    """Time the block as phase ``name`` when a session is active."""
+    session = _session.get()
+    if session is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        session.add(name, time.perf_counter() - started)
+
+
+@contextmanager
+def profile_request(request, use_profiler=True):
+    """Collect phase timings, and a cProfile trace if ``use_profiler``, for one request.
+
+    The profiler only sees the calling thread; work handed to executors
+    shows up through the phase hooks instead.
+    """
+    session = ProfileSession(request)
+    token = _session.set(session)
+    if use_profiler:
+        session.profiler = cProfile.Profile()
+        session.profiler.enable()
+    try:
+        yield session
+    finally:
+        if session.profiler is not None:
+            session.profiler.disable()
+        _session.reset(token)
+
+
+def write_report(session, status, elapsed):
+    """Write the text report and the raw .prof of ``session``; return the report id."""
+    PROFILE_REPORT_DIR.mkdir(parents=True, exist_ok=True)
+    out = io.StringIO()
+    out.write(f"{session.label}\nstatus {status}, {elapsed * 1000:.1f} ms, "
+              f"{session.started_at.isoformat()}\n\n")
+
+    stats = None
+    if session.profiler is not None:
+        stats = pstats.Stats(session.profiler, stream=out)
+        session.add_profiled_phases(stats)
+        stats.dump_stats(PROFILE_REPORT_DIR / f"{session.report_id}.prof")
+
+    out.write("Phases (work in other threads overlaps, so totals may exceed wall time)\n")
+    out.write(f"{'phase':<56}{'calls':>7}{'total ms':>11}{'max ms':>10}\n")
+    for name, (calls, total, longest) in sorted(
+            session.phases.items(), key=lambda item: -item[1][1]):
+        out.write(f"{name[:55]:<56}{calls:>7}{total * 1000:>11.1f}{longest * 1000:>10.1f}\n")
+
+    if stats is not None:
+        out.write(f"\ncProfile, top {PROFILE_TOP_FUNCTIONS} by cumulative time\n")
+        stats.sort_stats("cumulative").print_stats(PROFILE_TOP_FUNCTIONS)
+    else:
+        out.write("\nNo cProfile trace: async requests only record phases.\n")
+
+    (PROFILE_REPORT_DIR / f"{session.report_id}.txt").write_text(out.getvalue(), "utf-8")
+    _prune_reports()
+    return session.report_id
+
+
+def _prune_reports():
+    reports = sorted(PROFILE_REPORT_DIR.glob("*.txt"), key=lambda path: path.stat().st_mtime)
+    for report in reports[:-PROFILE_MAX_REPORTS] if PROFILE_MAX_REPORTS > 0 else []:
+        report.unlink(missing_ok=True)
+        report.with_suffix(".prof").unlink(missing_ok=True)
+
+
+def report_path(report_id, extension):
+    """Path of a stored report, or None when it does not exist."""
+    if len(report_id) != 32 or not all(char in "0123456789abcdef" for char in report_id):
+        return None
+    path = PROFILE_REPORT_DIR / f"{report_id}.{extension}"
+    return path if path.exists() else None
@@ -0,0 +1,151 @@
+from pathlib import Path
+import tempfile
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.test import RequestFactory, SimpleTestCase, TestCase
+from django.urls import reverse
+
+from . import metrics, profiling
+from .metrics import Histogram, track_upstream
+
+
+def _sample(name, labels):
+    """Value of one sample line of the rendered metrics, 0 when absent."""
+    prefix = f"{name}{{{labels}}} "
+    for line in metrics.render().splitlines():
+        if line.startswith(prefix):
+            return float(line[len(prefix):])
+    return 0
+
+
+class HistogramTests(SimpleTestCase):
+    """ Prometheus text rendering of the aggregator """
+
+    def setUp(self):
+        self.histogram = Histogram("test_seconds", "Test.", ("view",), buckets=(0.1, 1.0))
+        self.addCleanup(metrics._metrics.remove, self.histogram) # pylint: disable=W0212
+
+    def test_buckets_are_cumulative(self):
+        for value in (0.05, 0.5, 0.7, 5):
+            self.histogram.observe(value, "home")
+        self.assertEqual(_sample("test_seconds_bucket", 'view="home",le="0.1"'), 1)
+        self.assertEqual(_sample("test_seconds_bucket", 'view="home",le="1.0"'), 3)
+        self.assertEqual(_sample("test_seconds_bucket", 'view="home",le="+Inf"'), 4)
+        self.assertEqual(_sample("test_seconds_count", 'view="home"'), 4)
+        self.assertAlmostEqual(_sample("test_seconds_sum", 'view="home"'), 6.25)
+
+    def test_failed_upstream_calls_only_count_as_errors(self):
+        labels = 'service="test",method="call",error="TimeoutError"'
+        before = _sample("upstream_errors_total", labels)
+        with self.assertRaises(TimeoutError), track_upstream("test", "call"):
+            raise TimeoutError
+        self.assertEqual(_sample("upstream_errors_total", labels), before + 1)
+        self.assertEqual(
+            _sample("upstream_request_duration_seconds_count", 'service="test",method="call"'), 0
+        )
+
+
+class MetricsEndpointTests(TestCase):
+    """ /metrics access and the request metrics middleware """
+
+    def setUp(self):
+        self.staff = get_user_model().objects.create_user("staff", password="x", is_staff=True)
+        self.url = reverse("metrics")
+
+    def test_anonymous_readers_are_refused(self):
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+
+    def test_staff_can_read(self):
+        self.client.force_login(self.staff)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "# TYPE http_request_duration_seconds histogram")
+
+    def test_token_when_configured(self):
+        with mock.patch("core.views.METRICS_TOKEN", "scrape"):
+            self.assertEqual(
+                self.client.get(self.url, HTTP_AUTHORIZATION="Bearer scrape").status_code, 200
+            )
+            self.assertEqual(
+                self.client.get(self.url, HTTP_AUTHORIZATION="Bearer other").status_code, 401
+            )
+
+    def test_requests_are_recorded_under_their_route_name(self):
+        labels = 'view="metrics",method="GET",status="401"'
+        before = _sample("http_request_duration_seconds_count", labels)
+        self.client.get(self.url)
+        self.client.get(self.url)
+        self.assertEqual(_sample("http_request_duration_seconds_count", labels), before + 2)
+        self.assertGreater(_sample("http_response_size_bytes_count", 'view="metrics"'), 0)
+
+
+class ProfilingTests(TestCase):
+    """ On-demand profiling and the report download """
+
+    def setUp(self):
+        report_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(report_dir.cleanup)
+        patcher = mock.patch("core.profiling.PROFILE_REPORT_DIR", Path(report_dir.name))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        user_model = get_user_model()
+        self.staff = user_model.objects.create_user("staff", password="x", is_staff=True)
+        self.user = user_model.objects.create_user("user", password="x")
+        self.url = reverse("metrics")
+
+    def test_staff_requests_are_profiled_on_demand(self):
+        self.client.force_login(self.staff)
+        self.assertNotIn("X-Profile-Report", self.client.get(self.url))
+        for response in (self.client.get(self.url, HTTP_X_PROFILE="1"),
+                         self.client.get(self.url, {"profile": "1"})):
+            report_url = response["X-Profile-Report"]
+            report = b"".join(self.client.get(report_url).streaming_content).decode()
+            self.assertIn("GET /metrics", report)
+            self.assertIn("cProfile, top", report)
+            prof = self.client.get(report_url.replace(".txt", ".prof"))
+            self.assertIn("attachment", prof["Content-Disposition"])
+
+    def test_other_users_are_never_profiled(self):
+        self.assertNotIn("X-Profile-Report", self.client.get(self.url, HTTP_X_PROFILE="1"))
+        self.client.force_login(self.user)
+        self.assertNotIn("X-Profile-Report", self.client.get(self.url, HTTP_X_PROFILE="1"))
+
+    def test_reports_are_staff_only(self):
+        self.client.force_login(self.staff)
+        report_url = self.client.get(self.url, HTTP_X_PROFILE="1")["X-Profile-Report"]
+        self.client.force_login(self.user)
+        response = self.client.get(report_url)
+        self.assertEqual(response.status_code, 302)
+        self.assertIn(reverse("admin:login"), response["Location"])
+        self.client.force_login(self.staff)
+        self.assertEqual(self.client.get(reverse("profile_report", args=["0" * 32, "txt"]))
+                         .status_code, 404)
+
+    def test_old_reports_are_pruned(self):
+        self.client.force_login(self.staff)
+        with mock.patch("core.profiling.PROFILE_MAX_REPORTS", 2):
+            urls = [self.client.get(self.url, HTTP_X_PROFILE="1")["X-Profile-Report"]
+                    for _ in range(3)]
+            self.assertEqual(len(list(profiling.PROFILE_REPORT_DIR.glob("*.txt"))), 2)
+            self.assertEqual(len(list(profiling.PROFILE_REPORT_DIR.glob("*.prof"))), 2)
+        self.assertEqual(self.client.get(urls[-1]).status_code, 200)
+
+
+class PhaseTests(SimpleTestCase):
+    """ Phase timings outside and inside a profiling session """
+
+    def test_phases_only_record_inside_a_session(self):
+        with profiling.phase("outside"):
+            pass
+        request = RequestFactory().get("/page")
+        with profiling.profile_request(request, use_profiler=False) as session:
+            with profiling.phase("upstream"):
+                pass
+            profiling.record_phase("upstream", 0.5)
+        profiling.record_phase("after", 1)
+        self.assertIsNone(profiling.active_session())
+        self.assertEqual(list(session.phases), ["upstream"])
+        calls, total, longest = session.phases["upstream"]
+        self.assertEqual((calls, longest), (2, 0.5))
+        self.assertGreaterEqual(total, 0.5)
@@ -15,10 +15,15 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
+
+from . import views
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('metrics', views.metrics, name='metrics'),
+    re_path(r'^profiles/(?P<report_id>[0-9a-f]{32})\.(?P<extension>txt|prof)$',
+            views.profile_report, name='profile_report'),
     path('shopify/', include('app_shopify.urls')),
     path('aliexpress/', include('app_aliexpress.urls')),
 ]
@@ -0,0 +1,44 @@
+"""Project-level views."""
+import hmac
+
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import FileResponse, Http404, HttpResponse
+from decouple import config
+
+from . import metrics as metrics_registry
+from .profiling import report_path
+
+# When set, scrapers may send "Authorization: Bearer <METRICS_TOKEN>"; staff
+# users can always read the metrics
+METRICS_TOKEN = config("METRICS_TOKEN", default="")
+
+
+def _has_metrics_token(request):
+    return bool(METRICS_TOKEN) and hmac.compare_digest(
+        request.headers.get("Authorization", "").encode(), f"Bearer {METRICS_TOKEN}".encode()
+    )
+
+
+def metrics(request):
+    """Expose the in-process metrics in the Prometheus text format.
+
+    Route names and traffic volumes are not public: readers need the
+    METRICS_TOKEN or a staff session.
+    """
+    if not (_has_metrics_token(request)
+            or (request.user.is_active and request.user.is_staff)):
+        return HttpResponse(status=401)
+    return HttpResponse(
+        metrics_registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+@staff_member_required
+def profile_report(request, report_id, extension): # pylint: disable=W0613
+    """Download a report written by ProfilingMiddleware: ``txt`` or raw ``prof``."""
+    path = report_path(report_id, extension)
+    if path is None:
+        raise Http404("Profile report not found.")
+    if extension == "txt":
+        return FileResponse(path.open("rb"), content_type="text/plain; charset=utf-8")
+    return FileResponse(path.open("rb"), as_attachment=True, filename=path.name)